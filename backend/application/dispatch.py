@@ -1,11 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from django.conf import settings
 from django.db import connection
 from django.core.cache import cache
+from dvadmin.utils.cache_util import LocalVersionedCache, get_cache_version, bump_cache_version, \
+    VERSIONED_CACHE_TIMEOUT
 from dvadmin.utils.validator import CustomValidationError
 
-dispatch_db_type = getattr(settings, 'DISPATCH_DB_TYPE', 'memory')  # redis
+# 字典/系统配置采用两级缓存:
+# (1)共享缓存(django cache, 生产环境建议配置redis)按key分别存放, 读取单个key时不需要反序列化全部数据
+# (2)进程内缓存, 以共享缓存中的版本号判断是否失效, 写入后递增版本号, 各进程在下次读取时重新加载
+DICTIONARY_CACHE_NAMESPACE = "dispatch_dictionary"
+SYSTEM_CONFIG_CACHE_NAMESPACE = "dispatch_system_config"
+_local_caches = {}
+_MISSING = object()
 
 
 def is_tenants_mode():
@@ -19,24 +26,61 @@ def is_tenants_mode():
 # ================================================= #
 # ******************** 初始化 ******************** #
 # ================================================= #
+def _build_dictionary(rows, dictionary_ids=None):
+    """
+    将字典行数据组装为 {字典编号: {id, value, children}} 结构
+    :param rows: 字典行数据(已按排序)
+    :param dictionary_ids: 只组装指定id的字典, 不传则组装全部
+    :return:
+    """
+    children_map = {}
+    for row in rows:
+        if row.get("parent_id") is not None:
+            children_map.setdefault(row.get("parent_id"), []).append({
+                "label": row.get("label"),
+                "value": row.get("value"),
+                "type": row.get("type"),
+                "color": row.get("color"),
+            })
+    data = {}
+    for row in rows:
+        if row.get("is_value"):
+            continue
+        if dictionary_ids is not None and row.get("id") not in dictionary_ids:
+            continue
+        data[row.get("value")] = {
+            "id": row.get("id"),
+            "value": row.get("value"),
+            "children": children_map.get(row.get("id"), []),
+        }
+    return data
+
+
 def _get_all_dictionary():
+    """
+    一次查询加载全部启用的字典
+    """
     from dvadmin.system.models import Dictionary
 
-    queryset = Dictionary.objects.filter(status=True, is_value=False)
-    data = []
-    for instance in queryset:
-        data.append(
-            {
-                "id": instance.id,
-                "value": instance.value,
-                "children": list(
-                    Dictionary.objects.filter(parent=instance.id)
-                    .filter(status=1)
-                    .values("label", "value", "type", "color")
-                ),
-            }
-        )
-    return {ele.get("value"): ele for ele in data}
+    rows = Dictionary.objects.filter(status=True).values(
+        "id", "parent_id", "label", "value", "type", "color", "is_value"
+    )
+    return _build_dictionary(list(rows))
+
+
+def _get_dictionary(dictionary_ids):
+    """
+    一次查询加载指定id的字典及其子级
+    :param dictionary_ids: 字典id列表
+    :return:
+    """
+    from django.db.models import Q
+    from dvadmin.system.models import Dictionary
+
+    rows = Dictionary.objects.filter(status=True).filter(
+        Q(id__in=dictionary_ids) | Q(parent_id__in=dictionary_ids)
+    ).values("id", "parent_id", "label", "value", "type", "color", "is_value")
+    return _build_dictionary(list(rows), set(dictionary_ids))
 
 
 def _get_all_system_config():
@@ -66,23 +110,150 @@ def _get_all_system_config():
     return data
 
 
+def _get_schema_name(schema_name=None):
+    """
+    获取当前的租户schema_name, 非租户模式统一为public
+    :param schema_name: 指定的租户schema_name值
+    :return:
+    """
+    if schema_name:
+        return schema_name
+    if is_tenants_mode():
+        return connection.tenant.schema_name
+    return "public"
+
+
+def _get_namespace(namespace, schema_name=None):
+    """
+    获取租户对应的缓存命名空间, 各租户的版本号互相独立
+    :param namespace: 缓存命名空间
+    :param schema_name: 租户schema_name值
+    :return:
+    """
+    return f"{namespace}:{_get_schema_name(schema_name)}"
+
+
+def _get_local_cache(namespace):
+    local_cache = _local_caches.get(namespace)
+    if local_cache is None:
+        local_cache = _local_caches.setdefault(namespace, LocalVersionedCache(namespace))
+    return local_cache
+
+
+def _write_all_to_cache(namespace, version, data):
+    """
+    将全部数据按key分别写入共享缓存
+    :param namespace: 租户缓存命名空间
+    :param version: 缓存版本号
+    :param data: 全部数据
+    :return:
+    """
+    prefix = f"{namespace}:{version}"
+    cache.set_many({f"{prefix}:item:{key}": value for key, value in data.items()}, VERSIONED_CACHE_TIMEOUT)
+    cache.set(f"{prefix}:all", data, VERSIONED_CACHE_TIMEOUT)
+
+
+def _load_all_to_cache(namespace, schema_name, version):
+    """
+    从数据库加载全部数据, 按key分别写入共享缓存
+    :param namespace: 缓存命名空间
+    :param schema_name: 租户schema_name值
+    :param version: 缓存版本号
+    :return:
+    """
+    loader = _get_all_dictionary if namespace == DICTIONARY_CACHE_NAMESPACE else _get_all_system_config
+    if is_tenants_mode() and schema_name != connection.tenant.schema_name:
+        from django_tenants.utils import schema_context
+
+        with schema_context(schema_name):
+            data = loader()
+    else:
+        data = loader()
+    _write_all_to_cache(_get_namespace(namespace, schema_name), version, data)
+    return data
+
+
+def _get_all_cached(namespace, schema_name=None):
+    """
+    获取全部数据(进程内缓存 -> 共享缓存 -> 数据库)
+    :param namespace: 缓存命名空间
+    :param schema_name: 租户schema_name值
+    :return:
+    """
+    schema_name = _get_schema_name(schema_name)
+    schema_namespace = _get_namespace(namespace, schema_name)
+    version = get_cache_version(schema_namespace)
+
+    def loader():
+        data = cache.get(f"{schema_namespace}:{version}:all")
+        if data is None:
+            data = _load_all_to_cache(namespace, schema_name, version)
+        return data
+
+    return _get_local_cache(schema_namespace).get("all", loader, version=version)
+
+
+def _get_cached_value(namespace, key, schema_name=None):
+    """
+    获取单个key的数据(进程内缓存 -> 共享缓存 -> 数据库)
+    :param namespace: 缓存命名空间
+    :param key: 数据key值
+    :param schema_name: 租户schema_name值
+    :return:
+    """
+    schema_name = _get_schema_name(schema_name)
+    schema_namespace = _get_namespace(namespace, schema_name)
+    version = get_cache_version(schema_namespace)
+
+    def loader():
+        value = cache.get(f"{schema_namespace}:{version}:item:{key}", _MISSING)
+        if value is not _MISSING:
+            return value
+        data = cache.get(f"{schema_namespace}:{version}:all")
+        if data is None:
+            data = _load_all_to_cache(namespace, schema_name, version)
+        return data.get(key)
+
+    return _get_local_cache(schema_namespace).get(("item", key), loader, version=version)
+
+
+def _refresh_cache(namespace):
+    """
+    递增版本号, 所有进程在下次读取时重新加载, 租户模式下刷新所有租户
+    :param namespace: 缓存命名空间
+    :return:
+    """
+    if is_tenants_mode():
+        from django_tenants.utils import get_tenant_model
+
+        for tenant in get_tenant_model().objects.filter():
+            bump_cache_version(_get_namespace(namespace, tenant.schema_name))
+    else:
+        bump_cache_version(_get_namespace(namespace))
+
+
+def _init_cache(namespace):
+    """
+    预热缓存, 租户模式下预热所有租户
+    :param namespace: 缓存命名空间
+    :return:
+    """
+    if is_tenants_mode():
+        from django_tenants.utils import get_tenant_model
+
+        for tenant in get_tenant_model().objects.filter():
+            _get_all_cached(namespace, tenant.schema_name)
+    else:
+        _get_all_cached(namespace)
+
+
 def init_dictionary():
     """
     初始化字典配置
     :return:
     """
     try:
-        if dispatch_db_type == 'redis':
-            cache.set(f"init_dictionary", _get_all_dictionary())
-            return
-        if is_tenants_mode():
-            from django_tenants.utils import tenant_context, get_tenant_model
-
-            for tenant in get_tenant_model().objects.filter():
-                with tenant_context(tenant):
-                    settings.DICTIONARY_CONFIG[connection.tenant.schema_name] = _get_all_dictionary()
-        else:
-            settings.DICTIONARY_CONFIG = _get_all_dictionary()
+        _init_cache(DICTIONARY_CACHE_NAMESPACE)
     except Exception as e:
         print("请先进行数据库迁移!")
     return
@@ -95,56 +266,43 @@ def init_system_config():
     :return:
     """
     try:
-        if dispatch_db_type == 'redis':
-            cache.set(f"init_system_config", _get_all_system_config())
-            return
-        if is_tenants_mode():
-            from django_tenants.utils import tenant_context, get_tenant_model
-
-            for tenant in get_tenant_model().objects.filter():
-                with tenant_context(tenant):
-                    settings.SYSTEM_CONFIG[connection.tenant.schema_name] = _get_all_system_config()
-        else:
-            settings.SYSTEM_CONFIG = _get_all_system_config()
+        _init_cache(SYSTEM_CONFIG_CACHE_NAMESPACE)
     except Exception as e:
         print("请先进行数据库迁移!")
     return
 
 
-def refresh_dictionary():
+def refresh_dictionary(dictionary_ids=None):
     """
     刷新字典配置
+    :param dictionary_ids: 有变更的字典id列表, 传入时只重新加载这些字典, 不传则全部重新加载
     :return:
     """
-    if dispatch_db_type == 'redis':
-        cache.set(f"init_dictionary", _get_all_dictionary())
+    dictionary_ids = [ele for ele in dictionary_ids or [] if ele is not None]
+    if not dictionary_ids:
+        _refresh_cache(DICTIONARY_CACHE_NAMESPACE)
         return
-    if is_tenants_mode():
-        from django_tenants.utils import tenant_context, get_tenant_model
-
-        for tenant in get_tenant_model().objects.filter():
-            with tenant_context(tenant):
-                settings.DICTIONARY_CONFIG[connection.tenant.schema_name] = _get_all_dictionary()
-    else:
-        settings.DICTIONARY_CONFIG = _get_all_dictionary()
+    namespace = _get_namespace(DICTIONARY_CACHE_NAMESPACE)
+    version = get_cache_version(namespace)
+    dictionary_config = cache.get(f"{namespace}:{version}:all")
+    if dictionary_config is None:
+        bump_cache_version(namespace)
+        return
+    data = {key: value for key, value in dictionary_config.items() if value.get("id") not in dictionary_ids}
+    data.update(_get_dictionary(dictionary_ids))
+    new_version = bump_cache_version(namespace)
+    # 期间有其他进程刷新时不写入, 由读取时从数据库重新加载
+    if new_version == version + 1:
+        _write_all_to_cache(namespace, new_version, data)
 
 
 def refresh_system_config():
     """
     刷新系统配置
+    递增版本号, 所有进程在下次读取时重新加载
     :return:
     """
-    if dispatch_db_type == 'redis':
-        cache.set(f"init_system_config", _get_all_system_config())
-        return
-    if is_tenants_mode():
-        from django_tenants.utils import tenant_context, get_tenant_model
-
-        for tenant in get_tenant_model().objects.filter():
-            with tenant_context(tenant):
-                settings.SYSTEM_CONFIG[connection.tenant.schema_name] = _get_all_system_config()
-    else:
-        settings.SYSTEM_CONFIG = _get_all_system_config()
+    _refresh_cache(SYSTEM_CONFIG_CACHE_NAMESPACE)
 
 
 # ================================================= #
@@ -156,18 +314,7 @@ def get_dictionary_config(schema_name=None):
     :param schema_name: 对应字典配置的租户schema_name值
     :return:
     """
-    if dispatch_db_type == 'redis':
-        init_dictionary_data = cache.get(f"init_dictionary")
-        if not init_dictionary_data:
-            refresh_dictionary()
-        return cache.get(f"init_dictionary") or {}
-    if not settings.DICTIONARY_CONFIG:
-        refresh_dictionary()
-    if is_tenants_mode():
-        dictionary_config = settings.DICTIONARY_CONFIG[schema_name or connection.tenant.schema_name]
-    else:
-        dictionary_config = settings.DICTIONARY_CONFIG
-    return dictionary_config or {}
+    return _get_all_cached(DICTIONARY_CACHE_NAMESPACE, schema_name) or {}
 
 
 def get_dictionary_values(key, schema_name=None):
@@ -177,14 +324,7 @@ def get_dictionary_values(key, schema_name=None):
     :param schema_name: 对应字典配置的租户schema_name值
     :return:
     """
-    if dispatch_db_type == 'redis':
-        dictionary_config = cache.get(f"init_dictionary")
-        if not dictionary_config:
-            refresh_dictionary()
-            dictionary_config = cache.get(f"init_dictionary")
-        return dictionary_config.get(key)
-    dictionary_config = get_dictionary_config(schema_name)
-    return dictionary_config.get(key)
+    return _get_cached_value(DICTIONARY_CACHE_NAMESPACE, key, schema_name)
 
 
 def get_dictionary_label(key, name, schema_name=None):
@@ -213,18 +353,7 @@ def get_system_config(schema_name=None):
     :param schema_name: 对应字典配置的租户schema_name值
     :return:
     """
-    if dispatch_db_type == 'redis':
-        init_dictionary_data = cache.get(f"init_system_config")
-        if not init_dictionary_data:
-            refresh_system_config()
-        return cache.get(f"init_system_config") or {}
-    if not settings.SYSTEM_CONFIG:
-        refresh_system_config()
-    if is_tenants_mode():
-        dictionary_config = settings.SYSTEM_CONFIG[schema_name or connection.tenant.schema_name]
-    else:
-        dictionary_config = settings.SYSTEM_CONFIG
-    return dictionary_config or {}
+    return _get_all_cached(SYSTEM_CONFIG_CACHE_NAMESPACE, schema_name) or {}
 
 
 def get_system_config_values(key, schema_name=None):
@@ -234,14 +363,7 @@ def get_system_config_values(key, schema_name=None):
     :param schema_name: 对应系统配置的租户schema_name值
     :return:
     """
-    if dispatch_db_type == 'redis':
-        system_config = cache.get(f"init_system_config")
-        if not system_config:
-            refresh_system_config()
-            system_config = cache.get(f"init_system_config")
-        return system_config.get(key)
-    system_config = get_system_config(schema_name)
-    return system_config.get(key)
+    return _get_cached_value(SYSTEM_CONFIG_CACHE_NAMESPACE, key, schema_name)
 
 
 def get_system_config_values_to_dict(key, schema_name=None):
@@ -76,6 +76,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "dvadmin.utils.middleware.ApiLoggingMiddleware",
+    "dvadmin.utils.middleware.QueryInstrumentMiddleware",
 ]
 
 ROOT_URLCONF = "application.urls"
@@ -373,6 +374,17 @@ DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 API_LOG_ENABLE = True
 # API_LOG_METHODS = 'ALL' # ['POST', 'DELETE']
 API_LOG_METHODS = ["POST", "UPDATE", "DELETE", "PUT"]  # ['POST', 'DELETE']
+API_LOG_ASYNC = True  # 操作日志由后台线程批量写入
+API_LOG_QUEUE_SIZE = 10000  # 操作日志队列最大长度
+API_LOG_BATCH_SIZE = 100  # 操作日志每批写入条数
+API_LOG_FLUSH_INTERVAL = 2  # 操作日志最长写入间隔(秒)
+API_LOG_OVERFLOW_POLICY = "drop"  # 队列满时的处理策略: drop(丢弃) / block(阻塞等待) / sync(直接写入)
+API_LOG_STATS_INTERVAL = 300  # 操作日志写入器定期记录运行状态的间隔(秒), 0为不记录
+USER_AGENT_CACHE_SIZE = 1024  # User-Agent解析结果缓存条数
+QUERY_INSTRUMENT_ENABLE = DEBUG  # 统计每个请求的SQL查询数, 响应头返回统计结果
+QUERY_BUDGET_STRICT = False  # 查询数超出视图集的query_budget时直接报错(用于测试)
+PAGINATION_COUNT_MODE = "cached"  # 游标分页的总数统计方式: exact / cached / estimate
+PAGINATION_COUNT_CACHE_TIMEOUT = 60  # 游标分页总数缓存时间(秒)
 API_MODEL_MAP = {
     "/token/": "登录模块",
     "/api/login/": "登录模块",
@@ -381,6 +393,13 @@ API_MODEL_MAP = {
 
 DJANGO_CELERY_BEAT_TZ_AWARE = False
 CELERY_TIMEZONE = "Asia/Shanghai"  # celery 时区问题
+RESUME_INGEST_MAX_RETRIES = 2  # 简历入库每个阶段的最大重试次数
+RESUME_INGEST_RETRY_DELAY = 10  # 简历入库阶段重试间隔(秒)
+RESUME_BATCH_MAX_FILES = 500  # 批量上传简历的最大文件数
+RESUME_BATCH_MAX_FILE_SIZE = 20 * 1024 * 1024  # 批量上传简历时单个文件(含压缩包内文件解压后)的最大字节数
+RESUME_BATCH_MAX_TOTAL_SIZE = 500 * 1024 * 1024  # 批量上传简历解压后的最大总字节数
+RESUME_EXTRACT_RETRY_DELAY = 2  # 批量提取简历信息首次重试间隔(秒), 之后按指数退避
+RESUME_PARSER_WARMUP = False  # celery worker启动时预加载PDF解析模型
 # 静态页面压缩
 STATICFILES_STORAGE = "whitenoise.storage.CompressedStaticFilesStorage"
 
@@ -391,10 +410,6 @@ INITIALIZE_LIST = []
 INITIALIZE_RESET_LIST = []
 # 表前缀
 TABLE_PREFIX = locals().get('TABLE_PREFIX', "")
-# 系统配置
-SYSTEM_CONFIG = {}
-# 字典配置
-DICTIONARY_CONFIG = {}
 
 # ================================================= #
 # ******************** 插件配置 ******************** #
@@ -1,10 +1,14 @@
+import asyncio
+import hashlib
 import os
 import json
 import threading
+import weakref
 import concurrent.futures
 from typing import List, Dict, Any
 import requests
 import re  # 添加 re 模块的导入
+import time
 from tqdm import tqdm
 from tenacity import retry, stop_after_attempt, wait_exponential
 import os
@@ -18,6 +22,83 @@ DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "")
 DEEPSEEK_API_BASE = os.getenv("DEEPSEEK_API_BASE", "")
 DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "")
 DEEPSEEK_MAX_WORKERS = int(os.getenv("DEEPSEEK_MAX_WORKERS", "2"))
+# 每分钟最多请求次数, 0 表示不限制
+DEEPSEEK_RATE_LIMIT = int(os.getenv("DEEPSEEK_RATE_LIMIT", "0"))
+# 建立连接、读取响应的超时时间(秒), 流式响应时为相邻两段内容的最大间隔
+DEEPSEEK_CONNECT_TIMEOUT = float(os.getenv("DEEPSEEK_CONNECT_TIMEOUT", "5"))
+DEEPSEEK_TIMEOUT = float(os.getenv("DEEPSEEK_TIMEOUT", "120"))
+
+
+class RateLimiter:
+    """请求速率限制, 相邻两次请求的间隔不小于 60/rate_per_minute 秒"""
+
+    def __init__(self, rate_per_minute: int = 0):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """等待直到可以发送下一次请求"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+# 进程内同时进行的请求数不超过 DEEPSEEK_MAX_WORKERS
+_request_slots = threading.BoundedSemaphore(DEEPSEEK_MAX_WORKERS)
+_rate_limiter = RateLimiter(DEEPSEEK_RATE_LIMIT)
+# 异步客户端的连接绑定在事件循环上, 按事件循环区分, 事件循环被回收后自动移除
+_async_clients = weakref.WeakKeyDictionary()
+_async_clients_lock = threading.Lock()
+# 等待事件循环关闭的任务, 需保持引用避免被回收
+_close_tasks = set()
+
+
+async def _close_on_loop_shutdown(client):
+    """挂起直到事件循环关闭时被取消(asyncio.run/asgiref退出时会取消剩余任务), 随后关闭客户端的连接池"""
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await client.close()
+
+
+def get_async_client(api_key: str, api_base: str):
+    """获取当前事件循环共享的异步客户端, 内部维护连接池
+
+    客户端在事件循环关闭时关闭, 事件循环被回收后从缓存中移除。
+
+    Args:
+        api_key: API密钥
+        api_base: API基础URL
+
+    Returns:
+        AsyncOpenAI 客户端
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    loop = asyncio.get_running_loop()
+    key = (api_key, api_base)
+    with _async_clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=api_base,
+                timeout=httpx.Timeout(DEEPSEEK_TIMEOUT, connect=DEEPSEEK_CONNECT_TIMEOUT),
+                max_retries=2,
+            )
+            clients[key] = client
+            task = loop.create_task(_close_on_loop_shutdown(client))
+            _close_tasks.add(task)
+            task.add_done_callback(_close_tasks.discard)
+    return client
 
 class DeepSeekChat:
     def __init__(self, api_key: str = None, api_base: str = None, model: str = None):
@@ -34,6 +115,8 @@ class DeepSeekChat:
         
         self.api_base = api_base or DEEPSEEK_API_BASE
         self.model = model or DEEPSEEK_MODEL
+        # 复用连接
+        self.session = requests.Session()
         
     def chat_mock(self, prompt: str, temperature: float = 0.7, debug: bool = False) -> str:
         renturn = """
@@ -108,17 +191,42 @@ class DeepSeekChat:
             print(f"发送请求: {prompt[:100]}...")
             
         try:
-            response = requests.post(
-                f"{self.api_base}/chat/completions",
-                headers=headers,
-                json=data
-            )
+            with _request_slots:
+                _rate_limiter.acquire()
+                response = self.session.post(
+                    f"{self.api_base}/chat/completions",
+                    headers=headers,
+                    json=data,
+                    timeout=(DEEPSEEK_CONNECT_TIMEOUT, DEEPSEEK_TIMEOUT)
+                )
             response.raise_for_status()
             return response.json()["choices"][0]["message"]["content"]
         except Exception as e:
             print(f"API 调用失败: {str(e)}")
             raise
     
+    async def achat_stream(self, prompt: str, temperature: float = 0.7):
+        """流式发送聊天请求, 逐段返回生成的内容
+
+        Args:
+            prompt: 提示文本
+            temperature: 温度参数，控制响应的随机性
+
+        Yields:
+            新生成的文本片段
+        """
+        await asyncio.to_thread(_rate_limiter.acquire)
+        client = get_async_client(self.api_key, self.api_base)
+        stream = await client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
     @staticmethod
     def build_qa_prompt(prompt_tmpl: str, text: str) -> str:
         """构建QA提示
@@ -144,9 +252,7 @@ class DeepSeekChat:
 chat = DeepSeekChat()
 
 
-def chatToLLM(message):
-    # 调用chat获取回复
-    PROMPT_TMPL = """请根据用户的问题判断是否需要查询简历数据库。你的任务是根据问题内容决定是否需要查询数据库，并给出查询条件。
+SEARCH_PROMPT_TMPL = """请根据用户的问题判断是否需要查询简历数据库。你的任务是根据问题内容决定是否需要查询数据库，并给出查询条件。
 
     判断规则：
     1. 如果问题涉及具体求职者的信息（如姓名、技能、工作经验等），则需要查询
@@ -172,8 +278,109 @@ def chatToLLM(message):
     }
     当前用户问题：{{question}}"""
 
+
+def build_search_prompt(message):
+    """构建判断是否需要查询简历库的提示词"""
+    return SEARCH_PROMPT_TMPL.replace('{{question}}', message)
+
+
+class StreamingJsonField:
+    """从流式输出的JSON文本中增量解码指定字符串字段的内容"""
+
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, field):
+        self.pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self.pos = None
+        self.done = False
+
+    def feed(self, text):
+        """
+        Args:
+            text: 截至目前收到的全部文本
+
+        Returns:
+            本次新解码出的字段内容
+        """
+        if self.done:
+            return ""
+        if self.pos is None:
+            match = self.pattern.search(text)
+            if not match:
+                return ""
+            self.pos = match.end()
+        decoded = []
+        pos = self.pos
+        while pos < len(text):
+            char = text[pos]
+            if char == '"':
+                self.done = True
+                pos += 1
+                break
+            if char == '\\':
+                if pos + 1 >= len(text):
+                    break
+                escape = text[pos + 1]
+                if escape == 'u':
+                    if pos + 6 > len(text):
+                        break
+                    try:
+                        decoded.append(chr(int(text[pos + 2:pos + 6], 16)))
+                    except ValueError:
+                        pass
+                    pos += 6
+                    continue
+                decoded.append(self._ESCAPES.get(escape, escape))
+                pos += 2
+                continue
+            decoded.append(char)
+            pos += 1
+        self.pos = pos
+        return "".join(decoded)
+
+
+def find_json_object(text, field):
+    """在未完整的JSON文本中查找指定字段的对象值, 对象已完整时返回解析结果, 否则返回None"""
+    match = re.search(r'"%s"\s*:\s*\{' % re.escape(field), text)
+    if not match:
+        return None
+    start = match.end() - 1
+    depth = 0
+    in_string = False
+    escaped = False
+    for pos in range(start, len(text)):
+        char = text[pos]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                try:
+                    return json.loads(text[start:pos + 1])
+                except json.JSONDecodeError:
+                    return None
+    return None
+
+
+async def chatToLLMStream(message):
+    """流式判断是否需要查询简历库, 逐段返回大模型输出的JSON文本"""
+    async for delta in chat.achat_stream(build_search_prompt(message)):
+        yield delta
+
+
+def chatToLLM(message):
+    # 调用chat获取回复
     # 使用时替换question变量
-    prompt = PROMPT_TMPL.replace('{{question}}', message)
+    prompt = build_search_prompt(message)
     # 调用chat方法
     print("提示词：", prompt)
     response = chat.chat(prompt)  # 调用chat方法
@@ -192,11 +399,8 @@ def chatToLLM(message):
     print("回复：", response)
     return response
 
-def chatToLLM4Analysis(document, job_description):
-    # 让大模型提取简历关键信息，获得标准格式的json以及评分
-    document = document.strip()
-
-
+def build_analysis_prompt_template(job_description):
+    """构建简历分析的提示模板, 简历内容以 {{document}} 占位"""
     # 构建提示模板，可以加入岗位要求
     PROMPT_TMPL = "你是一个专业的招聘经理，请从以下一份中文简历中提取结构化的关键信息"
     
@@ -231,12 +435,27 @@ def chatToLLM4Analysis(document, job_description):
        "```\n" + \
        "简历内容：{{document}}" + \
        "请确保输出的JSON格式正确，并且所有字段都有值。"
+    if job_description:
+        PROMPT_TMPL = PROMPT_TMPL.replace('{{job_description}}', job_description)
+    return PROMPT_TMPL
+
+
+def get_analysis_version(job_description):
+    """简历分析结果的版本号, 由模型和提示模板(含岗位要求)决定, 用于缓存分析结果
+
+    Returns:
+        SHA-256 十六进制字符串
+    """
+    return hashlib.sha256(f"{DEEPSEEK_MODEL}\0{build_analysis_prompt_template(job_description)}".encode("utf-8")).hexdigest()
+
+
+def chatToLLM4Analysis(document, job_description):
+    # 让大模型提取简历关键信息，获得标准格式的json以及评分
+    document = document.strip()
 
     # 构建提示词
-    prompt = PROMPT_TMPL.replace('{{document}}', document)
-    if job_description:
-        prompt = prompt.replace('{{job_description}}', job_description)
-    
+    prompt = build_analysis_prompt_template(job_description).replace('{{document}}', document)
+
     print("提示词：", prompt)
     # 调用chat获取分析结果
     analysis = chat.chat(prompt)  # 调用chat方法
@@ -6,7 +6,10 @@ import traceback
 from docx import Document
 
 # 本地模块导入
-from .pdftomarkdown import MarkdownConverter
+from .pdftomarkdown import get_converter_pool
+
+# 解析逻辑变化时修改, 使已缓存的解析结果失效
+DOCUMENT_PARSER_VERSION = "1"
 
 def parse_docx(file_path):
     """解析docx文件并返回结构化数据"""
@@ -39,11 +42,8 @@ def parse_pdf(file_path):
     """解析PDF文件并返回结构化数据"""
     try:
         # 使用绝对路径并添加错误处理
-        # 初始化PDF转Markdown转换器 
-        converter = MarkdownConverter()
-        result = converter.convert(os.path.abspath(file_path))
-        converter.clear_gpu_memory()  # 清除GPU内存
-        return result
+        # 使用进程内常驻的转换器, 模型只加载一次
+        return get_converter_pool().convert(os.path.abspath(file_path))
     except Exception as e:
         print(f"PDF解析错误: {str(e)}")
         return ""
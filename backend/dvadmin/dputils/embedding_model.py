@@ -1,4 +1,6 @@
 import os
+import queue
+import threading
 import time
 from typing import List, Dict
 from langchain_community.embeddings import SentenceTransformerEmbeddings
@@ -9,17 +11,187 @@ from sklearn.metrics.pairwise import cosine_similarity
 from loguru import logger
 from dotenv import load_dotenv  # 环境变量管理
 
+# 模型加载失败后的重试间隔(秒), 连续失败时按指数退避, 最长不超过 EMBEDDING_LOAD_RETRY_MAX
+EMBEDDING_LOAD_RETRY_DELAY = float(os.getenv('EMBEDDING_LOAD_RETRY_DELAY', 30))
+EMBEDDING_LOAD_RETRY_MAX = float(os.getenv('EMBEDDING_LOAD_RETRY_MAX', 600))
+# 进程内共享的模型服务, 按模型路径区分
+_embedding_services = {}
+_embedding_services_lock = threading.Lock()
+
+
+class _EncodeRequest:
+    """一次编码请求, 由批处理线程填充结果"""
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.result = None
+        self.error = None
+        self.event = threading.Event()
+
+
+class EmbeddingService:
+    """进程内共享的向量化服务
+
+    (1)模型在第一次使用时加载, 整个进程只加载一次; 加载失败后在退避时间内不再重试
+    (2)并发的编码请求进入队列, 由后台线程合并为一次 model.encode 调用
+    (3)返回 numpy float32 数组, 不做 tolist 转换
+    """
+
+    def __init__(self, model_path: str, batch_size: int = 32, max_wait: float = 0.01):
+        """初始化
+
+        Args:
+            model_path: 本地模型路径
+            batch_size: 单次合并编码的最大文本数
+            max_wait: 等待合并请求的最长时间(秒)
+        """
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._load_failures = 0
+        self._next_load_time = 0.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._thread_lock = threading.Lock()
+
+    @property
+    def model(self):
+        """懒加载模型, 加载失败返回None, 退避时间内直接返回None"""
+        if self._model is None and time.monotonic() >= self._next_load_time:
+            with self._model_lock:
+                if self._model is None and time.monotonic() >= self._next_load_time:
+                    self._model = self._load_model()
+                    if self._model is None:
+                        self._load_failures += 1
+                        delay = min(EMBEDDING_LOAD_RETRY_DELAY * 2 ** (self._load_failures - 1),
+                                    EMBEDDING_LOAD_RETRY_MAX)
+                        self._next_load_time = time.monotonic() + delay
+                        logger.warning(f"嵌入模型加载失败{self._load_failures}次, {delay:.0f}秒后重试")
+                    else:
+                        self._load_failures = 0
+        return self._model
+
+    def _load_model(self):
+        try:
+            if self.model_path and os.path.exists(self.model_path):
+                logger.info(f"从本地路径加载模型: {self.model_path}")
+                model = SentenceTransformer(self.model_path)
+            else:
+                logger.error(f"未找到本地模型路径: {self.model_path}")
+                return None
+            logger.info(f"成功加载模型: {self.model_path}")
+            return model
+        except Exception as e:
+            logger.error(f"模型加载失败: {e}")
+            return None
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+            self._thread.start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """编码文本, 并发调用会被合并为批量编码
+
+        Args:
+            texts: 待编码的文本列表
+
+        Returns:
+            形状为 (len(texts), dims) 的 float32 数组
+        """
+        if self.model is None:
+            raise RuntimeError(f"嵌入模型未加载: {self.model_path}")
+        request = _EncodeRequest(list(texts))
+        self._ensure_started()
+        self._queue.put(request)
+        request.event.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self):
+        while True:
+            requests = [self._queue.get()]
+            count = len(requests[0].texts)
+            deadline = time.monotonic() + self.max_wait
+            while count < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                count += len(request.texts)
+            self._encode_batch(requests)
+
+    def _encode_batch(self, requests: List[_EncodeRequest]):
+        texts = [text for request in requests for text in request.texts]
+        try:
+            embeddings = self.model.encode(
+                texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False
+            ).astype(np.float32, copy=False)
+            offset = 0
+            for request in requests:
+                request.result = embeddings[offset:offset + len(request.texts)]
+                offset += len(request.texts)
+        except Exception as e:
+            for request in requests:
+                request.error = e
+        finally:
+            for request in requests:
+                request.event.set()
+
+
+def get_embedding_service(model_path: str = None) -> EmbeddingService:
+    """获取进程内共享的向量化服务
+
+    Args:
+        model_path: 本地模型路径, 默认读取环境变量 LOCAL_MODEL_PATH
+
+    Returns:
+        EmbeddingService 实例
+    """
+    load_dotenv()
+    model_path = model_path or os.getenv('LOCAL_MODEL_PATH')
+    service = _embedding_services.get(model_path)
+    if service is None:
+        with _embedding_services_lock:
+            service = _embedding_services.get(model_path)
+            if service is None:
+                service = EmbeddingService(
+                    model_path,
+                    batch_size=int(os.getenv('EMBEDDING_BATCH_SIZE', 32)),
+                    max_wait=float(os.getenv('EMBEDDING_MAX_WAIT_MS', 10)) / 1000,
+                )
+                _embedding_services[model_path] = service
+    return service
+
+
 class EmbeddingModel:
-    """文本嵌入模型类"""
-    def __init__(self):
+    """文本嵌入模型类, 模型由进程内共享的 EmbeddingService 管理, 创建实例不会重复加载模型"""
+    def __init__(self, local_model_path: str = None):
         """初始化"""
         self.setup_environment()
-        self.model = None
         self.embeddings = None
         self.similarity_matrix = None
-        LOCAL_MODEL_PATH = os.getenv('LOCAL_MODEL_PATH')
-        self.model = self.load_embedding_model(local_model_path=LOCAL_MODEL_PATH)
-    
+        self.service = get_embedding_service(local_model_path)
+
+    @property
+    def model(self):
+        return self.service.model
+
     def setup_environment(self):
         """设置环境变量和代理"""
         load_dotenv()
@@ -33,30 +205,6 @@ class EmbeddingModel:
             os.environ['HTTPS_PROXY'] = https_proxy
         
         logger.info("环境设置完成")
-        
-
-    def load_embedding_model(self, model_name: str = "BAAI/bge-large-zh-v1.5", local_model_path=None):
-        """加载文本嵌入模型
-        
-        Args:
-            model_name: 模型名称
-            local_model_path: 本地模型路径，用于离线加载
-            
-        Returns:
-            加载的模型对象，加载失败则返回None
-        """
-        try:
-            if local_model_path and os.path.exists(local_model_path):
-                logger.info(f"从本地路径加载模型: {local_model_path}")
-                model = SentenceTransformer(local_model_path)
-            else:
-                logger.error(f"未找到本地模型路径: {local_model_path}")
-                return None
-            logger.info(f"成功加载模型: {local_model_path}")
-            return model
-        except Exception as e:
-            logger.error(f"模型加载失败: {e}")
-            return None
 
     def calculate_embeddings(self, sentences):
         """计算文本的嵌入向量
@@ -71,54 +219,56 @@ class EmbeddingModel:
             return None
         
         try:
-            embeddings = self.model.encode(sentences)
+            embeddings = self.service.encode(sentences)
             logger.info(f"嵌入向量计算完成，形状: {embeddings.shape}")
             return embeddings
         except Exception as e:
             logger.error(f"嵌入向量计算失败: {e}")
             return None
     
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """将文档列表转换为嵌入向量列表
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """将文档列表转换为嵌入向量
         
         Args:
             texts: 文档文本列表
             
         Returns:
-            嵌入向量列表
+            形状为 (len(texts), dims) 的 float32 数组, texts 为空时返回空数组
+
+        Raises:
+            RuntimeError: 模型未加载
+            Exception: 编码失败
         """
         if not texts:
-            return []
+            return np.empty((0, 0), dtype=np.float32)
         
         try:
-            embeddings = self.model.encode(texts)
-            # 将numpy数组转换为Python列表
-            return embeddings.tolist()
+            return self.service.encode(texts)
         except Exception as e:
             logger.error(f"文档嵌入向量计算失败: {e}")
-            # 出错时返回空列表
-            return []
+            raise
     
-    def embed_query(self, text: str) -> List[float]:
+    def embed_query(self, text: str) -> np.ndarray:
         """将查询文本转换为嵌入向量
         
         Args:
             text: 查询文本
             
         Returns:
-            嵌入向量
+            float32 嵌入向量, text 为空时返回空数组
+
+        Raises:
+            RuntimeError: 模型未加载
+            Exception: 编码失败
         """
         if not text:
-            return []
+            return np.empty(0, dtype=np.float32)
         
         try:
-            embedding = self.model.encode(text)
-            # 将numpy数组转换为Python列表
-            return embedding.tolist()
+            return self.service.encode([text])[0]
         except Exception as e:
             logger.error(f"查询嵌入向量计算失败: {e}")
-            # 出错时返回空列表
-            return []
+            raise
 
 
 def main():
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+from dotenv import load_dotenv
+from elasticsearch import Elasticsearch
+
+from .logger_config import get_logger
+
+logger = get_logger(__name__)
+load_dotenv()
+
+# 请求超时时间(秒)
+ES_REQUEST_TIMEOUT = float(os.getenv("ES_REQUEST_TIMEOUT", 30))
+# 失败重试次数
+ES_MAX_RETRIES = int(os.getenv("ES_MAX_RETRIES", 3))
+# 每个节点的连接池大小
+ES_CONNECTIONS_PER_NODE = int(os.getenv("ES_CONNECTIONS_PER_NODE", 10))
+# 索引存在状态的缓存时间(秒)
+ES_INDEX_EXISTS_TTL = int(os.getenv("ES_INDEX_EXISTS_TTL", 300))
+
+_clients = {}
+_clients_lock = threading.Lock()
+# 异步客户端按事件循环缓存 {loop: {连接参数: 客户端}}, 事件循环被回收后自动移除
+_async_clients = weakref.WeakKeyDictionary()
+# 等待事件循环关闭的任务, 需保持引用避免被回收
+_close_tasks = set()
+# 已确认存在的索引 {(url, index_name): 过期时间}
+_known_indices = {}
+
+
+def _client_options(username, password, verify_certs):
+    return {
+        "basic_auth": (username, password) if username else None,
+        "verify_certs": verify_certs,
+        "request_timeout": ES_REQUEST_TIMEOUT,
+        "max_retries": ES_MAX_RETRIES,
+        "retry_on_timeout": True,
+        "retry_on_status": (429, 502, 503, 504),
+        "connections_per_node": ES_CONNECTIONS_PER_NODE,
+    }
+
+
+def get_es_client(url: str, username: str = "", password: str = "", verify_certs: bool = False) -> Elasticsearch:
+    """获取进程内共享的 Elasticsearch 客户端
+
+    客户端内部维护长连接池, 同一组连接参数在进程内只创建一次。
+
+    Args:
+        url: Elasticsearch 服务器 URL
+        username: 用户名
+        password: 密码
+        verify_certs: 是否校验证书
+
+    Returns:
+        Elasticsearch 客户端
+    """
+    key = (url, username, password, verify_certs, os.getpid())
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = Elasticsearch(url, **_client_options(username, password, verify_certs))
+                _clients[key] = client
+                logger.info(f"成功连接到 Elasticsearch: {url}")
+    return client
+
+
+async def _close_on_loop_shutdown(client):
+    """挂起直到事件循环关闭时被取消(asyncio.run/asgiref退出时会取消剩余任务), 随后关闭客户端的连接池"""
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await client.close()
+
+
+def get_async_es_client(url: str, username: str = "", password: str = "", verify_certs: bool = False):
+    """获取当前事件循环共享的 AsyncElasticsearch 客户端, 用于 ASGI 视图
+
+    异步客户端的连接绑定在事件循环上, 因此按事件循环区分; 客户端在事件循环关闭时关闭。
+
+    Args:
+        url: Elasticsearch 服务器 URL
+        username: 用户名
+        password: 密码
+        verify_certs: 是否校验证书
+
+    Returns:
+        AsyncElasticsearch 客户端
+    """
+    # 依赖 aiohttp, 只在使用时导入
+    from elasticsearch import AsyncElasticsearch
+
+    loop = asyncio.get_running_loop()
+    key = (url, username, password, verify_certs)
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = AsyncElasticsearch(url, **_client_options(username, password, verify_certs))
+            clients[key] = client
+            task = loop.create_task(_close_on_loop_shutdown(client))
+            _close_tasks.add(task)
+            task.add_done_callback(_close_tasks.discard)
+    return client
+
+
+def is_index_known(url: str, index_name: str) -> bool:
+    """索引是否已确认存在(在缓存有效期内)"""
+    expire = _known_indices.get((url, index_name))
+    return expire is not None and expire > time.monotonic()
+
+
+def mark_index_exists(url: str, index_name: str):
+    """记录索引已存在"""
+    _known_indices[(url, index_name)] = time.monotonic() + ES_INDEX_EXISTS_TTL
+
+
+def forget_index(url: str, index_name: str):
+    """清除索引存在状态, 删除索引后调用"""
+    _known_indices.pop((url, index_name), None)
@@ -1,7 +1,9 @@
+import json
 import os
+import queue
+import threading
 from typing import List, Dict, Any, Optional
-from tqdm import tqdm
-from elasticsearch import Elasticsearch
+from elasticsearch import helpers
 from langchain.docstore.document import Document
 from langchain_core.embeddings import Embeddings
 import numpy as np
@@ -11,6 +13,7 @@ import time
 from datetime import datetime
 
 from .embedding_model import EmbeddingModel
+from .es_client import get_es_client, is_index_known, mark_index_exists, forget_index
 from .logger_config import get_logger
 
 # 初始化日志记录器
@@ -22,6 +25,38 @@ ES_USERNAME = os.getenv("ES_USERNAME", "")
 ES_PASSWORD = os.getenv("ES_PASSWORD", "")
 ES_INDEX_NAME = os.getenv("ES_INDEX_NAME", "")
 ES_VERIFY_CERTS = os.getenv("ES_VERIFY_CERTS", "False") == "True"
+# HNSW 索引参数
+ES_HNSW_M = int(os.getenv("ES_HNSW_M", 16))
+ES_HNSW_EF_CONSTRUCTION = int(os.getenv("ES_HNSW_EF_CONSTRUCTION", 100))
+# kNN 检索时每个分片的候选数量 = k * ES_KNN_CANDIDATES_FACTOR
+ES_KNN_CANDIDATES_FACTOR = int(os.getenv("ES_KNN_CANDIDATES_FACTOR", 10))
+# Elasticsearch 允许的 num_candidates 上限
+ES_KNN_MAX_CANDIDATES = 10000
+# 文档数少于该值时使用精确评分(script_score)
+ES_EXACT_SEARCH_THRESHOLD = int(os.getenv("ES_EXACT_SEARCH_THRESHOLD", 10000))
+# 索引信息(向量是否建立HNSW索引/文档数)的缓存时间(秒)
+ES_INDEX_INFO_TTL = int(os.getenv("ES_INDEX_INFO_TTL", 60))
+# 文档数量的缓存时间(秒)
+ES_COUNT_CACHE_TTL = int(os.getenv("ES_COUNT_CACHE_TTL", 30))
+
+# 简历列表返回的字段, 不返回简历原文及向量
+RESUME_LIST_FIELDS = [
+    "metadata.name", "metadata.phone", "metadata.email", "metadata.education", "metadata.work_experience",
+    "metadata.skills", "metadata.projects", "metadata.other", "metadata.score", "metadata.score_details",
+    "metadata.filename", "metadata.upload_time",
+]
+# 简历列表可用的排序字段, 最后以 doc_id 保证排序唯一, 便于 search_after 翻页
+RESUME_SORT_FIELDS = {
+    "score": "metadata.score",
+    "upload_time": "metadata.upload_time",
+    "name": "metadata.name.keyword",
+}
+
+
+# 索引信息缓存 {index_name: (过期时间, info)}
+_index_info_cache = {}
+# 文档数量缓存 {(index_name, query): (过期时间, count)}
+_count_cache = {}
 
 
 class ESVectorDB:
@@ -39,12 +74,30 @@ class ESVectorDB:
             es_url: Elasticsearch 服务器 URL
         """
         try:
-            self.es_client = Elasticsearch(self.ES_URL,basic_auth=(self.ES_USERNAME, self.ES_PASSWORD), verify_certs=self.ES_VERIFY_CERTS)
-            logger.info(f"成功连接到 Elasticsearch: {ES_URL}")
+            # 使用进程内共享的客户端, 复用连接池
+            self.es_client = get_es_client(self.ES_URL, self.ES_USERNAME, self.ES_PASSWORD, self.ES_VERIFY_CERTS)
         except Exception as e:
             logger.error(f"连接 Elasticsearch 失败: {e}")
             self.es_client = None
     
+    @staticmethod
+    def vector_mapping(dims: int) -> Dict[str, Any]:
+        """向量字段映射, 使用 HNSW 索引以支持近似 kNN 检索
+
+        Args:
+            dims: 向量维度
+
+        Returns:
+            dense_vector 字段映射
+        """
+        return {
+            "type": "dense_vector",
+            "dims": dims,
+            "index": True,
+            "similarity": "cosine",
+            "index_options": {"type": "hnsw", "m": ES_HNSW_M, "ef_construction": ES_HNSW_EF_CONSTRUCTION}
+        }
+
     def create_index(self, index_name: str, dims: int = 1024, force_recreate: bool = False):
         """创建向量索引
         
@@ -60,12 +113,17 @@ class ESVectorDB:
             logger.error("Elasticsearch 客户端未初始化")
             return False
             
+        # 缓存有效期内已确认存在的索引不再检查
+        if not force_recreate and is_index_known(self.ES_URL, index_name):
+            return True
+
         # 检查索引是否存在
         index_exists = self.es_client.indices.exists(index=index_name)
         
         # 如果索引存在且需要重建，则删除
         if index_exists and force_recreate:
             self.es_client.indices.delete(index=index_name)
+            forget_index(self.ES_URL, index_name)
             logger.info(f"已删除现有索引: {index_name}")
             index_exists = False
         
@@ -76,7 +134,7 @@ class ESVectorDB:
                 "mappings": {
                     "properties": {
                         "content": {"type": "text"},
-                        "vector": {"type": "dense_vector", "dims": dims},
+                        "vector": self.vector_mapping(dims),
                         "metadata": {"type": "object"}
                     }
                 }
@@ -85,6 +143,7 @@ class ESVectorDB:
             try:
                 # 注意：在 Elasticsearch 8.x 中，body 参数已更改为直接传递映射
                 self.es_client.indices.create(index=index_name, mappings=mapping["mappings"])
+                mark_index_exists(self.ES_URL, index_name)
                 logger.info(f"成功创建索引: {index_name}")
                 return True
             except Exception as e:
@@ -93,19 +152,27 @@ class ESVectorDB:
                     logger.error(f"错误详情: {e.info}")
                 return False
         else:
+            mark_index_exists(self.ES_URL, index_name)
             logger.info(f"索引已存在: {index_name}")
             return True
     
     def index_documents(self, docs: List[Document], embedding_model: Embeddings, 
-                       index_name: str, batch_size: int = 100):
+                       index_name: str, batch_size: int = 100, checkpoint_path: Optional[str] = None,
+                       max_retries: int = 3, queue_size: int = 4):
         """索引文档
-        
+
+        向量化(CPU)在后台线程中进行, 与批量写入(HTTP)通过有界队列重叠执行;
+        写入使用 streaming_bulk, 被限流(429)的文档按指数退避重试。
+
         Args:
             docs: 文档列表
             embedding_model: 嵌入模型
             index_name: 索引名称
             batch_size: 批处理大小
-        
+            checkpoint_path: 进度文件路径, 记录已成功写入的 doc_id, 中断后再次执行时跳过这些文档
+            max_retries: 被限流时单个文档的最大重试次数
+            queue_size: 已向量化、等待写入的最大批次数
+
         Returns:
             索引是否成功
         """
@@ -116,67 +183,118 @@ class ESVectorDB:
         if not docs:
             logger.warning("没有文档需要索引")
             return False
-            
-        # 获取第一个文档的向量维度
-        try:
-            sample_embedding = embedding_model.embed_documents([docs[0].page_content])[0]
-            dims = len(sample_embedding)
-            logger.info(f"向量维度: {dims}")
-            
-            # 创建索引
-            if not self.create_index(index_name, dims):
-                return False
-                
-        except Exception as e:
-            logger.error(f"获取向量维度失败: {e}")
-            return False
-        
-        # 批量索引文档
-        total_batches = (len(docs) + batch_size - 1) // batch_size
-        success_count = 0
-        
-        for i in tqdm(range(0, len(docs), batch_size), total=total_batches, desc="索引文档"):
-            batch_docs = docs[i:i+batch_size]
-            batch_texts = [doc.page_content for doc in batch_docs]
-            
+
+        # 使用metadata中的doc_id作为文档ID，如果没有则使用默认生成方式
+        done_ids = self._load_checkpoint(checkpoint_path)
+        pending = [(str(doc.metadata.get('doc_id', f"{i}")), doc) for i, doc in enumerate(docs)]
+        pending = [(doc_id, doc) for doc_id, doc in pending if doc_id not in done_ids]
+        if not pending:
+            logger.info(f"全部 {len(docs)} 个文档已索引, 无需处理")
+            return True
+        if done_ids:
+            logger.info(f"从进度文件恢复, 跳过 {len(docs) - len(pending)} 个已索引文档")
+
+        batches = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+
+        def produce():
             try:
-                # 获取嵌入向量
-                batch_embeddings = embedding_model.embed_documents(batch_texts)
-                
-                # 准备批量索引请求
-                bulk_data = []
-                for j, (doc, embedding) in enumerate(zip(batch_docs, batch_embeddings)):
-                    # 使用metadata中的doc_id作为文档ID，如果没有则使用默认生成方式
-                    doc_id = doc.metadata.get('doc_id', f"{i+j}")
-                    print(f"文档ID: {doc_id}")
-                    # 索引操作
-                    bulk_data.append({"index": {"_index": index_name, "_id": doc_id}})
-                    
-                    # 文档内容
-                    doc_data = {
-                        "content": doc.page_content,
-                        "vector": embedding,
-                        "metadata": doc.metadata
-                    }
-                    bulk_data.append(doc_data)
-                
-                # 执行批量索引
-                if bulk_data:
-                    # 异步刷新配置（不立即刷新）
-                    response = self.es_client.bulk(body=bulk_data, refresh=False)
-                    if not response.get("errors", True):
-                        success_count += len(batch_docs)
-                    else:
-                        logger.warning(f"批量索引部分失败: {response}")
-                
+                for i in range(0, len(pending), batch_size):
+                    if stop.is_set():
+                        break
+                    batch = pending[i:i + batch_size]
+                    embeddings = embedding_model.embed_documents([doc.page_content for _, doc in batch])
+                    if len(embeddings) != len(batch):
+                        raise RuntimeError("文档向量化失败")
+                    batches.put((batch, embeddings))
             except Exception as e:
-                logger.error(f"批量索引失败: {e}")
-        
-        logger.info(f"成功索引 {success_count}/{len(docs)} 个文档")
+                batches.put(e)
+            finally:
+                batches.put(None)
+
+        producer = threading.Thread(target=produce, name="es-index-embedding", daemon=True)
+        producer.start()
+
+        def drain():
+            # 通知生产者停止并取出剩余批次, 避免其阻塞在队列上
+            stop.set()
+            while producer.is_alive() or not batches.empty():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+        # 以第一批向量的维度创建索引
+        first = batches.get()
+        if first is None or isinstance(first, Exception):
+            logger.error(f"获取向量维度失败: {first}")
+            drain()
+            return False
+        dims = len(first[1][0])
+        logger.info(f"向量维度: {dims}")
+        if not self.create_index(index_name, dims):
+            drain()
+            return False
+
+        def actions():
+            item = first
+            while item is not None:
+                if isinstance(item, Exception):
+                    raise item
+                batch, embeddings = item
+                for (doc_id, doc), embedding in zip(batch, embeddings):
+                    yield {
+                        "_index": index_name,
+                        "_id": doc_id,
+                        "_source": {
+                            "content": doc.page_content,
+                            "vector": embedding,
+                            "metadata": doc.metadata
+                        }
+                    }
+                item = batches.get()
+
+        success_count = 0
+        failed_count = 0
+        start_time = time.monotonic()
+        checkpoint = open(checkpoint_path, "a", encoding="utf-8") if checkpoint_path else None
+        try:
+            for ok, info in helpers.streaming_bulk(
+                    self.es_client, actions(), chunk_size=batch_size, max_retries=max_retries,
+                    initial_backoff=2, raise_on_error=False, raise_on_exception=False, refresh=False):
+                if ok:
+                    success_count += 1
+                    if checkpoint:
+                        checkpoint.write(f"{info['index']['_id']}\n")
+                        if success_count % batch_size == 0:
+                            checkpoint.flush()
+                else:
+                    failed_count += 1
+                    logger.warning(f"文档索引失败: {info}")
+        except Exception as e:
+            logger.error(f"批量索引失败: {e}")
+        finally:
+            drain()
+            if checkpoint:
+                checkpoint.close()
+
+        elapsed = time.monotonic() - start_time
+        rate = success_count / elapsed if elapsed > 0 else 0
+        logger.info(f"成功索引 {success_count}/{len(pending)} 个文档, 失败 {failed_count} 个, "
+                    f"耗时 {elapsed:.1f} 秒, {rate:.1f} 条/秒")
         return success_count > 0
+
+    @staticmethod
+    def _load_checkpoint(checkpoint_path: Optional[str]) -> set:
+        """读取进度文件中已索引的 doc_id"""
+        if not checkpoint_path or not os.path.exists(checkpoint_path):
+            return set()
+        with open(checkpoint_path, encoding="utf-8") as f:
+            return {line.strip() for line in f if line.strip()}
     
     def search(self, query: str, embedding_model: Embeddings, index_name: str, 
-              k: int = 5, metadata_filter: Optional[Dict[str, Any]] = None):
+              k: int = 5, metadata_filter: Optional[Dict[str, Any]] = None,
+              mode: str = "auto", num_candidates: Optional[int] = None):
         """向量搜索
         
         Args:
@@ -184,7 +302,9 @@ class ESVectorDB:
             embedding_model: 嵌入模型
             index_name: 索引名称
             k: 返回结果数量
-            metadata_filter: 元数据过滤条件
+            metadata_filter: 元数据过滤条件, 在 kNN 检索前过滤
+            mode: knn(HNSW近似检索) / exact(script_score精确评分) / auto(小索引或未建立HNSW索引时精确评分)
+            num_candidates: kNN 每个分片的候选数量, 默认 k * ES_KNN_CANDIDATES_FACTOR
             
         Returns:
             检索到的文档列表
@@ -196,36 +316,11 @@ class ESVectorDB:
         try:
             # 获取查询向量
             query_vector = embedding_model.embed_query(query)
-            
-            # 构建查询
-            search_query = {
-                "size": k,
-                "query": {
-                    "script_score": {
-                        "query": {"match_all": {}},
-                        "script": {
-                            "source": "cosineSimilarity(params.query_vector, 'vector') + 1.0",
-                            "params": {"query_vector": query_vector}
-                        }
-                    }
-                }
-            }
-            
-            # 添加元数据过滤
-            if metadata_filter:
-                filter_conditions = []
-                for key, value in metadata_filter.items():
-                    filter_conditions.append({"term": {f"metadata.{key}": value}})
-                
-                search_query["query"] = {
-                    "bool": {
-                        "must": search_query["query"],
-                        "filter": filter_conditions
-                    }
-                }
-            
-            # 执行搜索
-            response = self.es_client.search(index=index_name, body=search_query)
+            if mode == "auto":
+                mode = "knn" if self.use_knn(index_name) else "exact"
+            response = self.es_client.search(
+                index=index_name, **self.build_vector_query(query_vector, k, metadata_filter, mode, num_candidates)
+            )
             
             # 处理结果
             results = []
@@ -243,6 +338,138 @@ class ESVectorDB:
         except Exception as e:
             logger.error(f"搜索失败: {e}")
             return []
+
+    @staticmethod
+    def build_metadata_filter(metadata_filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """将元数据过滤条件转换为 term/terms 过滤
+
+        metadata 使用动态映射, 字符串字段为分词的 text 类型, 精确匹配需使用其 .keyword 子字段;
+        数值、布尔字段直接匹配, 列表值转换为 terms 过滤
+        """
+        conditions = []
+        for key, value in (metadata_filter or {}).items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            field = f"metadata.{key}.keyword" if any(isinstance(item, str) for item in values) else f"metadata.{key}"
+            if isinstance(value, (list, tuple, set)):
+                conditions.append({"terms": {field: list(values)}})
+            else:
+                conditions.append({"term": {field: value}})
+        return conditions
+
+    def build_vector_query(self, query_vector, k: int = 5, metadata_filter: Optional[Dict[str, Any]] = None,
+                           mode: str = "knn", num_candidates: Optional[int] = None,
+                           filters: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """构建向量检索的请求参数
+
+        Args:
+            query_vector: 查询向量
+            k: 返回结果数量
+            metadata_filter: 元数据过滤条件
+            mode: knn / exact
+            num_candidates: kNN 每个分片的候选数量
+            filters: 额外的过滤查询(ES查询语句列表)
+
+        Returns:
+            es_client.search 的关键字参数
+        """
+        filter_conditions = self.build_metadata_filter(metadata_filter) + list(filters or [])
+        if mode == "knn":
+            # num_candidates 不能超过 ES 上限, 且不能小于 k
+            k = min(k, ES_KNN_MAX_CANDIDATES)
+            knn = {
+                "field": "vector",
+                "query_vector": query_vector,
+                "k": k,
+                "num_candidates": min(max(num_candidates or k * ES_KNN_CANDIDATES_FACTOR, k), ES_KNN_MAX_CANDIDATES),
+            }
+            if filter_conditions:
+                knn["filter"] = filter_conditions
+            return {"knn": knn, "size": k}
+        base_query = {"bool": {"filter": filter_conditions}} if filter_conditions else {"match_all": {}}
+        return {
+            "size": k,
+            "query": {
+                "script_score": {
+                    "query": base_query,
+                    "script": {
+                        "source": "cosineSimilarity(params.query_vector, 'vector') + 1.0",
+                        "params": {"query_vector": query_vector}
+                    }
+                }
+            }
+        }
+
+    def get_index_info(self, index_name: str) -> Dict[str, Any]:
+        """获取索引的向量映射及文档数, 结果缓存 ES_INDEX_INFO_TTL 秒
+
+        Returns:
+            {"knn": 向量是否建立了HNSW索引, "dims": 向量维度, "count": 文档数}
+        """
+        cached = _index_info_cache.get(index_name)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        mapping = self.es_client.indices.get_mapping(index=index_name)
+        vector = {}
+        for index_mapping in mapping.values():
+            vector = index_mapping["mappings"].get("properties", {}).get("vector", {})
+            break
+        info = {
+            "knn": bool(vector.get("index")) and vector.get("similarity") is not None,
+            "dims": vector.get("dims"),
+            "count": self.es_client.count(index=index_name)["count"],
+        }
+        _index_info_cache[index_name] = (time.monotonic() + ES_INDEX_INFO_TTL, info)
+        return info
+
+    def use_knn(self, index_name: str) -> bool:
+        """是否使用 kNN 检索: 向量已建立HNSW索引且文档数不少于 ES_EXACT_SEARCH_THRESHOLD"""
+        try:
+            info = self.get_index_info(index_name)
+        except Exception as e:
+            logger.warning(f"获取索引信息失败, 使用精确评分: {e}")
+            return False
+        return info["knn"] and info["count"] >= ES_EXACT_SEARCH_THRESHOLD
+
+    def migrate_to_knn_index(self, index_name: str, target_index: Optional[str] = None, replace: bool = False):
+        """将旧索引重建为 HNSW 向量映射
+
+        Args:
+            index_name: 旧索引名称
+            target_index: 新索引名称, 默认 {index_name}_knn
+            replace: 是否删除旧索引并以旧索引名创建指向新索引的别名, 业务代码无需修改索引名
+
+        Returns:
+            新索引名称, 失败返回None
+        """
+        if self.es_client is None:
+            logger.error("Elasticsearch 客户端未初始化")
+            return None
+        target_index = target_index or f"{index_name}_knn"
+        try:
+            info = self.get_index_info(index_name)
+            if not info["dims"]:
+                logger.error(f"索引 {index_name} 没有向量字段")
+                return None
+            if not self.create_index(target_index, info["dims"], force_recreate=True):
+                return None
+            response = self.es_client.reindex(
+                source={"index": index_name}, dest={"index": target_index},
+                wait_for_completion=True, refresh=True, request_timeout=3600
+            )
+            logger.info(f"已重建索引 {index_name} -> {target_index}: {response.get('total')} 个文档, "
+                        f"失败 {len(response.get('failures', []))} 个")
+            if response.get("failures"):
+                return None
+            if replace:
+                self.es_client.indices.delete(index=index_name)
+                forget_index(self.ES_URL, index_name)
+                self.es_client.indices.put_alias(index=target_index, name=index_name)
+                logger.info(f"已删除旧索引 {index_name}, 并创建别名指向 {target_index}")
+            _index_info_cache.pop(index_name, None)
+            return target_index
+        except Exception as e:
+            logger.error(f"重建索引失败: {e}")
+            return None
     
     def get_all_metadatas(self, index_name: str):
         """获取索引中所有文档的元数据
@@ -319,8 +546,20 @@ class ESVectorDB:
             logger.error(f"索引文档失败: {e}")
             return None
 
-    def search_documents(self,  query, index_name=ES_INDEX_NAME,sort=None, size=10):
-        """搜索ES文档"""
+    def search_documents(self,  query, index_name=ES_INDEX_NAME,sort=None, size=10, from_=0,
+                         source_includes=None, search_after=None, track_total_hits=None):
+        """搜索ES文档
+
+        Args:
+            query: 查询条件
+            index_name: 索引名称
+            sort: 排序条件
+            size: 返回数量
+            from_: 偏移量
+            source_includes: 只返回的字段
+            search_after: 上一页最后一条的排序值, 指定后忽略 from_
+            track_total_hits: 是否统计总数
+        """
         try:
             # 构建查询体
             search_body = {
@@ -331,6 +570,14 @@ class ESVectorDB:
             # 添加排序条件
             if sort:
                 search_body["sort"] = sort
+            if search_after:
+                search_body["search_after"] = search_after
+            elif from_:
+                search_body["from"] = from_
+            if source_includes:
+                search_body["_source"] = {"includes": source_includes}
+            if track_total_hits is not None:
+                search_body["track_total_hits"] = track_total_hits
                 
             # 执行搜索 - 使用 es_client 直接查询
             response = self.es_client.search(
@@ -344,6 +591,32 @@ class ESVectorDB:
             print(f"搜索文档失败: {str(e)}")
             return None
 
+    def count_documents(self, query=None, index_name=ES_INDEX_NAME, ttl=ES_COUNT_CACHE_TTL):
+        """统计文档数量, 结果缓存 ttl 秒
+
+        Args:
+            query: 查询条件, 默认全部
+            index_name: 索引名称
+            ttl: 缓存时间(秒)
+
+        Returns:
+            文档数量
+        """
+        key = (index_name, json.dumps(query, sort_keys=True, ensure_ascii=False))
+        cached = _count_cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        count = self.es_client.count(index=index_name, query=query or {"match_all": {}})["count"]
+        _count_cache[key] = (time.monotonic() + ttl, count)
+        return count
+
+
+def clear_count_cache(index_name=None):
+    """清除文档数量缓存, 写入文档后调用"""
+    for key in list(_count_cache):
+        if index_name is None or key[0] == index_name:
+            _count_cache.pop(key, None)
+
 def _query_es_(query_text, index_name, top_k=10):
     """
     在 Elasticsearch 中执行查询并返回结果。
@@ -354,8 +627,8 @@ def _query_es_(query_text, index_name, top_k=10):
     Returns:
         list: 包含查询结果的列表。
     """
-    # 初始化 Elasticsearch 客户端
-    es = Elasticsearch(ES_URL, basic_auth=(ES_USERNAME, ES_PASSWORD), verify_certs=ES_VERIFY_CERTS)
+    # 获取共享的 Elasticsearch 客户端
+    es = get_es_client(ES_URL, ES_USERNAME, ES_PASSWORD, ES_VERIFY_CERTS)
 
     # 构建查询
     query = {
@@ -412,9 +685,33 @@ def _main_4_one_docs_():
         logger.info(f"文档内容: {doc.page_content}, 分数: {doc.metadata.get('score')}")
 
 
+def get_es_vector_db() -> ESVectorDB:
+    """获取使用默认连接配置的 ESVectorDB, 底层客户端在进程内共享"""
+    return ESVectorDB(ES_URL, ES_USERNAME, ES_PASSWORD, ES_VERIFY_CERTS)
+
+
+def build_resume_metadata(filename, parsed_data):
+    """由大模型提取的结构化信息构建简历文档的元数据"""
+    return {
+        "doc_id": filename,
+        "filename": filename,
+        "upload_time": datetime.now().isoformat(),
+        "name": parsed_data['name'],
+        "phone": parsed_data['phone'],
+        "email": parsed_data['email'],
+        "education": parsed_data['education'],
+        "score": parsed_data['score'],
+        "score_details": parsed_data['score_details'],
+        "work_experience": str(parsed_data['work_experience']),
+        "skills": parsed_data['skills'],
+        "projects": parsed_data['projects'],
+        "other": parsed_data['other']
+    }
+
+
 def save_to_es(filename,document,parsed_data):
     index_name = ES_INDEX_NAME
-    es = ESVectorDB(ES_URL,ES_USERNAME, ES_PASSWORD, ES_VERIFY_CERTS)
+    es = get_es_vector_db()
     # 定义索引名称
     # 创建索引，指定向量维度为1024
     es.create_index(index_name, dims=1024, force_recreate=False)
@@ -423,33 +720,81 @@ def save_to_es(filename,document,parsed_data):
     # 创建示例文档
     doc = Document(page_content=document, 
                 # 使用元数据存储其他信息
-                metadata={
-                    "doc_id": filename,
-                    "filename": filename,
-                    "upload_time": datetime.now().isoformat(), 
-                    "name": parsed_data['name'],
-                    "phone": parsed_data['phone'],
-                    "email": parsed_data['email'],
-                    "education": parsed_data['education'],
-                    "score": parsed_data['score'],
-                    "score_details": parsed_data['score_details'],
-                    "work_experience": str(parsed_data['work_experience']),
-                    "skills": parsed_data['skills'],
-                    "projects": parsed_data['projects'],
-                    "other": parsed_data['other']
-                })
+                metadata=build_resume_metadata(filename, parsed_data))
     docs=[] 
     docs.append(doc)
     # 处理 parsed_data = parsed_data.strip()
     print("开始索引文档...")
     # 使用index_documents方法批量索引文档
     es.index_documents(docs, embedding_model, index_name)
+    clear_count_cache(index_name)
+
+    return True
+
+
+def index_resume(filename, document, parsed_data, vector):
+    """写入已向量化的简历
 
+    Args:
+        filename: 文件名, 同时作为文档ID
+        document: 简历内容
+        parsed_data: 大模型提取的结构化信息
+        vector: 简历内容的向量
+
+    Returns:
+        是否写入成功
+    """
+    index_name = ES_INDEX_NAME
+    es = get_es_vector_db()
+    if not es.create_index(index_name, dims=len(vector), force_recreate=False):
+        return False
+    es.es_client.index(index=index_name, id=filename, document={
+        "content": document,
+        "vector": list(vector),
+        "metadata": build_resume_metadata(filename, parsed_data)
+    })
+    clear_count_cache(index_name)
     return True
 
 
+def index_resumes(resumes, batch_size=100):
+    """批量写入已向量化的简历
+
+    Args:
+        resumes: [(filename, document, parsed_data, vector), ...], filename 同时作为文档ID
+        batch_size: 每批写入数量
+
+    Returns:
+        {filename: 错误信息}, 写入失败的简历
+    """
+    index_name = ES_INDEX_NAME
+    if not resumes:
+        return {}
+    es = get_es_vector_db()
+    if not es.create_index(index_name, dims=len(resumes[0][3]), force_recreate=False):
+        return {filename: "创建索引失败" for filename, *_ in resumes}
+    actions = ({
+        "_index": index_name,
+        "_id": filename,
+        "_source": {
+            "content": document,
+            "vector": list(vector),
+            "metadata": build_resume_metadata(filename, parsed_data)
+        }
+    } for filename, document, parsed_data, vector in resumes)
+    failed = {}
+    for ok, info in helpers.streaming_bulk(es.es_client, actions, chunk_size=batch_size, max_retries=3,
+                                           initial_backoff=2, raise_on_error=False, raise_on_exception=False):
+        if not ok:
+            item = info.get("index", {})
+            failed[item.get("_id")] = str(item.get("error", info))
+    clear_count_cache(index_name)
+    logger.info(f"批量写入简历 {len(resumes) - len(failed)}/{len(resumes)} 份")
+    return failed
+
+
 def search_resume(query):
-    es = ESVectorDB(ES_URL,ES_USERNAME, ES_PASSWORD, ES_VERIFY_CERTS)
+    es = get_es_vector_db()
     index_name = ES_INDEX_NAME
     # 构建查询
     query_body = query
@@ -457,25 +802,41 @@ def search_resume(query):
     results = es.search_documents(query=query_body, index_name=index_name)
     return results
 
-def list_resume():
-    es = ESVectorDB(ES_URL,ES_USERNAME, ES_PASSWORD, ES_VERIFY_CERTS)
+def list_resume(page=1, size=10, sort_field="score", order="desc", search_after=None):
+    """分页查询简历列表
+
+    Args:
+        page: 页码, 指定 search_after 时忽略
+        size: 每页数量
+        sort_field: 排序字段, 见 RESUME_SORT_FIELDS
+        order: asc / desc
+        search_after: 上一页最后一条的 sort 值, 用于深度翻页
+
+    Returns:
+        {"total": 总数, "hits": 当前页结果}
+    """
+    es = get_es_vector_db()
     index_name = ES_INDEX_NAME
-    # 查询最新的10条简历
+    order = "asc" if order == "asc" else "desc"
+    sort = [
+        {RESUME_SORT_FIELDS.get(sort_field, RESUME_SORT_FIELDS["score"]): {"order": order, "missing": "_last"}},
+        {"metadata.doc_id.keyword": {"order": "asc"}},
+    ]
     results = es.search_documents(
         query={
             "match_all": {}
         },
         index_name=index_name,
-        sort=[
-            {
-                "metadata.score": {
-                    "order": "desc"
-                }
-            }
-        ],
-        size=10
+        sort=sort,
+        size=size,
+        from_=(page - 1) * size,
+        source_includes=RESUME_LIST_FIELDS,
+        search_after=search_after,
+        track_total_hits=False
     )
-    return results
+    if results is None:
+        return None
+    return {"total": es.count_documents(index_name=index_name), "hits": results["hits"]["hits"]}
 
 def _main_():
     # 只是向量数据库，没有向量模型。
@@ -0,0 +1,246 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from .embedding_model import EmbeddingModel
+from .es_client import get_async_es_client
+from .es_vector_db import ESVectorDB, ES_INDEX_NAME, get_es_vector_db
+from .logger_config import get_logger
+
+logger = get_logger(__name__)
+
+# RRF 融合常数, 越大则排名靠后的结果权重衰减越慢
+HYBRID_RRF_RANK_CONSTANT = int(os.getenv("HYBRID_RRF_RANK_CONSTANT", 60))
+# 每路检索至少召回的数量
+HYBRID_RANK_WINDOW = int(os.getenv("HYBRID_RANK_WINDOW", 50))
+# 查询向量缓存条数
+HYBRID_QUERY_CACHE_SIZE = int(os.getenv("HYBRID_QUERY_CACHE_SIZE", 1024))
+
+# 词法检索与向量检索并发执行的线程池
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("HYBRID_SEARCH_WORKERS", 8)),
+                               thread_name_prefix="hybrid-search")
+
+
+class QueryEmbeddingCache:
+    """查询向量的 LRU 缓存, 相同的查询文本只向量化一次"""
+
+    def __init__(self, maxsize: int = HYBRID_QUERY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, embedding_model: Embeddings, text: str):
+        key = (getattr(getattr(embedding_model, "service", None), "model_path", type(embedding_model).__name__), text)
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+        vector = embedding_model.embed_query(text)
+        if len(vector) == 0:
+            return vector
+        with self._lock:
+            self.misses += 1
+            self._data[key] = vector
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return vector
+
+
+query_embedding_cache = QueryEmbeddingCache()
+
+
+class HybridRetriever:
+    """词法(BM25) + 向量混合检索
+
+    两路检索并发执行, 结果按倒数排名融合(RRF)或按归一化分数加权融合。
+    """
+
+    def __init__(self, es_db: ESVectorDB, embedding_model: Embeddings, index_name: str = ES_INDEX_NAME,
+                 fusion: str = "rrf", lexical_weight: float = 1.0, vector_weight: float = 1.0,
+                 rank_constant: int = HYBRID_RRF_RANK_CONSTANT, rank_window: int = HYBRID_RANK_WINDOW):
+        """初始化
+
+        Args:
+            es_db: ESVectorDB 实例
+            embedding_model: 嵌入模型
+            index_name: 索引名称
+            fusion: rrf(倒数排名融合) / weighted(归一化分数加权)
+            lexical_weight: 词法检索权重
+            vector_weight: 向量检索权重
+            rank_constant: RRF 常数
+            rank_window: 每路检索至少召回的数量
+        """
+        self.es_db = es_db
+        self.embedding_model = embedding_model
+        self.index_name = index_name
+        self.fusion = fusion
+        self.lexical_weight = lexical_weight
+        self.vector_weight = vector_weight
+        self.rank_constant = rank_constant
+        self.rank_window = rank_window
+
+    def search(self, query_text: str, lexical_query: Optional[Dict[str, Any]] = None,
+               filters: Optional[List[Dict[str, Any]]] = None, page: int = 1, size: int = 10,
+               source_excludes: Optional[List[str]] = None) -> Dict[str, Any]:
+        """混合检索
+
+        Args:
+            query_text: 查询文本, 用于向量检索; 未指定 lexical_query 时也用于全文匹配
+            lexical_query: 词法检索的查询语句, 默认 match content
+            filters: 两路检索共同的过滤条件(ES查询语句列表)
+            page: 页码
+            size: 每页数量
+            source_excludes: 不返回的字段, 默认不返回向量
+
+        Returns:
+            {"window_total": 融合窗口内的结果数, "hits": 当前页结果}, 结果格式与 ES hits 一致;
+            两路检索各只召回 max(page * size, rank_window) 条, window_total 不是命中总数
+        """
+        window = max(page * size, self.rank_window)
+        source_excludes = source_excludes if source_excludes is not None else ["vector"]
+        lexical_future = _executor.submit(
+            self._lexical_search, query_text, lexical_query, filters, window, source_excludes
+        )
+        vector_future = _executor.submit(self._vector_search, query_text, filters, window, source_excludes)
+        ranked = []
+        for future, weight, name in ((lexical_future, self.lexical_weight, "lexical"),
+                                     (vector_future, self.vector_weight, "vector")):
+            try:
+                ranked.append((future.result(), weight, name))
+            except Exception as e:
+                logger.error(f"{name}检索失败: {e}")
+        hits = self.fuse(ranked)
+        start = (page - 1) * size
+        return {"window_total": len(hits), "hits": hits[start:start + size]}
+
+    async def asearch(self, query_text: str, lexical_query: Optional[Dict[str, Any]] = None,
+                      filters: Optional[List[Dict[str, Any]]] = None, page: int = 1, size: int = 10,
+                      source_excludes: Optional[List[str]] = None) -> Dict[str, Any]:
+        """混合检索的异步版本, 用于 ASGI 视图
+
+        两路检索使用当前事件循环共享的 AsyncElasticsearch 客户端, 查询向量化在线程中执行。
+        参数及返回值同 search。
+        """
+        window = max(page * size, self.rank_window)
+        source_excludes = source_excludes if source_excludes is not None else ["vector"]
+        es_client = get_async_es_client(self.es_db.ES_URL, self.es_db.ES_USERNAME, self.es_db.ES_PASSWORD,
+                                        self.es_db.ES_VERIFY_CERTS)
+        results = await asyncio.gather(
+            self._alexical_search(es_client, query_text, lexical_query, filters, window, source_excludes),
+            self._avector_search(es_client, query_text, filters, window, source_excludes),
+            return_exceptions=True,
+        )
+        ranked = []
+        for result, weight, name in zip(results, (self.lexical_weight, self.vector_weight), ("lexical", "vector")):
+            if isinstance(result, BaseException):
+                if not isinstance(result, Exception):
+                    raise result
+                logger.error(f"{name}检索失败: {result}")
+            else:
+                ranked.append((result, weight, name))
+        hits = self.fuse(ranked)
+        start = (page - 1) * size
+        return {"window_total": len(hits), "hits": hits[start:start + size]}
+
+    def _lexical_query(self, query_text, lexical_query, filters):
+        query = {"bool": {"must": [lexical_query or {"match": {"content": query_text}}]}}
+        if filters:
+            query["bool"]["filter"] = filters
+        return query
+
+    def _lexical_search(self, query_text, lexical_query, filters, window, source_excludes):
+        response = self.es_db.es_client.search(
+            index=self.index_name, query=self._lexical_query(query_text, lexical_query, filters),
+            size=window, source_excludes=source_excludes
+        )
+        return response["hits"]["hits"]
+
+    async def _alexical_search(self, es_client, query_text, lexical_query, filters, window, source_excludes):
+        response = await es_client.search(
+            index=self.index_name, query=self._lexical_query(query_text, lexical_query, filters),
+            size=window, source_excludes=source_excludes
+        )
+        return response["hits"]["hits"]
+
+    def _vector_search(self, query_text, filters, window, source_excludes):
+        query_vector = query_embedding_cache.get(self.embedding_model, query_text)
+        if len(query_vector) == 0:
+            return []
+        mode = "knn" if self.es_db.use_knn(self.index_name) else "exact"
+        response = self.es_db.es_client.search(
+            index=self.index_name, source_excludes=source_excludes,
+            **self.es_db.build_vector_query(query_vector, window, mode=mode, filters=filters)
+        )
+        return response["hits"]["hits"]
+
+    async def _avector_search(self, es_client, query_text, filters, window, source_excludes):
+        # 向量化为CPU计算, 索引信息有缓存但未命中时需请求ES, 均放到线程中执行
+        query_vector = await asyncio.to_thread(query_embedding_cache.get, self.embedding_model, query_text)
+        if len(query_vector) == 0:
+            return []
+        use_knn = await asyncio.to_thread(self.es_db.use_knn, self.index_name)
+        response = await es_client.search(
+            index=self.index_name, source_excludes=source_excludes,
+            **self.es_db.build_vector_query(query_vector, window, mode="knn" if use_knn else "exact",
+                                            filters=filters)
+        )
+        return response["hits"]["hits"]
+
+    def fuse(self, ranked) -> List[Dict[str, Any]]:
+        """融合多路检索结果
+
+        Args:
+            ranked: [(hits, 权重, 名称), ...]
+
+        Returns:
+            按融合分数降序排列的 hits, _score 为融合分数
+        """
+        fused = {}
+        for hits, weight, name in ranked:
+            if not hits:
+                continue
+            if self.fusion == "weighted":
+                scores = [hit["_score"] or 0 for hit in hits]
+                low, high = min(scores), max(scores)
+            for rank, hit in enumerate(hits, start=1):
+                item = fused.setdefault(hit["_id"], {**hit, "_score": 0.0, "_ranks": {}})
+                item["_ranks"][name] = rank
+                if self.fusion == "weighted":
+                    score = ((hit["_score"] or 0) - low) / (high - low) if high > low else 1.0
+                    item["_score"] += weight * score
+                else:
+                    item["_score"] += weight / (self.rank_constant + rank)
+        return sorted(fused.values(), key=lambda item: item["_score"], reverse=True)
+
+
+def hybrid_search_resume(query_text: str, lexical_query: Optional[Dict[str, Any]] = None,
+                         filters: Optional[List[Dict[str, Any]]] = None, page: int = 1, size: int = 10):
+    """简历混合检索
+
+    Args:
+        query_text: 用户的查询文本
+        lexical_query: 由检索条件构建的词法查询
+        filters: 过滤条件
+        page: 页码
+        size: 每页数量
+
+    Returns:
+        {"window_total": 融合窗口内的结果数, "hits": 当前页结果}
+    """
+    retriever = HybridRetriever(get_es_vector_db(), EmbeddingModel(), ES_INDEX_NAME)
+    return retriever.search(query_text, lexical_query=lexical_query, filters=filters, page=page, size=size)
+
+
+async def ahybrid_search_resume(query_text: str, lexical_query: Optional[Dict[str, Any]] = None,
+                                filters: Optional[List[Dict[str, Any]]] = None, page: int = 1, size: int = 10):
+    """简历混合检索的异步版本, 需在事件循环中调用, 参数及返回值同 hybrid_search_resume"""
+    retriever = HybridRetriever(get_es_vector_db(), EmbeddingModel(), ES_INDEX_NAME)
+    return await retriever.asearch(query_text, lexical_query=lexical_query, filters=filters, page=page, size=size)
@@ -1,24 +1,50 @@
 import os
 import json
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
 import torch
+from dotenv import load_dotenv
 from magic_pdf.data.data_reader_writer import FileBasedDataWriter, FileBasedDataReader
 from magic_pdf.data.dataset import PymuDocDataset
-from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze
+from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze, ModelSingleton
 from magic_pdf.config.enums import SupportedPdfParseMethod
 
+from .logger_config import get_logger
+
+logger = get_logger(__name__)
+load_dotenv()
+
+# 精简模式: 不生成模型、版面、文本块的调试PDF及中间JSON
+MINERU_LEAN_MODE = os.getenv("MINERU_LEAN_MODE", "True") == "True"
+# 常驻转换进程数, 大于1时使用多进程并按页分段并行处理长文档, 每个进程各自加载一份模型
+MINERU_POOL_SIZE = int(os.getenv("MINERU_POOL_SIZE", 1))
+# 多进程模式下超过该页数的PDF按页分段, 0 表示不分段
+MINERU_PAGE_CHUNK_SIZE = int(os.getenv("MINERU_PAGE_CHUNK_SIZE", 20))
+# 转换器池每转换多少个文件记录一次各阶段累计耗时, 0 表示不记录
+MINERU_STATS_INTERVAL = int(os.getenv("MINERU_STATS_INTERVAL", 20))
+
+
 class MarkdownConverter:
-    def __init__(self, output_dir: str = "output"):
+    def __init__(self, output_dir: str = "output", lean: bool = MINERU_LEAN_MODE):
         """
         初始化PDF转Markdown转换器
         :param output_dir: 输出目录
+        :param lean: 精简模式, 只输出Markdown引用的图片, 不生成调试文件
         """
         self.output_dir = output_dir
         self.image_dir = os.path.join(output_dir, "images")
-        
+        self.lean = lean
+        # 最近一次转换各阶段的耗时(秒)
+        self.last_timings = {}
+
         # 初始化输出目录
         os.makedirs(self.image_dir, exist_ok=True)
         os.makedirs(output_dir, exist_ok=True)
-        
+
         # 初始化写入器
         self.image_writer = FileBasedDataWriter(self.image_dir)
         self.md_writer = FileBasedDataWriter(output_dir)
@@ -41,90 +67,252 @@ class MarkdownConverter:
         :param doc_path: PDF文件路径
         :return: Markdown内容
         """
-        # 读取PDF内容
-        if not os.path.exists(doc_path):
-            raise FileNotFoundError(f"PDF文件不存在: {doc_path}")
-        self.file_bytes = FileBasedDataReader("").read(doc_path)
-        self.ds = PymuDocDataset(self.file_bytes)
-        # 清空GPU内存
-        self.clear_gpu_memory()
+        return self.convert(doc_path)
 
-        # 判断处理模式
-        if self.ds.classify() == SupportedPdfParseMethod.OCR:
-            infer_result = self.ds.apply(doc_analyze, ocr=True)
-            pipe_result = infer_result.pipe_ocr_mode(self.image_writer)
-        else:
-            infer_result = self.ds.apply(doc_analyze, ocr=False)
-            pipe_result = infer_result.pipe_txt_mode(self.image_writer)
-
-        # 生成各种输出文件
-        self._generate_output_files(infer_result, pipe_result)
-        # 返回Markdown内容
-        return pipe_result.get_markdown(os.path.basename(self.image_dir))
+    def convert(self, pdf_path: str, start_page_id: int = 0, end_page_id: int = None):
+        """执行PDF到Markdown的转换
 
-
-    def convert(self, pdf_path: str):
-        """执行PDF到Markdown的转换"""
+        :param pdf_path: PDF文件路径
+        :param start_page_id: 起始页码(从0开始)
+        :param end_page_id: 结束页码(包含), 默认到最后一页
+        :return: Markdown内容
+        """
+        timings = {}
+        start = time.monotonic()
         # 读取PDF内容
         pdf_path = os.path.abspath(pdf_path)  # 转换为绝对路径
         if not os.path.exists(pdf_path):
             raise FileNotFoundError(f"PDF文件不存在: {pdf_path}")
-            
+
         self.name_without_ext = os.path.splitext(os.path.basename(pdf_path))[0]
         self.pdf_bytes = FileBasedDataReader("").read(pdf_path)
         self.ds = PymuDocDataset(self.pdf_bytes)
+        timings["read"] = time.monotonic() - start
 
-        # 清空GPU内存
-        self.clear_gpu_memory()
-        
         # 判断处理模式
-        if self.ds.classify() == SupportedPdfParseMethod.OCR:
-            infer_result = self.ds.apply(doc_analyze, ocr=True)
-            pipe_result = infer_result.pipe_ocr_mode(self.image_writer)
+        start = time.monotonic()
+        ocr = self.ds.classify() == SupportedPdfParseMethod.OCR
+        timings["classify"] = time.monotonic() - start
+
+        # 模型由 ModelSingleton 缓存, 推理结束后 doc_analyze 会自行回收显存
+        start = time.monotonic()
+        infer_result = self.ds.apply(doc_analyze, ocr=ocr, start_page_id=start_page_id, end_page_id=end_page_id)
+        timings["analyze"] = time.monotonic() - start
+
+        start = time.monotonic()
+        if ocr:
+            pipe_result = infer_result.pipe_ocr_mode(self.image_writer, start_page_id=start_page_id,
+                                                     end_page_id=end_page_id)
         else:
-            infer_result = self.ds.apply(doc_analyze, ocr=False)
-            pipe_result = infer_result.pipe_txt_mode(self.image_writer)
-        
-        # 生成各种输出文件
-        self._generate_output_files(infer_result, pipe_result)
-        
+            pipe_result = infer_result.pipe_txt_mode(self.image_writer, start_page_id=start_page_id,
+                                                     end_page_id=end_page_id)
+        timings["pipe"] = time.monotonic() - start
+
         # 返回Markdown内容
-        return pipe_result.get_markdown(os.path.basename(self.image_dir))
-    
+        start = time.monotonic()
+        markdown = pipe_result.get_markdown(os.path.basename(self.image_dir))
+        timings["markdown"] = time.monotonic() - start
+
+        if not self.lean:
+            # 生成各种输出文件
+            start = time.monotonic()
+            self._generate_output_files(infer_result, pipe_result)
+            timings["dump"] = time.monotonic() - start
+
+        self.last_timings = {name: round(elapsed, 3) for name, elapsed in timings.items()}
+        logger.info(f"PDF转换完成: {self.name_without_ext} 第{start_page_id + 1}页起, "
+                    f"{'OCR' if ocr else '文本'}模式, 耗时 {self.last_timings}")
+        return markdown
+
     def _generate_output_files(self, infer_result, pipe_result):
         """生成所有输出文件"""
         # 绘制模型结果
         infer_result.draw_model(self._get_output_path("_model.pdf"))
-        
+
         # 绘制布局结果
         pipe_result.draw_layout(self._get_output_path("_layout.pdf"))
-        
+
         # 绘制文本块结果
         pipe_result.draw_span(self._get_output_path("_spans.pdf"))
-        
+
         # 保存Markdown文件
-        pipe_result.dump_md(self.md_writer, f"{self.name_without_ext}.md", 
+        pipe_result.dump_md(self.md_writer, f"{self.name_without_ext}.md",
                            os.path.basename(self.image_dir))
-        
+
         # 保存内容列表
-        pipe_result.dump_content_list(self.md_writer, 
+        pipe_result.dump_content_list(self.md_writer,
                                     f"{self.name_without_ext}_content_list.json",
                                     os.path.basename(self.image_dir))
-        
+
         # 保存中间JSON
-        pipe_result.dump_middle_json(self.md_writer, 
+        pipe_result.dump_middle_json(self.md_writer,
                                     f"{self.name_without_ext}_middle.json")
-    
+
     def _get_output_path(self, suffix: str) -> str:
         """获取输出文件路径"""
         return os.path.join(self.output_dir, f"{self.name_without_ext}{suffix}")
 
+
+_worker_converter = None
+
+
+def _init_worker(output_dir: str, lean: bool):
+    """转换进程初始化: 创建转换器并预加载模型"""
+    global _worker_converter
+    _worker_converter = MarkdownConverter(output_dir, lean)
+    warm_up()
+
+
+def _convert_in_worker(pdf_path: str, start_page_id: int, end_page_id):
+    """在转换进程中转换指定页码范围, 返回(Markdown内容, 各阶段耗时)"""
+    markdown = _worker_converter.convert(pdf_path, start_page_id, end_page_id)
+    return markdown, _worker_converter.last_timings
+
+
+def warm_up():
+    """预先加载版面分析、公式、表格及OCR模型, 避免首个文件承担模型加载耗时"""
+    start = time.monotonic()
+    ModelSingleton().get_model(ocr=True, show_log=False, lang=None, layout_model=None,
+                               formula_enable=None, table_enable=None)
+    logger.info(f"MinerU模型预加载完成, 耗时 {time.monotonic() - start:.1f} 秒")
+
+
+class ConverterPool:
+    """常驻的转换器池
+
+    size 为1时在当前进程内转换, 转换器保存单次转换的状态, 同一时刻只处理一个文件;
+    size 大于1时启动常驻的转换进程, 各进程启动时加载一次模型, 长文档按页分段分发到多个进程并行处理。
+    当前进程无法创建子进程时(如celery的守护进程)退回当前进程内转换。
+    每转换 stats_interval 个文件记录一次 stats()。
+    """
+
+    def __init__(self, size: int = MINERU_POOL_SIZE, output_dir: str = "output", lean: bool = MINERU_LEAN_MODE,
+                 stats_interval: int = MINERU_STATS_INTERVAL):
+        """初始化
+
+        Args:
+            size: 转换进程数
+            output_dir: 输出目录
+            lean: 是否使用精简模式
+            stats_interval: 记录累计耗时的文件数间隔, 0 表示不记录
+        """
+        self.size = size
+        self.output_dir = output_dir
+        self.lean = lean
+        self.stats_interval = stats_interval
+        self._converter = MarkdownConverter(output_dir, lean)
+        self._converter_lock = threading.Lock()
+        self._executor = None
+        self._stats_lock = threading.Lock()
+        self._count = 0
+        self._timings = {}
+
+    def _get_executor(self):
+        if self.size <= 1:
+            return None
+        if self._executor is None:
+            with self._converter_lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.size, mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker, initargs=(self.output_dir, self.lean)
+                    )
+        return self._executor
+
+    def _disable_executor(self, error):
+        logger.warning(f"无法启动转换进程, 在当前进程内转换: {error}")
+        self.size = 1
+        self._executor = None
+
+    def warm_up(self):
+        """预加载模型, 多进程模式下启动全部转换进程"""
+        executor = self._get_executor()
+        if executor is not None:
+            try:
+                # 每个进程启动时执行初始化, 提交与进程数相同的空任务即可全部启动
+                for future in [executor.submit(time.sleep, 0) for _ in range(self.size)]:
+                    future.result()
+                return
+            except AssertionError as e:
+                # 守护进程(如celery的worker)不能创建子进程
+                self._disable_executor(e)
+        warm_up()
+
+    def _page_ranges(self, pdf_path: str):
+        if not self.lean or MINERU_PAGE_CHUNK_SIZE <= 0:
+            return [(0, None)]
+        with fitz.open(pdf_path) as doc:
+            page_count = doc.page_count
+        return [(i, min(i + MINERU_PAGE_CHUNK_SIZE, page_count) - 1)
+                for i in range(0, page_count, MINERU_PAGE_CHUNK_SIZE)] or [(0, None)]
+
+    def convert(self, pdf_path: str) -> str:
+        """转换PDF并累计各阶段耗时
+
+        Args:
+            pdf_path: PDF文件路径
+
+        Returns:
+            Markdown内容
+        """
+        results = None
+        executor = self._get_executor()
+        if executor is not None:
+            try:
+                futures = [executor.submit(_convert_in_worker, os.path.abspath(pdf_path), first, last)
+                           for first, last in self._page_ranges(pdf_path)]
+                results = [future.result() for future in futures]
+            except AssertionError as e:
+                # 守护进程(如celery的worker)不能创建子进程
+                self._disable_executor(e)
+        if results is None:
+            with self._converter_lock:
+                results = [(self._converter.convert(pdf_path), self._converter.last_timings)]
+        markdown = "\n\n".join(result[0] for result in results if result[0])
+        with self._stats_lock:
+            self._count += 1
+            for _, timings in results:
+                for name, elapsed in timings.items():
+                    self._timings[name] = self._timings.get(name, 0) + elapsed
+            log_stats = self.stats_interval and self._count % self.stats_interval == 0
+        if log_stats:
+            logger.info(f"PDF转换器池状态: {self.stats()}")
+        return markdown
+
+    def stats(self):
+        """已转换的文件数及各阶段的累计、平均耗时(秒), 分段处理时为各段耗时之和"""
+        with self._stats_lock:
+            return {
+                "count": self._count,
+                "total": {name: round(elapsed, 3) for name, elapsed in self._timings.items()},
+                "average": {name: round(elapsed / self._count, 3) for name, elapsed in self._timings.items()}
+                if self._count else {},
+            }
+
+
+_converter_pools = {}
+_converter_pools_lock = threading.Lock()
+
+
+def get_converter_pool() -> ConverterPool:
+    """获取进程内共享的转换器池"""
+    pid = os.getpid()
+    pool = _converter_pools.get(pid)
+    if pool is None:
+        with _converter_pools_lock:
+            pool = _converter_pools.get(pid)
+            if pool is None:
+                pool = ConverterPool()
+                _converter_pools[pid] = pool
+    return pool
+
+
 # 使用示例
 if __name__ == "__main__":
-    converter = MarkdownConverter()  # 初始化时不传pdf_path
+    converter = MarkdownConverter(lean=False)  # 初始化时不传pdf_path
     pdf_path = "/Users/luyangcai/trae/django-vue3-admin/backend/media/output/1745491266.pdf"
     print("开始转换PDF到Markdown...")
     markdown_content = converter.convert(pdf_path)  # 只调用一次convert并传入参数
     converter.clear_gpu_memory()
-    
+
     print("转换完成，Markdown内容已保存到输出目录")
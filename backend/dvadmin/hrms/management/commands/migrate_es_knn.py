@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+
+from dvadmin.dputils.es_vector_db import ESVectorDB, ES_URL, ES_USERNAME, ES_PASSWORD, ES_VERIFY_CERTS, ES_INDEX_NAME
+
+
+class Command(BaseCommand):
+    """
+    将简历向量索引重建为HNSW映射: python manage.py migrate_es_knn [--index xxx] [--replace]
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', default=ES_INDEX_NAME, help='需要重建的索引名称')
+        parser.add_argument('--target', default=None, help='新索引名称, 默认 {index}_knn')
+        parser.add_argument('--replace', action='store_true', help='删除旧索引并以旧索引名创建别名')
+
+    def handle(self, *args, **options):
+        es = ESVectorDB(ES_URL, ES_USERNAME, ES_PASSWORD, ES_VERIFY_CERTS)
+        print(f"正在重建索引 {options['index']} ...")
+        target_index = es.migrate_to_knn_index(options['index'], options['target'], options['replace'])
+        if target_index:
+            print(f"索引重建完成: {target_index}")
+        else:
+            print("索引重建失败, 请查看日志")
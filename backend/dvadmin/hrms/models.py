@@ -159,6 +159,7 @@ class Resume(CoreModel):
     file_type = models.CharField(max_length=100, verbose_name='文件类型')
     file_size = models.IntegerField(verbose_name='文件大小(KB)')
     file_id = models.CharField(null=True, blank=True, max_length=100,verbose_name='文件ID')
+    file_hash = models.CharField(null=True, blank=True, max_length=64, db_index=True, verbose_name='文件SHA-256')
     content = models.TextField(null=True, blank=True, verbose_name='简历内容')
     analysis_result = models.JSONField(null=True, blank=True, verbose_name='分析结果')
     
@@ -166,4 +167,34 @@ class Resume(CoreModel):
         db_table = table_prefix + "hrms_resume"
         verbose_name = "简历表"
         verbose_name_plural = verbose_name
-        ordering = ("-create_datetime",)
\ No newline at end of file
+        ordering = ("-create_datetime",)
+
+class ResumeIngestJob(CoreModel):
+    """简历入库任务表"""
+    resume = models.ForeignKey(
+        to="Resume",
+        verbose_name="简历",
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name="ingest_jobs",
+        help_text="简历",
+    )
+    job_description = models.TextField(verbose_name="简历评分要求", null=True, blank=True, help_text="简历评分要求")
+    JOB_STATUS = (
+        (0, "排队中"),
+        (1, "处理中"),
+        (2, "已完成"),
+        (3, "失败"),
+    )
+    status = models.IntegerField(choices=JOB_STATUS, default=0, verbose_name="任务状态", help_text="任务状态")
+    stage = models.CharField(max_length=20, null=True, blank=True, verbose_name="当前阶段", help_text="当前阶段")
+    progress = models.SmallIntegerField(default=0, verbose_name="进度", help_text="进度")
+    stages = models.JSONField(default=dict, verbose_name="阶段详情", help_text="各阶段的状态、重试次数及耗时")
+    vector = models.JSONField(null=True, blank=True, verbose_name="向量", help_text="向量化阶段的中间结果")
+    error = models.TextField(null=True, blank=True, verbose_name="错误信息", help_text="错误信息")
+
+    class Meta:
+        db_table = table_prefix + "hrms_resume_ingest_job"
+        verbose_name = "简历入库任务表"
+        verbose_name_plural = verbose_name
+        ordering = ("-create_datetime",)
@@ -0,0 +1,401 @@
+import functools
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from celery import chain, chord, group
+from celery.signals import worker_process_init
+from django.conf import settings
+
+from application.celery import app
+from dvadmin.hrms.models import ResumeIngestJob
+from dvadmin.utils.content_cache_util import (
+    CONTENT_CACHE_MISS, content_cache_get, get_content_cache, set_content_cache, text_sha256
+)
+
+logger = logging.getLogger(__name__)
+
+# 入库阶段及完成后的进度
+INGEST_STAGES = (("parse", 25), ("extract", 50), ("embed", 75), ("index", 100))
+# 支持解析的简历文件格式
+RESUME_FILE_TYPES = ('pdf', 'docx')
+# 解析后简历内容的最小长度
+RESUME_MIN_CONTENT_LENGTH = 50
+# 大模型提取结果的必要字段
+RESUME_REQUIRED_FIELDS = ['name', 'phone', 'email', 'education', 'work_experience',
+                          'skills', 'projects', 'other', 'score', 'score_details']
+
+
+class IngestError(Exception):
+    """不需要重试的入库错误, 如文件格式不支持、内容过少"""
+
+
+@worker_process_init.connect
+def warm_up_resume_parser(**kwargs):
+    """
+    celery worker进程启动时预加载PDF解析模型
+    """
+    if not getattr(settings, 'RESUME_PARSER_WARMUP', False):
+        return
+    try:
+        from dvadmin.dputils.pdftomarkdown import get_converter_pool
+        get_converter_pool().warm_up()
+    except Exception as e:
+        logger.warning(f"预加载PDF解析模型失败: {e}")
+
+
+def parse_analysis(analysis):
+    """
+    从大模型的回复中提取简历的结构化信息
+    :param analysis: 大模型回复
+    :return: dict
+    """
+    start_idx = analysis.find('{')
+    end_idx = analysis.rfind('}') + 1
+    if start_idx == -1 or end_idx == 0:
+        raise ValueError("No valid JSON found in LLM output")
+    parsed_data = json.loads(analysis[start_idx:end_idx])
+    for field in RESUME_REQUIRED_FIELDS:
+        if field not in parsed_data:
+            raise ValueError(f"Missing required field: {field}")
+    return parsed_data
+
+
+def job_to_dict(job):
+    """
+    入库任务的状态信息
+    """
+    return {
+        "job_id": job.id,
+        "resume_id": job.resume_id,
+        "file_name": job.resume.file_name,
+        "status": job.status,
+        "status_label": job.get_status_display(),
+        "stage": job.stage,
+        "progress": job.progress,
+        "stages": job.stages,
+        "error": job.error,
+        "parsed_data": job.resume.analysis_result if job.status == 2 else None,
+    }
+
+
+def push_job_progress(job):
+    """
+    通过消息中心的websocket推送任务进度, 推送失败不影响任务执行
+    """
+    if not job.creator_id:
+        return
+    try:
+        from dvadmin.system.views.message_center import websocket_push
+        websocket_push(job.creator_id, message={"sender": 'system', "contentType": 'RESUME_INGEST',
+                                                "content": job_to_dict(job)})
+    except Exception as e:
+        logger.warning(f"推送简历入库进度失败: {e}")
+
+
+def _update_stage(job, name, **kwargs):
+    stage = dict(job.stages.get(name, {}))
+    stage.update(kwargs)
+    job.stages = {**job.stages, name: stage}
+
+
+def start_stage(job, name, attempts=1):
+    """
+    标记阶段开始
+    """
+    job.status = 1
+    job.stage = name
+    _update_stage(job, name, status="running", attempts=attempts)
+    job.save(update_fields=['status', 'stage', 'stages'])
+    push_job_progress(job)
+
+
+def finish_stage(job, name, elapsed):
+    """
+    标记阶段完成, 最后一个阶段完成时任务完成
+    """
+    progress = dict(INGEST_STAGES)[name]
+    _update_stage(job, name, status="success", elapsed=round(elapsed, 3), error=None)
+    job.progress = progress
+    if progress == 100:
+        job.status = 2
+        job.vector = None
+    job.save()
+    push_job_progress(job)
+
+
+def fail_stage(job, name, elapsed, exc, retry=False):
+    """
+    标记阶段失败, 不再重试时任务失败
+    """
+    _update_stage(job, name, status="retrying" if retry else "failed", elapsed=round(elapsed, 3), error=str(exc))
+    if not retry:
+        job.status = 3
+        job.error = str(exc)
+        job.vector = None
+        logger.error(f"简历入库任务{job.id}在{name}阶段失败: {exc}")
+    job.save(update_fields=['status', 'stages', 'error', 'vector'])
+    push_job_progress(job)
+
+
+def ingest_stage(name):
+    """
+    简历入库阶段装饰器
+    记录阶段状态、重试次数和耗时, 失败时按配置重试, 超过重试次数或遇到 IngestError 时任务失败
+    被装饰的函数接收任务实例, 返回的任务ID传递给下一阶段;
+    raise_on_failure 为 False 时失败返回 None, 用于批量任务中不中断其他简历
+    """
+
+    def wraps(func):
+        @app.task(bind=True, name=f"dvadmin.hrms.tasks.ingest_{name}",
+                  max_retries=getattr(settings, 'RESUME_INGEST_MAX_RETRIES', 2),
+                  default_retry_delay=getattr(settings, 'RESUME_INGEST_RETRY_DELAY', 10))
+        @functools.wraps(func)
+        def wrapper(self, job_id, raise_on_failure=True):
+            job = ResumeIngestJob.objects.select_related('resume').get(pk=job_id)
+            start_stage(job, name, attempts=self.request.retries + 1)
+            start = time.monotonic()
+            try:
+                func(job)
+            except Exception as exc:
+                retry = not isinstance(exc, IngestError) and self.request.retries < self.max_retries
+                fail_stage(job, name, time.monotonic() - start, exc, retry=retry)
+                if retry:
+                    raise self.retry(exc=exc)
+                if raise_on_failure:
+                    raise
+                return None
+            finish_stage(job, name, time.monotonic() - start)
+            return job_id
+
+        return wrapper
+
+    return wraps
+
+
+@ingest_stage("parse")
+def ingest_parse(job):
+    """解析简历文件为Markdown, 相同文件复用已缓存的解析结果"""
+    resume = job.resume
+    if resume.file_type not in RESUME_FILE_TYPES:
+        raise IngestError("不支持的文件格式")
+    from dvadmin.dputils.document_parser import DOCUMENT_PARSER_VERSION, parse_pdf, parse_docx
+
+    def load():
+        file_path = os.path.join(settings.MEDIA_ROOT, resume.file.name)
+        if resume.file_type == 'pdf':
+            # 使用magicpdf 解析成Markdown文件
+            content = parse_pdf(file_path)
+        else:
+            content = parse_docx(file_path)
+        if not content or len(content.strip()) < RESUME_MIN_CONTENT_LENGTH:
+            raise IngestError("文件解析失败或内容过少，请检查上传的文件是否正确")
+        return content
+
+    resume.content, cached = content_cache_get(
+        resume.file_hash, "markdown", f"{resume.file_type}:{DOCUMENT_PARSER_VERSION}", load
+    )
+    _update_stage(job, "parse", cached=cached)
+    resume.save(update_fields=['content'])
+
+
+@ingest_stage("extract")
+def ingest_extract(job):
+    """大模型提取简历关键信息并评分, 相同文件在相同模型和提示词下复用已缓存的结果"""
+    from dvadmin.dputils.deepseek_chat import chatToLLM4Analysis, get_analysis_version
+
+    resume = job.resume
+    resume.analysis_result, cached = content_cache_get(
+        resume.file_hash, "extraction", get_analysis_version(job.job_description),
+        lambda: parse_analysis(chatToLLM4Analysis(resume.content, job.job_description))
+    )
+    _update_stage(job, "extract", cached=cached)
+    resume.save(update_fields=['analysis_result'])
+
+
+def _vector_version(embedding_model, content):
+    # 向量由模型和解析后的内容决定
+    return text_sha256(embedding_model.service.model_path, content)
+
+
+@ingest_stage("embed")
+def ingest_embed(job):
+    """简历内容向量化, 相同文件在相同模型下复用已缓存的向量"""
+    from dvadmin.dputils.embedding_model import EmbeddingModel
+
+    def load():
+        vector = embedding_model.embed_documents([job.resume.content])
+        if len(vector) == 0:
+            raise ValueError("文档向量化失败")
+        return [float(value) for value in vector[0]]
+
+    embedding_model = EmbeddingModel()
+    job.vector, cached = content_cache_get(
+        job.resume.file_hash, "vector", _vector_version(embedding_model, job.resume.content), load
+    )
+    _update_stage(job, "embed", cached=cached)
+
+
+@ingest_stage("index")
+def ingest_index(job):
+    """写入ES"""
+    from dvadmin.dputils.es_vector_db import index_resume
+
+    resume = job.resume
+    if not index_resume(resume.file_name, resume.content, resume.analysis_result, job.vector):
+        raise ValueError("写入ES失败")
+
+
+def ingest_pipeline(job_id):
+    """
+    简历入库任务链: 解析 -> 提取 -> 向量化 -> 写入
+    """
+    return chain(ingest_parse.s(job_id), ingest_extract.s(), ingest_embed.s(), ingest_index.s())
+
+
+def _retry_backoff(attempts, base, max_delay=60):
+    """
+    指数退避的重试间隔, 带随机抖动避免并发请求同时重试
+    :param attempts: 已尝试次数
+    :param base: 首次重试间隔(秒)
+    :param max_delay: 最大重试间隔(秒)
+    :return:
+    """
+    delay = min(base * 2 ** (attempts - 1), max_delay)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _extract_one(content, job_description, max_retries, retry_delay=0):
+    """
+    在线程中调用大模型提取简历信息, 不访问数据库, 失败时按指数退避重试
+    :param retry_delay: 首次重试间隔(秒)
+    :return: (结构化信息或异常, 尝试次数, 耗时)
+    """
+    from dvadmin.dputils.deepseek_chat import chatToLLM4Analysis
+
+    start = time.monotonic()
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            return parse_analysis(chatToLLM4Analysis(content, job_description)), attempts, time.monotonic() - start
+        except Exception as exc:
+            if attempts > max_retries:
+                return exc, attempts, time.monotonic() - start
+            logger.warning("简历信息提取失败, 第%s次重试: %s", attempts, exc)
+            time.sleep(_retry_backoff(attempts, retry_delay))
+
+
+@app.task(bind=True, name="dvadmin.hrms.tasks.ingest_batch_finish")
+def ingest_batch_finish(self, job_ids):
+    """
+    批量入库: 解析完成后并发调用大模型提取, 统一向量化后一次批量写入ES
+    :param job_ids: 解析阶段的结果, 解析失败的为 None
+    """
+    from dvadmin.dputils.deepseek_chat import DEEPSEEK_MAX_WORKERS, get_analysis_version
+    from dvadmin.dputils.embedding_model import EmbeddingModel
+    from dvadmin.dputils.es_vector_db import index_resumes
+
+    jobs = list(ResumeIngestJob.objects.select_related('resume').filter(pk__in=[i for i in job_ids if i]))
+    if not jobs:
+        return []
+    max_retries = getattr(settings, 'RESUME_INGEST_MAX_RETRIES', 2)
+    retry_delay = getattr(settings, 'RESUME_EXTRACT_RETRY_DELAY', 2)
+
+    # 大模型提取, 并发数不超过 DEEPSEEK_MAX_WORKERS, 数据库只在当前线程中更新
+    extracted = []
+    with ThreadPoolExecutor(max_workers=DEEPSEEK_MAX_WORKERS, thread_name_prefix="resume-extract") as executor:
+        futures = {}
+        for job in jobs:
+            start_stage(job, "extract")
+            version = get_analysis_version(job.job_description)
+            result = get_content_cache(job.resume.file_hash, "extraction", version)
+            if result is not CONTENT_CACHE_MISS:
+                job.resume.analysis_result = result
+                job.resume.save(update_fields=['analysis_result'])
+                _update_stage(job, "extract", cached=True)
+                finish_stage(job, "extract", 0)
+                extracted.append(job)
+                continue
+            future = executor.submit(_extract_one, job.resume.content, job.job_description, max_retries, retry_delay)
+            futures[future] = (job, version)
+        for future in as_completed(futures):
+            job, version = futures[future]
+            result, attempts, elapsed = future.result()
+            _update_stage(job, "extract", attempts=attempts, cached=False)
+            if isinstance(result, Exception):
+                fail_stage(job, "extract", elapsed, result)
+                continue
+            set_content_cache(job.resume.file_hash, "extraction", version, result)
+            job.resume.analysis_result = result
+            job.resume.save(update_fields=['analysis_result'])
+            finish_stage(job, "extract", elapsed)
+            extracted.append(job)
+    if not extracted:
+        return []
+
+    # 未命中缓存的简历一次性向量化
+    embedding_model = EmbeddingModel()
+    vectors = {}
+    versions = {}
+    for job in extracted:
+        start_stage(job, "embed")
+        version = _vector_version(embedding_model, job.resume.content)
+        vector = get_content_cache(job.resume.file_hash, "vector", version)
+        if vector is not CONTENT_CACHE_MISS:
+            vectors[job.id] = vector
+            _update_stage(job, "embed", cached=True)
+            finish_stage(job, "embed", 0)
+        else:
+            versions[job.id] = version
+    missing = [job for job in extracted if job.id not in vectors]
+    start = time.monotonic()
+    try:
+        embeddings = embedding_model.embed_documents([job.resume.content for job in missing]) if missing else []
+        if len(embeddings) != len(missing):
+            raise ValueError("文档向量化失败")
+    except Exception as exc:
+        for job in missing:
+            fail_stage(job, "embed", time.monotonic() - start, exc)
+        extracted = [job for job in extracted if job.id in vectors]
+        missing = []
+        embeddings = []
+    elapsed = time.monotonic() - start
+    for job, embedding in zip(missing, embeddings):
+        vectors[job.id] = [float(value) for value in embedding]
+        set_content_cache(job.resume.file_hash, "vector", versions[job.id], vectors[job.id])
+        _update_stage(job, "embed", cached=False)
+        finish_stage(job, "embed", elapsed)
+    if not extracted:
+        return []
+
+    # 一次批量写入
+    for job in extracted:
+        start_stage(job, "index")
+    start = time.monotonic()
+    try:
+        failed = index_resumes([
+            (job.resume.file_name, job.resume.content, job.resume.analysis_result, vectors[job.id])
+            for job in extracted
+        ])
+    except Exception as exc:
+        failed = {job.resume.file_name: str(exc) for job in extracted}
+    elapsed = time.monotonic() - start
+    succeeded = []
+    for job in extracted:
+        if job.resume.file_name in failed:
+            fail_stage(job, "index", elapsed, failed[job.resume.file_name])
+        else:
+            finish_stage(job, "index", elapsed)
+            succeeded.append(job.id)
+    return succeeded
+
+
+def ingest_batch_pipeline(job_ids):
+    """
+    批量入库任务: 各简历的解析分发到celery worker进程并行执行, 全部完成后进入 ingest_batch_finish
+    """
+    return chord(group(ingest_parse.s(job_id, raise_on_failure=False) for job_id in job_ids), ingest_batch_finish.s())
@@ -1,21 +1,30 @@
 # ... existing code ...
+import asyncio
+import logging
 import os
 import json
 import traceback
 import re
+import zipfile
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.conf import settings
-from dvadmin.hrms.models import Resume
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from dvadmin.hrms.models import Resume, ResumeIngestJob
+from dvadmin.hrms.tasks import INGEST_STAGES, RESUME_FILE_TYPES, ingest_pipeline, ingest_batch_pipeline, job_to_dict
+from dvadmin.utils.content_cache_util import file_sha256, get_content_cache_stats
 from dvadmin.utils.viewset import CustomModelViewSet
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.json_response import DetailResponse, SuccessResponse, ErrorResponse
 from dvadmin.utils.viewset import CustomModelViewSet
        # 调用简历解析接口
-from dvadmin.dputils.document_parser import parse_pdf, parse_docx
-from dvadmin.dputils.deepseek_chat import chatToLLM4Analysis, chatToLLM
-from dvadmin.dputils.es_vector_db import save_to_es, list_resume, search_resume
+from dvadmin.dputils.deepseek_chat import chatToLLM, chatToLLMStream, StreamingJsonField, find_json_object
+from dvadmin.dputils.es_vector_db import list_resume
+from dvadmin.dputils.hybrid_retriever import hybrid_search_resume, ahybrid_search_resume
 
+logger = logging.getLogger(__name__)
 
 
 class ResumeSerializer(CustomModelSerializer):
@@ -95,6 +104,94 @@ class ResumeViewSet(CustomModelViewSet):
         return file_id
     
     
+    def __create_ingest_job__(self, file, creator, job_description):
+        """
+        保存简历文件并创建入库任务, 返回(任务, 是否新建), 文件格式不支持时返回(None, False)
+        相同文件(SHA-256)已上传过时不再保存文件: 评分要求相同且任务未失败时直接返回已有任务,
+        否则在已有简历上创建新任务, ES中以文件名为主键覆盖原文档
+        """
+        file_type = file.name.split(".")[-1].lower()
+        if file_type not in RESUME_FILE_TYPES:
+            return None, False
+        file_hash = file_sha256(file)
+        resume = Resume.objects.filter(file_hash=file_hash).order_by('-create_datetime').first()
+        if resume:
+            job = resume.ingest_jobs.filter(job_description=job_description).exclude(status=3).first()
+            if job:
+                return job, False
+        else:
+            # 获取文件信息
+            file_id = self.__getfileid__()
+            file_name = file_id + "." + file_type
+            file_size = round(file.size / 1024)
+            # 重设置文件名
+            file.name = file_name
+
+            # 保存文件
+            resume = Resume.objects.create(
+                file=file,
+                file_hash=file_hash,
+                file_id=file_id,
+                file_name=file_name,
+                file_type=file_type,
+                file_size=file_size,
+                creator=creator
+            )
+        job = ResumeIngestJob.objects.create(
+            resume=resume,
+            job_description=job_description,
+            stages={name: {"status": "pending", "attempts": 0, "elapsed": None, "error": None}
+                    for name, _ in INGEST_STAGES},
+            creator=creator
+        )
+        return job, True
+
+    def __iter_zip_members__(self, archive):
+        """返回压缩包中的简历文件(ZipInfo, 文件名), 跳过目录及隐藏文件"""
+        for info in archive.infolist():
+            name = info.filename
+            if not info.flag_bits & 0x800:
+                # 未标记UTF-8的文件名按GBK解码, 兼容Windows下创建的压缩包
+                try:
+                    name = name.encode('cp437').decode('gbk')
+                except (UnicodeEncodeError, UnicodeDecodeError):
+                    pass
+            basename = os.path.basename(name)
+            if info.is_dir() or name.startswith('__MACOSX/') or basename.startswith('.'):
+                continue
+            yield info, basename
+
+    def __scan_upload_files__(self, files):
+        """
+        统计上传的文件, 只读取压缩包目录, 不解压
+        :return: (可解析的简历文件数, 最大的单个文件大小, 解压后的总大小), 大小为字节数
+        """
+        count = 0
+        max_size = 0
+        total_size = 0
+        for file in files:
+            if not file.name.lower().endswith('.zip'):
+                members = [(file.name, file.size)]
+            else:
+                with zipfile.ZipFile(file) as archive:
+                    members = [(name, info.file_size) for info, name in self.__iter_zip_members__(archive)]
+                file.seek(0)
+            for name, size in members:
+                count += name.split(".")[-1].lower() in RESUME_FILE_TYPES
+                max_size = max(max_size, size)
+                total_size += size
+        return count, max_size, total_size
+
+    def __iter_upload_files__(self, files):
+        """展开上传的文件, zip压缩包中的简历逐个返回"""
+        for file in files:
+            if not file.name.lower().endswith('.zip'):
+                yield file
+                continue
+            with zipfile.ZipFile(file) as archive:
+                for info, basename in self.__iter_zip_members__(archive):
+                    yield ContentFile(archive.read(info), name=basename)
+
     def detail(self, request, *args, **kwargs):
         """获取简历详情"""
         # TODO: 从ES数据库获取完整的简历信息，包括解析后的结构化数据
@@ -118,81 +215,162 @@ class ResumeViewSet(CustomModelViewSet):
         resume_description = request.data.get('job_description', '')
         # print("简历评分要求：", resume_description)
 
-        # 获取文件信息
-        file_id = self.__getfileid__()
-        file_name = file_id + "." + file.name.split(".")[-1]
-        file_size = round(file.size / 1024)
-        file_type = file_name.split(".")[-1]
-        # 重设置文件名
-        file._set_name(file_name)
-        
-        # 保存文件
-        resume = Resume.objects.create(
-            file=file,
-            file_id=file_id,
-            file_name=file_name,
-            file_type=file_type,
-            file_size=file_size
-        )
-
-        # 文件解析
-        document_markdown = ''
-        file_path = os.path.join(settings.MEDIA_ROOT, resume.file.name)
-        print("文件路径：", file_path)
-
-        if file.name.endswith('.pdf'):
-        # 解析PDF 使用magicpdf 解析成Markdown文件
-            document_markdown = parse_pdf(file_path)
-        elif file.name.endswith('.docx'):
-            # 解析DOCX
-            document_markdown = parse_docx(file_path)
-        else:
+        creator = request.user if request.user.is_authenticated else None
+        job, created = self.__create_ingest_job__(file, creator, resume_description)
+        if not job:
             return Response({"code": 4000, "msg": "不支持的文件格式"})
-
-        if not document_markdown or len(document_markdown.strip()) < 50:  # 设置最小内容长度阈值为50个字符
-            return Response({"code": 4000, "msg": "文件解析失败或内容过少，请检查上传的文件是否正确"})
-            
-        analysis = chatToLLM4Analysis(document_markdown, resume_description)
-
-        # 从analysis中提取json字符串
+        resume = job.resume
+        file_id = resume.file_id
+        file_name = resume.file_name
+        if not created:
+            # 重复上传, 返回已有的任务
+            return Response({
+                "code": 2000,
+                "msg": "简历已上传",
+                "data": {
+                    "id": file_id,
+                    "job_id": job.id,
+                    "file_name": file_name,
+                    "duplicate": True,
+                    "parsed_data": resume.analysis_result if job.status == 2 else None
+                }
+            })
+        # 解析、提取、向量化、写入由celery分阶段执行, 进度通过消息中心推送, 也可通过job接口查询
+        pipeline = ingest_pipeline(job.id)
         try:
-            # 查找json字符串的起始和结束位置
-            start_idx = analysis.find('{')
-            end_idx = analysis.rfind('}') + 1
-            if start_idx == -1 or end_idx == 0:
-                return Response({"code": 4000, "msg": "No valid JSON found in LLM output"})
-                
-            json_str = analysis[start_idx:end_idx]
-            # 解析JSON字符串
-            parsed_data = json.loads(json_str)
-            
-            # 验证必要字段是否存在
-            required_fields = ['name', 'phone', 'email', 'education', 'work_experience', 
-                'skills', 'projects', 'other','score','score_details']
-            for field in required_fields:
-                if field not in parsed_data:
-                    return Response({"code": 4000, "msg": f'Missing required field: {field}' })
-                    
-        except json.JSONDecodeError as e:
-            return Response({"code": 4000, "msg": f'Failed to parse JSON from LLM output: {str(e)}'})
+            pipeline.apply_async()
         except Exception as e:
-            return Response({"code": 4000, "msg": f'Error processing LLM output: {str(e)}'})
-
-        # 保存解析结果到es数据库
-        save_to_es(file_name,document_markdown,parsed_data)
-
-        print("解析结果：", parsed_data)
+            logger.exception(f"创建简历入库任务失败, 改为同步执行: {e}")
+            try:
+                pipeline.apply()
+            except Exception:
+                # 失败原因已记录在任务中
+                pass
+            job.refresh_from_db()
+            resume.refresh_from_db()
+            if job.status == 3:
+                return Response({"code": 4000, "msg": job.error, "data": job_to_dict(job)})
 
         return Response({
             "code": 2000,
             "msg": "上传成功",
             "data": {
                 "id": file_id,
+                "job_id": job.id,
                 "file_name": file_name,
-                "parsed_data": parsed_data
+                "parsed_data": resume.analysis_result if job.status == 2 else None
             }
         })
-    
+
+    @action(methods=["POST"], detail=False)
+    def batch_upload(self, request):
+        """批量上传简历文件, 支持多个文件或zip压缩包"""
+        files = request.FILES.getlist("files") or request.FILES.getlist("file")
+        if not files:
+            return Response({"code": 4000, "msg": "请上传文件"})
+        resume_description = request.data.get('job_description', '')
+        creator = request.user if request.user.is_authenticated else None
+        max_files = getattr(settings, 'RESUME_BATCH_MAX_FILES', 500)
+        max_file_size = getattr(settings, 'RESUME_BATCH_MAX_FILE_SIZE', 20 * 1024 * 1024)
+        max_total_size = getattr(settings, 'RESUME_BATCH_MAX_TOTAL_SIZE', 500 * 1024 * 1024)
+
+        # 先统计文件数及解压后的大小, 超出上限时不解压、不保存任何文件
+        try:
+            file_count, file_size, total_size = self.__scan_upload_files__(files)
+        except zipfile.BadZipFile:
+            return Response({"code": 4000, "msg": "压缩包格式错误"})
+        if file_count > max_files:
+            return Response({"code": 4000, "msg": f"单次最多上传{max_files}份简历"})
+        if file_size > max_file_size:
+            return Response({"code": 4000, "msg": f"单个文件不能超过{max_file_size // 1024 // 1024}MB"}, status=400)
+        if total_size > max_total_size:
+            return Response({"code": 4000, "msg": f"解压后的文件总大小不能超过{max_total_size // 1024 // 1024}MB"},
+                            status=400)
+
+        jobs = []
+        duplicates = []
+        skipped = []
+        try:
+            # 全部创建成功后再提交, 避免中途出错留下没有入库任务的简历
+            with transaction.atomic():
+                for file in self.__iter_upload_files__(files):
+                    job, created = self.__create_ingest_job__(file, creator, resume_description)
+                    if not job:
+                        skipped.append(file.name)
+                    elif created:
+                        jobs.append(job)
+                    elif job not in duplicates and job not in jobs:
+                        duplicates.append(job)
+        except Exception:
+            # 数据已回滚, 删除本次新保存的文件(回滚后已不存在的简历), 已有简历的文件保留
+            kept = set(Resume.objects.filter(pk__in=[job.resume_id for job in jobs]).values_list('pk', flat=True))
+            for job in jobs:
+                if job.resume_id not in kept:
+                    job.resume.file.delete(save=False)
+            raise
+        if not jobs and not duplicates:
+            return Response({"code": 4000, "msg": "没有可解析的简历文件(仅支持pdf、docx)"})
+
+        # 解析分发到celery worker并行执行, 完成后并发提取并一次批量写入ES, 重复上传的简历不再入库
+        job_ids = [job.id for job in jobs]
+        if job_ids:
+            pipeline = ingest_batch_pipeline(job_ids)
+            try:
+                pipeline.apply_async()
+            except Exception as e:
+                logger.exception(f"创建批量入库任务失败, 改为同步执行: {e}")
+                try:
+                    pipeline.apply()
+                except Exception:
+                    pass
+
+        return Response({
+            "code": 2000,
+            "msg": f"已创建{len(jobs)}个简历入库任务" + (f", {len(duplicates)}份简历已上传过" if duplicates else ""),
+            "data": {
+                "job_ids": job_ids,
+                "files": [{"job_id": job.id, "file_name": job.resume.file_name} for job in jobs],
+                "duplicates": [{"job_id": job.id, "file_name": job.resume.file_name} for job in duplicates],
+                "skipped": skipped
+            }
+        })
+
+    @action(methods=["GET"], detail=False, url_path="job/batch")
+    def job_batch_status(self, request):
+        """批量查询简历入库任务状态, ids以逗号分隔"""
+        ids = [i for i in request.query_params.get('ids', '').split(',') if i.isdigit()]
+        jobs = ResumeIngestJob.objects.select_related('resume').filter(pk__in=ids)
+        data = [job_to_dict(job) for job in jobs]
+        summary = {label: 0 for _, label in ResumeIngestJob.JOB_STATUS}
+        for item in data:
+            summary[item['status_label']] += 1
+        return Response({
+            "code": 2000,
+            "msg": "获取成功",
+            "data": {"summary": summary, "jobs": data}
+        })
+
+    @action(methods=["GET"], detail=False)
+    def cache_stats(self, request):
+        """解析、提取、向量化结果缓存的命中统计"""
+        return Response({
+            "code": 2000,
+            "msg": "获取成功",
+            "data": get_content_cache_stats()
+        })
+
+    @action(methods=["GET"], detail=False, url_path=r"job/(?P<job_id>\d+)")
+    def job_status(self, request, job_id=None):
+        """查询简历入库任务状态"""
+        job = ResumeIngestJob.objects.select_related('resume').filter(pk=job_id).first()
+        if not job:
+            return Response({"code": 4000, "msg": "任务不存在"})
+        return Response({
+            "code": 2000,
+            "msg": "获取成功",
+            "data": job_to_dict(job)
+        })
+
     @action(methods=["POST"], detail=False)
     def analyze(self, request):
         """分析简历内容"""
@@ -231,10 +409,18 @@ class ResumeViewSet(CustomModelViewSet):
 
     def list(self, request, *args, **kwargs):
         """获取简历列表"""
+        # 获取分页参数
+        page = int(request.query_params.get('page', 1))
+        size = int(request.query_params.get('size', 10))
+        sort_field = request.query_params.get('sort', 'score')
+        order = request.query_params.get('order', 'desc')
+        # 深度翻页时传入上一页返回的search_after(JSON数组)
+        search_after = request.query_params.get('search_after')
         try:
-            results = list_resume()
+            search_after = json.loads(search_after) if search_after else None
+            results = list_resume(page=page, size=size, sort_field=sort_field, order=order, search_after=search_after)
         except Exception as e:
-            print(f"获取简历列表失败: {str(e)}\n错误类型: {type(e).__name__}\n完整堆栈: ")
+            logger.exception(f"获取简历列表失败: {e}")
             return Response({
                 'code': 4000,
                 'error': f'获取简历列表失败: {str(e)}',
@@ -248,14 +434,11 @@ class ResumeViewSet(CustomModelViewSet):
                 'error_type': 'NoResumeFound'
             })
         
-        # 打印查询结果
-        # print("查询结果：", results)
-
-        print(f"查到{results['hits']['total']['value']}条数据，本次返回{len(results['hits']['hits'])}条")
+        logger.debug(f"查到{results['total']}条数据，本次返回{len(results['hits'])}条")
 
         # 处理返回结果
         resumes = []
-        for hit in results['hits']['hits']:
+        for hit in results['hits']:
             resume = {
                 'id': hit['_id'],
                 'name': hit['_source']['metadata']['name'],
@@ -272,23 +455,150 @@ class ResumeViewSet(CustomModelViewSet):
                 'upload_time': hit['_source']['metadata'].get('upload_time', '')
             }
             resumes.append(resume)
-        # 获取分页参数
-        page = int(request.query_params.get('page', 1))
-        size = int(request.query_params.get('size', 10))
-        
-        # 计算分页数据
-        start = (page - 1) * size
-        end = start + size
-        paged_resumes = resumes[start:end]
         
         return Response({
             'code': 2000,
-            'total': results['hits']['total']['value'],
+            'total': results['total'],
             'page': page,
             'size': size,
-            'data': paged_resumes
+            'search_after': results['hits'][-1].get('sort') if results['hits'] else None,
+            'data': resumes
         })
         
+    @staticmethod
+    def __build_search_query__(search_criteria):
+        """根据大模型给出的检索条件构建ES查询, 没有条件时返回None"""
+        # 构建搜索条件
+        query = {
+            "bool": {
+                "must": []
+            }
+        }
+
+        # 构建搜索条件
+        # 添加各种搜索条件
+        if 'name' in search_criteria and search_criteria['name']:
+            query['bool']['must'].append({
+                "match": {"metadata.name": search_criteria['name']}
+            })
+        
+        if 'email' in search_criteria and search_criteria['email']:
+            query['bool']['must'].append({
+                "match": {"metadata.email": search_criteria['email']}
+            })
+        
+        if 'phone' in search_criteria and search_criteria['phone']:
+            query['bool']['must'].append({
+                "match": {"metadata.phone": search_criteria['phone']}
+            })
+        
+        if 'skills' in search_criteria and search_criteria['skills']:
+            # 处理skills作为列表的情况
+            skill_queries = []
+            for skill in search_criteria['skills']:
+                skill_queries.append({
+                    "match": {"metadata.skills": skill}
+                })
+                
+            if skill_queries:
+                query['bool']['must'].append({
+                    "bool": {
+                        "should": skill_queries,
+                        "minimum_should_match": 1
+                    }
+                })
+
+        if 'experience' in search_criteria and search_criteria['experience']:
+            query['bool']['must'].append({
+                "match": {"metadata.experience": search_criteria['experience']}
+            })
+
+        if 'education' in search_criteria and search_criteria['education']:
+            query['bool']['must'].append({
+                "match": {"metadata.education": search_criteria['education']}
+            })
+        
+        if 'projects' in search_criteria and search_criteria['projects']:
+            # 处理projects作为列表的情况
+            project_queries = []
+            for project in search_criteria['projects']:
+                project_queries.append({
+                    "match": {"metadata.projects": project}
+                })
+            
+            if project_queries:
+                query['bool']['must'].append({
+                    "bool": {
+                        "should": project_queries,
+                        "minimum_should_match": 1
+                    }
+                })
+
+        if 'gender' in search_criteria and search_criteria['gender']:
+            query['bool']['must'].append({
+                "match": {"metadata.gender": search_criteria['gender']}
+            })
+        
+        if 'score_range' in search_criteria and search_criteria['score_range']:
+            query['bool']['must'].append({
+                "range": {"metadata.score": {
+                    "gte": search_criteria['score_range'][0],
+                    "lte": search_criteria['score_range'][1]
+                }}
+            })
+        
+        if 'other' in search_criteria and search_criteria['other']:
+            query['bool']['must'].append({
+                "match": {"metadata.other": search_criteria['other']}
+            })
+
+        return query if query['bool']['must'] else None
+
+    @staticmethod
+    def __format_candidate__(hit):
+        """检索结果转换为候选人信息"""
+        return {
+            'id': hit['_id'],
+            'name': hit['_source']['metadata']['name'],
+            'phone': hit['_source']['metadata'].get('phone', ''),
+            'email': hit['_source']['metadata'].get('email', ''),
+            'education': hit['_source']['metadata'].get('education', ''),
+            'score': hit['_source']['metadata'].get('score', ''),
+            'filename': hit['_source']['metadata']['filename'],
+            'upload_time': hit['_source']['metadata'].get('upload_time', '')
+        }
+
+    @staticmethod
+    def __search_filters__(criteria_query):
+        """检索条件中的范围条件, 作为两路检索共同的过滤条件"""
+        filters = [clause for clause in criteria_query['bool']['must'] if 'range' in clause] if criteria_query else []
+        return filters or None
+
+    @staticmethod
+    def __search_candidates__(message, criteria_query, page, size):
+        """
+        混合检索候选人, 检索条件只用于词法检索评分, 向量检索按与对话内容的语义相似度召回;
+        评分范围等范围条件是硬性要求, 同时作为两路检索的过滤条件
+        """
+        return hybrid_search_resume(
+            message,
+            lexical_query=criteria_query,
+            filters=ResumeViewSet.__search_filters__(criteria_query),
+            page=page,
+            size=size
+        )
+
+    @staticmethod
+    async def __asearch_candidates__(message, criteria_query, page, size):
+        """混合检索候选人的异步版本, 用于流式对话, 检索方式同 __search_candidates__"""
+        return await ahybrid_search_resume(
+            message,
+            lexical_query=criteria_query,
+            filters=ResumeViewSet.__search_filters__(criteria_query),
+            page=page,
+            size=size
+        )
+
     @action(methods=["POST"], detail=False, url_path="chat")
     def handle_chat(self, request, *args, **kwargs):
         try:
@@ -315,137 +625,38 @@ class ResumeViewSet(CustomModelViewSet):
                 })
             # 简历列表
             candidates = []
-            # 构建搜索条件
-            query = {
-                "bool": {
-                    "must": []
-                }
-            }
-
-            # 构建搜索条件
-            search_criteria = parsed_response['search_criteria']
-            # 添加各种搜索条件
-            if 'name' in search_criteria and search_criteria['name']:
-                query['bool']['must'].append({
-                    "match": {"metadata.name": search_criteria['name']}
-                })
-            
-            if 'email' in search_criteria and search_criteria['email']:
-                query['bool']['must'].append({
-                    "match": {"metadata.email": search_criteria['email']}
-                })
-            
-            if 'phone' in search_criteria and search_criteria['phone']:
-                query['bool']['must'].append({
-                    "match": {"metadata.phone": search_criteria['phone']}
-                })
-            
-            if 'skills' in search_criteria and search_criteria['skills']:
-                # 处理skills作为列表的情况
-                skill_queries = []
-                for skill in search_criteria['skills']:
-                    skill_queries.append({
-                        "match": {"metadata.skills": skill}
-                    })
-                    
-                if skill_queries:
-                    query['bool']['must'].append({
-                        "bool": {
-                            "should": skill_queries,
-                            "minimum_should_match": 1
-                        }
-                    })
-
-            if 'experience' in search_criteria and search_criteria['experience']:
-                query['bool']['must'].append({
-                    "match": {"metadata.experience": search_criteria['experience']}
-                })
+            criteria_query = self.__build_search_query__(parsed_response['search_criteria'])
 
-            if 'education' in search_criteria and search_criteria['education']:
-                query['bool']['must'].append({
-                    "match": {"metadata.education": search_criteria['education']}
-                })
-            
-            if 'projects' in search_criteria and search_criteria['projects']:
-                # 处理projects作为列表的情况
-                project_queries = []
-                for project in search_criteria['projects']:
-                    project_queries.append({
-                        "match": {"metadata.projects": project}
-                    })
-                
-                if project_queries:
-                    query['bool']['must'].append({
-                        "bool": {
-                            "should": project_queries,
-                            "minimum_should_match": 1
-                        }
-                    })
-
-            if 'gender' in search_criteria and search_criteria['gender']:
-                query['bool']['must'].append({
-                    "match": {"metadata.gender": search_criteria['gender']}
-                })
-            
-            if 'score_range' in search_criteria and search_criteria['score_range']:
-                query['bool']['must'].append({
-                    "range": {"metadata.score": {
-                        "gte": search_criteria['score_range'][0],
-                        "lte": search_criteria['score_range'][1]
-                    }}
-                })
-            
-            if 'other' in search_criteria and search_criteria['other']:
-                query['bool']['must'].append({
-                    "match": {"metadata.other": search_criteria['other']}
-                })
+            # 获取分页参数
+            page = int(request.query_params.get('page', 1))
+            size = int(request.query_params.get('size', 10))
 
+            # 检索条件只用于词法检索评分, 向量检索按与对话内容的语义相似度召回, 评分范围同时过滤两路结果
+            results = {'window_total': 0, 'hits': []}
             try:
-                # 连接ES数据库
-                # 执行搜索
-                results = search_resume(
-                    query=query
-                )
-
-                print(f"搜索到{results['hits']['total']['value']}条数据")
+                results = self.__search_candidates__(message, criteria_query, page, size)
+                logger.info(f"融合窗口内共{results['window_total']}条数据")
             except Exception as e:
-                print(f"搜索候选人失败: {str(e)}")
+                logger.exception(f"搜索候选人失败: {e}")
                 parsed_response['reply'] += "\n\n搜索数据库时发生错误，请稍后重试。"
             # 处理搜索结果
-            for hit in results['hits']['hits']:
-                candidate = {
-                    'id': hit['_id'],
-                    'name': hit['_source']['metadata']['name'],
-                    'phone': hit['_source']['metadata'].get('phone', ''),
-                    'email': hit['_source']['metadata'].get('email', ''),
-                    'education': hit['_source']['metadata'].get('education', ''),
-                    'score': hit['_source']['metadata'].get('score', ''),
-                    'filename': hit['_source']['metadata']['filename'],
-                    'upload_time': hit['_source']['metadata'].get('upload_time', '')
-                }
-                candidates.append(candidate)
+            for hit in results['hits']:
+                candidates.append(self.__format_candidate__(hit))
 
 
             # 将搜索结果添加到回复中
             parsed_response['reply'] += f"\n\n找到以下{len(candidates)}位候选人：\n"
             for candidate in candidates:
                 parsed_response['reply'] += f"\n- {candidate['name']} | {candidate['education']} | 评分：{candidate['score']}"
-            
-                    # 获取分页参数
-            page = int(request.query_params.get('page', 1))
-            size = int(request.query_params.get('size', 10))
-            
-            # 计算分页数据
-            start = (page - 1) * size
-            end = start + size
-            paged_resumes = candidates[start:end]
+            paged_resumes = candidates
             
             return Response({
                 'success': True,
                 'need_search': True,
                 'reply': parsed_response['reply'],  # 按照要求将响应放在data.reply字段中
                 'data': {
-                    'total': len(paged_resumes),
+                    # 融合窗口内的结果数, 不是命中总数
+                    'window_total': results['window_total'],
                     'page': page,
                     'size': size,
                     'data': paged_resumes
@@ -459,4 +670,109 @@ class ResumeViewSet(CustomModelViewSet):
                 'error': f'聊天处理失败: {str(e)}',
                 'error_type': type(e).__name__,
                 'stack_trace': traceback.format_exc().splitlines()
-            }, status=500)  # 使用status参数而不是元组
\ No newline at end of file
+            }, status=500)  # 使用status参数而不是元组
+
+    @staticmethod
+    def __sse_event__(event, data):
+        """构建一条SSE消息"""
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    @action(methods=["POST"], detail=False, url_path="chat/stream")
+    def chat_stream(self, request, *args, **kwargs):
+        """
+        流式对话, 以SSE逐段返回大模型的回复
+        检索条件生成完毕后立即开始检索候选人, 与回复的生成同时进行
+        事件依次为: token(回复片段) / criteria(检索条件) / candidates(候选人) / done(与对话接口相同的完整结果) / error
+        :param request:
+        :return:
+        """
+        message = request.data.get('message', '')
+        if not message:
+            return ErrorResponse(msg="用户对话内容为空")
+        page = int(request.query_params.get('page', 1))
+        size = int(request.query_params.get('size', 10))
+
+        async def event_stream():
+            search_task = None
+            try:
+                text = ''
+                reply_field = StreamingJsonField('reply')
+                async for delta in chatToLLMStream(message):
+                    text += delta
+                    reply = reply_field.feed(text)
+                    if reply:
+                        yield self.__sse_event__('token', {'text': reply})
+                    if search_task is None and re.search(r'"need_search"\s*:\s*true', text, re.IGNORECASE):
+                        search_criteria = find_json_object(text, 'search_criteria')
+                        if search_criteria is not None:
+                            criteria_query = self.__build_search_query__(search_criteria)
+                            search_task = asyncio.ensure_future(
+                                self.__asearch_candidates__(message, criteria_query, page, size)
+                            )
+                            yield self.__sse_event__('criteria', search_criteria)
+
+                try:
+                    parsed_response = self.__parse_llm_response__(text)
+                except ValueError as e:
+                    yield self.__sse_event__('error', {'msg': f'解析LLM返回内容时出错: {str(e)}'})
+                    return
+                if not parsed_response['need_search']:
+                    yield self.__sse_event__('done', {
+                        'success': True,
+                        'need_search': False,
+                        'reply': parsed_response['reply']
+                    })
+                    return
+                if search_task is None:
+                    # 检索条件未能在流式输出中提前解析时, 以完整结果检索
+                    criteria_query = self.__build_search_query__(parsed_response['search_criteria'])
+                    search_task = asyncio.ensure_future(
+                        self.__asearch_candidates__(message, criteria_query, page, size)
+                    )
+                results = {'window_total': 0, 'hits': []}
+                summary = ''
+                try:
+                    results = await search_task
+                except Exception as e:
+                    logger.exception(f"搜索候选人失败: {e}")
+                    summary += "\n\n搜索数据库时发生错误，请稍后重试。"
+                candidates = [self.__format_candidate__(hit) for hit in results['hits']]
+                yield self.__sse_event__('candidates', {
+                    # 融合窗口内的结果数, 不是命中总数
+                    'window_total': results['window_total'],
+                    'page': page,
+                    'size': size,
+                    'data': candidates
+                })
+
+                summary += f"\n\n找到以下{len(candidates)}位候选人：\n"
+                for candidate in candidates:
+                    summary += f"\n- {candidate['name']} | {candidate['education']} | 评分：{candidate['score']}"
+                yield self.__sse_event__('token', {'text': summary})
+                yield self.__sse_event__('done', {
+                    'success': True,
+                    'need_search': True,
+                    'reply': parsed_response['reply'] + summary,
+                    'data': {
+                        # 融合窗口内的结果数, 不是命中总数
+                        'window_total': results['window_total'],
+                        'page': page,
+                        'size': size,
+                        'data': candidates
+                    }
+                })
+            except Exception as e:
+                logger.exception(f"聊天处理失败: {e}")
+                yield self.__sse_event__('error', {
+                    'msg': f'聊天处理失败: {str(e)}',
+                    'error_type': type(e).__name__
+                })
+            finally:
+                if search_task is not None and not search_task.done():
+                    search_task.cancel()
+
+        response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # 关闭nginx的响应缓冲, 使回复片段及时送达
+        response['X-Accel-Buffering'] = 'no'
+        return response
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SystemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dvadmin.system'
+
+    def ready(self):
+        # 注册缓存刷新的信号处理
+        from dvadmin.system import receivers  # noqa: F401
@@ -0,0 +1,24 @@
+from django.core.management import BaseCommand
+from django.db import connection
+
+from application import dispatch
+from dvadmin.system.models import DeptClosure
+
+
+class Command(BaseCommand):
+    """
+    重建部门层级索引命令: python manage.py rebuild_dept_closure
+    """
+
+    def handle(self, *args, **options):
+        print("正在重建部门层级索引...")
+        if dispatch.is_tenants_mode():
+            from django_tenants.utils import get_tenant_model
+            from django_tenants.utils import tenant_context
+            for tenant in get_tenant_model().objects.exclude(schema_name='public'):
+                with tenant_context(tenant):
+                    DeptClosure.rebuild()
+                    print(f"租户[{connection.tenant.schema_name}]部门层级索引重建完成！")
+        else:
+            DeptClosure.rebuild()
+        print("部门层级索引重建完成！")
@@ -0,0 +1,25 @@
+from django.core.management import BaseCommand
+from django.db import connection
+
+from application import dispatch
+from dvadmin.system.views.menu import warm_web_router
+
+
+class Command(BaseCommand):
+    """
+    预热前端路由缓存命令: python manage.py warm_web_router
+    """
+
+    def handle(self, *args, **options):
+        print("正在预热前端路由缓存...")
+        if dispatch.is_tenants_mode():
+            from django_tenants.utils import get_tenant_model
+            from django_tenants.utils import tenant_context
+            for tenant in get_tenant_model().objects.exclude(schema_name='public'):
+                with tenant_context(tenant):
+                    count = warm_web_router()
+                    print(f"租户[{connection.tenant.schema_name}]预热{count}个角色组合！")
+        else:
+            count = warm_web_router()
+            print(f"预热{count}个角色组合！")
+        print("前端路由缓存预热完成！")
@@ -4,7 +4,7 @@ from time import time
 from pathlib import PurePosixPath
 
 from django.contrib.auth.models import AbstractUser, UserManager
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from application import dispatch
 from dvadmin.utils.models import CoreModel, table_prefix, get_custom_app_models
@@ -163,6 +163,60 @@ class Dept(CoreModel):
                 cls.recursion_all_dept(ele.get("id"), dept_all_list, dept_list)
         return list(set(dept_list))
 
+    @classmethod
+    def descendant_ids(cls, dept_id, include_self=True):
+        """
+        通过部门层级索引获取部门的所有下级部门id
+        :param dept_id: 需要获取的部门id, 可为字符串形式的id
+        :param include_self: 是否包含部门本身
+        :return:
+        """
+        dept_id = cls._meta.pk.to_python(dept_id)
+        closure_list = list(
+            DeptClosure.objects.filter(ancestor_id=dept_id).values_list("descendant_id", "depth")
+        )
+        if not closure_list and cls.objects.filter(id=dept_id).exists():
+            # 部门层级索引尚未建立(历史数据, 执行migrate或rebuild_dept_closure命令后建立), 按上级关系计算, 查询时不写入
+            return cls.descendant_ids_by_parent([dept_id], include_self)[dept_id]
+        return [descendant_id for descendant_id, depth in closure_list if include_self or depth > 0]
+
+    @classmethod
+    def descendant_ids_by_parent(cls, dept_ids, include_self=True):
+        """
+        根据部门的上级关系在内存中计算多个部门各自的所有下级部门id, 只需一次查询, 用于部门层级索引尚未建立时
+        :param dept_ids: 需要获取的部门id列表
+        :param include_self: 是否包含部门本身
+        :return: {部门id: [下级部门id]}
+        """
+        children = {}
+        for child_id, parent_id in cls.objects.values_list("id", "parent_id"):
+            children.setdefault(parent_id, []).append(child_id)
+        result = {}
+        for dept_id in dept_ids:
+            descendants = [dept_id] if include_self else []
+            visited = {dept_id}
+            stack = [dept_id]
+            while stack:
+                for child_id in children.get(stack.pop(), []):
+                    if child_id not in visited:
+                        visited.add(child_id)
+                        descendants.append(child_id)
+                        stack.append(child_id)
+            result[dept_id] = descendants
+        return result
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            is_new = self._state.adding
+            old_parent_id = None
+            if not is_new:
+                old_parent_id = Dept.objects.filter(id=self.id).values_list("parent_id", flat=True).first()
+            super().save(*args, **kwargs)
+            if is_new:
+                DeptClosure.insert_node(self)
+            elif old_parent_id != self.parent_id:
+                DeptClosure.move_node(self)
+
     class Meta:
         db_table = table_prefix + "system_dept"
         verbose_name = "部门表"
@@ -170,6 +224,90 @@ class Dept(CoreModel):
         ordering = ("sort",)
 
 
+class DeptClosure(models.Model):
+    """
+    部门层级索引(闭包表), 每个部门与其所有上级部门(含自身)各保存一行
+    随部门新增/移动维护, 删除部门时级联删除
+    """
+    ancestor = models.ForeignKey(
+        to="Dept",
+        db_constraint=False,
+        related_name="descendant_closure",
+        on_delete=models.CASCADE,
+        verbose_name="上级部门",
+        help_text="上级部门",
+    )
+    descendant = models.ForeignKey(
+        to="Dept",
+        db_constraint=False,
+        related_name="ancestor_closure",
+        on_delete=models.CASCADE,
+        verbose_name="下级部门",
+        help_text="下级部门",
+    )
+    depth = models.IntegerField(default=0, verbose_name="层级距离", help_text="层级距离")
+
+    class Meta:
+        db_table = table_prefix + "system_dept_closure"
+        verbose_name = "部门层级索引表"
+        verbose_name_plural = verbose_name
+        unique_together = (("ancestor", "descendant"),)
+
+    @classmethod
+    def insert_node(cls, dept):
+        """
+        新增部门时, 继承上级部门的所有上级
+        """
+        rows = [cls(ancestor_id=dept.id, descendant_id=dept.id, depth=0)]
+        if dept.parent_id:
+            for ancestor_id, depth in cls.objects.filter(descendant_id=dept.parent_id).values_list(
+                    "ancestor_id", "depth"):
+                rows.append(cls(ancestor_id=ancestor_id, descendant_id=dept.id, depth=depth + 1))
+        cls.objects.bulk_create(rows)
+
+    @classmethod
+    def move_node(cls, dept):
+        """
+        移动部门时, 断开整棵子树与原上级的关联, 再关联到新上级
+        """
+        subtree = list(cls.objects.filter(ancestor_id=dept.id).values_list("descendant_id", "depth"))
+        if not subtree:
+            cls.rebuild()
+            return
+        subtree_ids = [descendant_id for descendant_id, _ in subtree]
+        if dept.parent_id in subtree_ids:
+            raise ValidationError("不能将部门移动到其下级部门")
+        cls.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+        if not dept.parent_id:
+            return
+        ancestors = list(cls.objects.filter(descendant_id=dept.parent_id).values_list("ancestor_id", "depth"))
+        cls.objects.bulk_create([
+            cls(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=ancestor_depth + depth + 1)
+            for ancestor_id, ancestor_depth in ancestors
+            for descendant_id, depth in subtree
+        ])
+
+    @classmethod
+    def rebuild(cls):
+        """
+        根据部门的上级关系重建全部层级索引
+        """
+        parent_map = dict(Dept.objects.values_list("id", "parent_id"))
+        rows = []
+        for dept_id in parent_map:
+            depth = 0
+            node_id = dept_id
+            visited = set()
+            while node_id is not None and node_id in parent_map and node_id not in visited:
+                visited.add(node_id)
+                rows.append(cls(ancestor_id=node_id, descendant_id=dept_id, depth=depth))
+                node_id = parent_map[node_id]
+                depth += 1
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rows, batch_size=1000)
+
+
 class Menu(CoreModel):
     parent = models.ForeignKey(
         to="Menu",
@@ -381,12 +519,17 @@ class Dictionary(CoreModel):
         ordering = ("sort",)
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        old_parent_id = None
+        if not self._state.adding:
+            old_parent_id = Dictionary.objects.filter(id=self.id).values_list("parent_id", flat=True).first()
         super().save(force_insert, force_update, using, update_fields)
-        dispatch.refresh_dictionary()  # 有更新则刷新字典配置
+        # 有更新则刷新字典配置, 只重新加载本字典及其上级字典
+        dispatch.refresh_dictionary(dictionary_ids=[self.id, self.parent_id, old_parent_id])
 
     def delete(self, using=None, keep_parents=False):
+        dictionary_ids = [self.id, self.parent_id]
         res = super().delete(using, keep_parents)
-        dispatch.refresh_dictionary()
+        dispatch.refresh_dictionary(dictionary_ids=dictionary_ids)
         return res
 
 
@@ -414,6 +557,8 @@ class OperationLog(CoreModel):
         verbose_name = "操作日志"
         verbose_name_plural = verbose_name
         ordering = ("-create_datetime",)
+        # 游标分页按(创建时间, id)倒序取数
+        indexes = [models.Index(fields=["-create_datetime", "-id"], name="operation_log_keyset_idx")]
 
 
 def media_file_name(instance, filename):
@@ -600,6 +745,8 @@ class LoginLog(CoreModel):
         verbose_name = "登录日志"
         verbose_name_plural = verbose_name
         ordering = ("-create_datetime",)
+        # 游标分页按(创建时间, id)倒序取数
+        indexes = [models.Index(fields=["-create_datetime", "-id"], name="login_log_keyset_idx")]
 
 
 class MessageCenter(CoreModel):
@@ -653,6 +800,7 @@ class DownloadCenter(CoreModel):
     url = models.FileField(upload_to=media_file_name_downloadcenter, null=True, blank=True)
     size = models.BigIntegerField(default=0, verbose_name="文件大小", help_text="文件大小")
     md5sum = models.CharField(max_length=36, null=True, blank=True, verbose_name="文件md5", help_text="文件md5")
+    progress = models.SmallIntegerField(default=0, verbose_name="任务进度", help_text="任务进度(百分比)")
 
     def save(self, *args, **kwargs):
         if self.url:
@@ -672,3 +820,21 @@ class DownloadCenter(CoreModel):
         ordering = ("-create_datetime",)
 
 
+
+
+class ContentCache(CoreModel):
+    """
+    按文件内容SHA-256寻址的解析结果缓存, 相同文件重复上传时复用解析、提取及向量化结果
+    """
+    content_hash = models.CharField(max_length=64, db_index=True, verbose_name="内容哈希", help_text="文件内容SHA-256")
+    kind = models.CharField(max_length=20, verbose_name="缓存类型", help_text="markdown/extraction/vector")
+    version = models.CharField(max_length=64, verbose_name="版本", help_text="解析器、提示词或模型版本的哈希")
+    value = models.JSONField(verbose_name="缓存内容", help_text="缓存内容")
+    hit_count = models.IntegerField(default=0, verbose_name="命中次数", help_text="命中次数")
+
+    class Meta:
+        db_table = table_prefix + "content_cache"
+        verbose_name = "内容缓存"
+        verbose_name_plural = verbose_name
+        ordering = ("-create_datetime",)
+        unique_together = ("content_hash", "kind", "version")
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 模型变更信号处理, 用于刷新各类缓存的版本号及维护部门层级索引
+"""
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed, post_migrate
+from django.dispatch import receiver
+
+from dvadmin.system.models import ApiWhiteList, MenuButton, RoleMenuButtonPermission, Role, Users, Dept, Menu, \
+    RoleMenuPermission, DeptClosure
+from dvadmin.system.views.menu import WEB_ROUTER_CACHE_NAMESPACE
+from dvadmin.utils.cache_util import bump_cache_version, get_tenant_namespace
+from dvadmin.utils.filters import DATA_SCOPE_CACHE_NAMESPACE
+from dvadmin.utils.permission import API_PERMISSION_CACHE_NAMESPACE
+from dvadmin.utils.serializers import user_name_cache_key
+
+
+def _is_pre_m2m_action(kwargs):
+    """多对多变更信号只在变更完成后处理"""
+    action = kwargs.get('action')
+    return bool(action) and not action.startswith('post_')
+
+
+@receiver(post_save, sender=ApiWhiteList)
+@receiver(post_delete, sender=ApiWhiteList)
+@receiver(post_save, sender=MenuButton)
+@receiver(post_delete, sender=MenuButton)
+@receiver(post_save, sender=RoleMenuButtonPermission)
+@receiver(post_delete, sender=RoleMenuButtonPermission)
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+@receiver(m2m_changed, sender=Users.role.through)
+def refresh_api_permission_cache(sender, **kwargs):
+    """接口白名单/按钮/角色按钮权限/用户角色变更时, 刷新接口权限及数据权限缓存"""
+    if _is_pre_m2m_action(kwargs):
+        return
+    bump_cache_version(get_tenant_namespace(API_PERMISSION_CACHE_NAMESPACE))
+    bump_cache_version(get_tenant_namespace(DATA_SCOPE_CACHE_NAMESPACE))
+
+
+@receiver(post_save, sender=Dept)
+@receiver(post_delete, sender=Dept)
+@receiver(m2m_changed, sender=RoleMenuButtonPermission.dept.through)
+def refresh_data_scope_cache(sender, **kwargs):
+    """部门/自定数据权限部门变更时, 刷新数据权限缓存"""
+    if _is_pre_m2m_action(kwargs):
+        return
+    bump_cache_version(get_tenant_namespace(DATA_SCOPE_CACHE_NAMESPACE))
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+@receiver(post_save, sender=RoleMenuPermission)
+@receiver(post_delete, sender=RoleMenuPermission)
+def refresh_web_router_cache(sender, **kwargs):
+    """菜单/角色菜单权限变更时, 刷新前端路由缓存"""
+    bump_cache_version(get_tenant_namespace(WEB_ROUTER_CACHE_NAMESPACE))
+
+
+@receiver(post_save, sender=Users)
+@receiver(post_delete, sender=Users)
+def refresh_user_name_cache(sender, instance, **kwargs):
+    """用户变更时, 清除当前租户下审计字段使用的用户姓名缓存"""
+    cache.delete(user_name_cache_key(instance.pk))
+
+
+@receiver(post_migrate, dispatch_uid="dvadmin.system.build_dept_closure")
+def build_dept_closure(sender, **kwargs):
+    """migrate后为历史部门数据建立部门层级索引, 已建立时跳过"""
+    if getattr(sender, "name", None) != "dvadmin.system":
+        return
+    if Dept.objects.exists() and not DeptClosure.objects.exists():
+        DeptClosure.rebuild()
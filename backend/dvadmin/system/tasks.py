@@ -1,107 +1,53 @@
+import os
+import tempfile
 from hashlib import md5
-from io import BytesIO
-from datetime import datetime
-from time import sleep
 
-from openpyxl import Workbook
-from openpyxl.worksheet.table import Table, TableStyleInfo
-from openpyxl.utils import get_column_letter
-from django.core.files.base import ContentFile
+from django.core.files import File
 
 from application.celery import app
 from dvadmin.system.models import DownloadCenter
+from dvadmin.utils.import_export import build_export_view, export_to_excel, iter_export_rows
 
-def is_number(num):
-    try:
-        float(num)
-        return True
-    except ValueError:
-        pass
-
-    try:
-        import unicodedata
-        unicodedata.numeric(num)
-        return True
-    except (TypeError, ValueError):
-        pass
-    return False
-
-def get_string_len(string):
+@app.task
+def async_export_data(view_path: str, user_id: int, path: str, method: str, query_params: dict, view_kwargs: dict,
+                      filename: str, dcid: int, export_field_label: dict):
     """
-    获取字符串最大长度
-    :param string:
-    :return:
+    异步导出
+    任务只接收查询参数, 在worker中重建查询集后分批序列化, 流式写入临时文件
     """
-    length = 4
-    if string is None:
-        return length
-    if is_number(string):
-        return length
-    for char in string:
-        length += 2.1 if ord(char) > 256 else 1
-    return round(length, 1) if length <= 50 else 50
-
-@app.task
-def async_export_data(data: list, filename: str, dcid: int, export_field_label: dict):
     instance = DownloadCenter.objects.get(pk=dcid)
     instance.task_status = 1
     instance.save()
-    sleep(2)
+    fd, file_path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
     try:
-        wb = Workbook()
-        ws = wb.active
-        header_data = ["序号", *export_field_label.values()]
-        hidden_header = ["#", *export_field_label.keys()]
-        df_len_max = [get_string_len(ele) for ele in header_data]
-        row = get_column_letter(len(export_field_label) + 1)
-        column = 1
-        ws.append(header_data)
-        for index, results in enumerate(data):
-            results_list = []
-            for h_index, h_item in enumerate(hidden_header):
-                for key, val in results.items():
-                    if key == h_item:
-                        if val is None or val == "":
-                            results_list.append("")
-                        elif isinstance(val, datetime):
-                            val = val.strftime("%Y-%m-%d %H:%M:%S")
-                            results_list.append(val)
-                        else:
-                            results_list.append(val)
-                        # 计算最大列宽度
-                        result_column_width = get_string_len(val)
-                        if h_index != 0 and result_column_width > df_len_max[h_index]:
-                            df_len_max[h_index] = result_column_width
-            ws.append([index + 1, *results_list])
-            column += 1
-        # 　更新列宽
-        for index, width in enumerate(df_len_max):
-            ws.column_dimensions[get_column_letter(index + 1)].width = width
-        tab = Table(displayName="Table", ref=f"A1:{row}{column}")  # 名称管理器
-        style = TableStyleInfo(
-            name="TableStyleLight11",
-            showFirstColumn=True,
-            showLastColumn=True,
-            showRowStripes=True,
-            showColumnStripes=True,
+        view = build_export_view(view_path, user_id, path, method, query_params, view_kwargs)
+        queryset = view.filter_queryset(view.get_queryset())
+
+        def update_progress(progress):
+            DownloadCenter.objects.filter(pk=dcid).update(progress=progress)
+
+        export_to_excel(
+            iter_export_rows(queryset, view.export_serializer_class, view.request),
+            export_field_label,
+            file_path,
+            total=queryset.count(),
+            progress_callback=update_progress,
+            max_width=view.export_column_width,
         )
-        tab.tableStyleInfo = style
-        ws.add_table(tab)
-        stream = BytesIO()
-        wb.save(stream)
-        stream.seek(0)
         s = md5()
-        while True:
-            chunk = stream.read(1024)
-            if not chunk:
-                break
-            s.update(chunk)
-        stream.seek(0)
-        instance.md5sum = s.hexdigest()
-        instance.file_name = filename
-        instance.url.save(filename, ContentFile(stream.read()))
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                s.update(chunk)
+            f.seek(0)
+            instance.md5sum = s.hexdigest()
+            instance.file_name = filename
+            instance.url.save(filename, File(f), save=False)
         instance.task_status = 2
+        instance.progress = 100
     except Exception as e:
         instance.task_status = 3
         instance.description = str(e)[:250]
+    finally:
+        os.remove(file_path)
     instance.save()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 树形列表接口的查询数回归测试
+列表查询数应与行数无关, 数据量足够时逐行查询会超出视图集声明的查询预算
+"""
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from dvadmin.system.models import Area, Dept, Menu, MenuButton, Users
+from dvadmin.system.views.area import AreaViewSet
+from dvadmin.system.views.dept import DeptViewSet
+from dvadmin.system.views.menu import MenuViewSet
+from dvadmin.utils.query_util import get_query_budget, query_budget
+
+# 每个父节点下的子节点数, 需明显大于查询预算
+ROW_COUNT = 20
+
+
+class TreeListQueryBudgetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Users.objects.create(username="query_budget_admin", name="admin", is_superuser=True)
+        cls.dept = Dept.objects.create(name="root", key="root")
+        cls.area = Area.objects.create(name="省", code="11", level=1, pinyin="sheng", initials="S")
+        cls.menu = Menu.objects.create(name="root", web_path="/root")
+        for i in range(ROW_COUNT):
+            dept = Dept.objects.create(name=f"dept{i}", key=f"dept{i}", parent=cls.dept)
+            Dept.objects.create(name=f"sub_dept{i}", key=f"sub_dept{i}", parent=dept)
+            Users.objects.create(username=f"query_budget_user{i}", name=f"user{i}", dept=dept,
+                                 creator=cls.user, modifier=str(cls.user.id))
+            area = Area.objects.create(name=f"市{i}", code=f"11{i:02d}", level=2, pinyin="shi", initials="S",
+                                       pcode=cls.area, creator=cls.user, modifier=str(cls.user.id))
+            Area.objects.create(name=f"区{i}", code=f"11{i:02d}01", level=3, pinyin="qu", initials="Q", pcode=area)
+            menu = Menu.objects.create(name=f"menu{i}", web_path=f"/menu{i}", parent=cls.menu,
+                                       creator=cls.user, modifier=str(cls.user.id))
+            Menu.objects.create(name=f"sub_menu{i}", web_path=f"/sub_menu{i}", parent=menu)
+            MenuButton.objects.create(menu=menu, name=f"button{i}", value=f"button{i}", api="/api/test/", method=0)
+
+    def get_list(self, viewset, params):
+        """在视图集声明的查询预算内请求列表接口"""
+        request = APIRequestFactory().get("/", params)
+        force_authenticate(request, self.user)
+        budget = get_query_budget(viewset, "list")
+        self.assertIsNotNone(budget)
+        with query_budget(budget, f"{viewset.__name__}.list"):
+            response = viewset.as_view({"get": "list"})(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_area_list(self):
+        data = self.get_list(AreaViewSet, {"pcode": self.area.code})
+        self.assertEqual(len(data["data"]), ROW_COUNT)
+        self.assertTrue(all(item["hasChild"] for item in data["data"]))
+
+    def test_dept_list(self):
+        data = self.get_list(DeptViewSet, {"parent": self.dept.id})
+        self.assertEqual(len(data["data"]), ROW_COUNT)
+        self.assertTrue(all(item["hasChild"] for item in data["data"]))
+
+    def test_menu_list(self):
+        data = self.get_list(MenuViewSet, {"parent": self.menu.id})
+        self.assertEqual(len(data["data"]), ROW_COUNT)
+        self.assertTrue(all(item["hasChild"] and item["menuPermission"] for item in data["data"]))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 查询预算及查询统计中间件测试
+"""
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from dvadmin.system.models import Users
+from dvadmin.utils.middleware import QueryInstrumentMiddleware
+from dvadmin.utils.query_util import QueryBudgetExceeded, query_budget, query_stats
+
+
+def run_queries(count):
+    for _ in range(count):
+        Users.objects.exists()
+
+
+class BudgetViewSet:
+    """模拟声明了查询预算的视图集"""
+    query_budget = {'list': 2}
+
+
+def budget_view(request):
+    run_queries(int(request.GET.get('queries', 0)))
+    return HttpResponse()
+
+
+budget_view.cls = BudgetViewSet
+budget_view.actions = {'get': 'list'}
+
+
+class QueryBudgetTest(TestCase):
+
+    def test_within_budget(self):
+        with query_budget(2, 'within') as recorder:
+            run_queries(2)
+        self.assertEqual(recorder.count, 2)
+
+    def test_over_budget(self):
+        with self.assertRaises(QueryBudgetExceeded) as cm:
+            with query_budget(2, 'over'):
+                run_queries(3)
+        self.assertIn('over 执行了3次查询, 超出预算2次', str(cm.exception))
+
+    def test_error_in_block_not_replaced(self):
+        # 代码块内的异常原样抛出, 不检查预算
+        with self.assertRaises(ValueError):
+            with query_budget(0, 'error'):
+                run_queries(1)
+                raise ValueError
+
+
+class QueryInstrumentMiddlewareTest(TestCase):
+
+    def setUp(self):
+        query_stats.clear()
+
+    def request(self, queries):
+        middleware = QueryInstrumentMiddleware(lambda request: (
+            middleware.process_view(request, budget_view, (), {}) or budget_view(request)
+        ))
+        return middleware(RequestFactory().get('/', {'queries': queries}))
+
+    @override_settings(QUERY_INSTRUMENT_ENABLE=True, QUERY_BUDGET_STRICT=False)
+    def test_within_budget(self):
+        response = self.request(2)
+        self.assertEqual(response['X-Query-Count'], '2')
+        stats = query_stats.snapshot()[0]
+        self.assertEqual((stats['view'], stats['budget'], stats['over_budget']), ('BudgetViewSet.list', 2, 0))
+
+    @override_settings(QUERY_INSTRUMENT_ENABLE=True, QUERY_BUDGET_STRICT=False)
+    def test_over_budget_logged(self):
+        with self.assertLogs('query_budget', level='WARNING'):
+            response = self.request(3)
+        self.assertEqual(response['X-Query-Count'], '3')
+        self.assertEqual(query_stats.snapshot()[0]['over_budget'], 1)
+
+    @override_settings(QUERY_INSTRUMENT_ENABLE=True, QUERY_BUDGET_STRICT=True)
+    def test_over_budget_strict(self):
+        self.request(2)
+        with self.assertRaises(QueryBudgetExceeded):
+            self.request(3)
+
+    @override_settings(QUERY_INSTRUMENT_ENABLE=False)
+    def test_disabled(self):
+        response = self.request(3)
+        self.assertFalse(response.has_header('X-Query-Count'))
+        self.assertEqual(query_stats.snapshot(), [])
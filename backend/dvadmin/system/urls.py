@@ -12,6 +12,7 @@ from dvadmin.system.views.menu import MenuViewSet
 from dvadmin.system.views.menu_button import MenuButtonViewSet
 from dvadmin.system.views.message_center import MessageCenterViewSet
 from dvadmin.system.views.operation_log import OperationLogViewSet
+from dvadmin.system.views.query_stats import QueryStatsView
 from dvadmin.system.views.role import RoleViewSet
 from dvadmin.system.views.role_menu import RoleMenuPermissionViewSet
 from dvadmin.system.views.role_menu_button_permission import RoleMenuButtonPermissionViewSet
@@ -53,5 +54,6 @@ urlpatterns = [
     # path('dept_lazy_tree/', DeptViewSet.as_view({'get': 'dept_lazy_tree'})),
     path('clause/privacy.html', PrivacyView.as_view()),
     path('clause/terms_service.html', TermsServiceView.as_view()),
+    path('query_stats/', QueryStatsView.as_view()),
 ]
 urlpatterns += system_url.urls
@@ -7,6 +7,7 @@ from dvadmin.system.models import Area
 from dvadmin.utils.field_permission import FieldPermissionMixin
 from dvadmin.utils.json_response import SuccessResponse
 from dvadmin.utils.serializers import CustomModelSerializer
+from dvadmin.utils.tree_util import count_subquery, get_annotated
 from dvadmin.utils.viewset import CustomModelViewSet
 
 
@@ -19,17 +20,18 @@ class AreaSerializer(CustomModelSerializer):
     pcode_info = serializers.SerializerMethodField()
 
     def get_pcode_info(self, instance):
-        pcode = Area.objects.filter(code=instance.pcode_id).values("name", "code")
-        return pcode
+        if not Area.pcode.is_cached(instance):
+            return Area.objects.filter(code=instance.pcode_id).values("name", "code")
+        # 上级地区已随列表查出
+        if instance.pcode is None:
+            return []
+        return [{"name": instance.pcode.name, "code": instance.pcode.code}]
 
     def get_pcode_count(self, instance: Area):
-        return Area.objects.filter(pcode=instance).count()
+        return get_annotated(instance, 'child_count', lambda obj: Area.objects.filter(pcode=obj).count())
 
     def get_hasChild(self, instance):
-        hasChild = Area.objects.filter(pcode=instance.code)
-        if hasChild:
-            return True
-        return False
+        return self.get_pcode_count(instance) > 0
 
     class Meta:
         model = Area
@@ -68,11 +70,16 @@ class AreaViewSet(CustomModelViewSet, FieldPermissionMixin):
     retrieve:单例
     destroy:删除
     """
-    queryset = Area.objects.all()
+    # 上级地区信息、下级地区数随列表一次查出
+    queryset = Area.objects.select_related('pcode').annotate(
+        child_count=count_subquery(Area.objects.all(), 'pcode', 'code'),
+    )
     serializer_class = AreaSerializer
     create_serializer_class = AreaCreateUpdateSerializer
     update_serializer_class = AreaCreateUpdateSerializer
     extra_filter_class = []
+    # 列表查询数与行数无关, 超出时说明出现了逐行查询
+    query_budget = {'list': 8}
 
     def list(self, request, *args, **kwargs):
         self.request.query_params._mutable = True
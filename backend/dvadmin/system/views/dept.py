@@ -5,14 +5,17 @@
 @contact: QQ:2505811377
 @Remark: 部门管理
 """
+from django.db.models import Count
 from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
-from dvadmin.system.models import Dept, RoleMenuButtonPermission, Users
-from dvadmin.utils.filters import DataLevelPermissionsFilter
+from dvadmin.system.models import Dept, DeptClosure, RoleMenuButtonPermission, Users
+from dvadmin.utils.cache_util import bump_cache_version, get_tenant_namespace
+from dvadmin.utils.filters import DataLevelPermissionsFilter, DATA_SCOPE_CACHE_NAMESPACE
 from dvadmin.utils.json_response import DetailResponse, SuccessResponse, ErrorResponse
 from dvadmin.utils.serializers import CustomModelSerializer
+from dvadmin.utils.tree_util import count_subquery, get_annotated
 from dvadmin.utils.viewset import CustomModelViewSet
 
 
@@ -28,13 +31,10 @@ class DeptSerializer(CustomModelSerializer):
     dept_user_count = serializers.SerializerMethodField()
 
     def get_dept_user_count(self, obj: Dept):
-        return Users.objects.filter(dept=obj).count()
+        return get_annotated(obj, 'user_count', lambda instance: Users.objects.filter(dept=instance).count())
 
     def get_hasChild(self, instance):
-        hasChild = Dept.objects.filter(parent=instance.id)
-        if hasChild:
-            return True
-        return False
+        return self.get_has_children(instance) > 0
 
     def get_status_label(self, obj: Dept):
         if obj.status:
@@ -42,7 +42,7 @@ class DeptSerializer(CustomModelSerializer):
         return "禁用"
 
     def get_has_children(self, obj: Dept):
-        return Dept.objects.filter(parent_id=obj.id).count()
+        return get_annotated(obj, 'child_count', lambda instance: Dept.objects.filter(parent_id=instance.id).count())
 
     class Meta:
         model = Dept
@@ -66,6 +66,11 @@ class DeptCreateUpdateSerializer(CustomModelSerializer):
     部门管理 创建/更新时的列化器
     """
 
+    def validate_parent(self, value):
+        if value and self.instance and value.id in Dept.descendant_ids(self.instance.id):
+            raise serializers.ValidationError("不能将部门移动到其下级部门")
+        return value
+
     def create(self, validated_data):
         value = validated_data.get('parent', None)
         if value is None:
@@ -92,19 +97,32 @@ class DeptViewSet(CustomModelViewSet):
     retrieve:单例
     destroy:删除
     """
-    queryset = Dept.objects.all()
+    # 上级部门名称、下级部门数、部门用户数随列表一次查出
+    queryset = Dept.objects.select_related('parent').annotate(
+        child_count=count_subquery(Dept.objects.all(), 'parent'),
+        user_count=count_subquery(Users.objects.all(), 'dept'),
+    )
     serializer_class = DeptSerializer
     create_serializer_class = DeptCreateUpdateSerializer
     update_serializer_class = DeptCreateUpdateSerializer
     filter_fields = ['name', 'id', 'parent']
     search_fields = []
+    # 列表查询数与行数无关, 超出时说明出现了逐行查询
+    query_budget = {'list': 8}
     # extra_filter_class = []
     import_serializer_class = DeptImportSerializer
+    # 批量写入, 部门层级索引由after_import重建
+    import_bulk_save = True
     import_field_dict = {
         "name": "部门名称",
         "key": "部门标识",
     }
 
+    def after_import(self, request, result):
+        # 批量写入不会经过Dept.save, 需重建部门层级索引并刷新数据权限缓存
+        DeptClosure.rebuild()
+        bump_cache_version(get_tenant_namespace(DATA_SCOPE_CACHE_NAMESPACE))
+
     def list(self, request, *args, **kwargs):
         # 如果懒加载，则只返回父级
         request.query_params._mutable = True
@@ -164,14 +182,6 @@ class DeptViewSet(CustomModelViewSet):
     @action(methods=['GET'], detail=False, permission_classes=[])
     def dept_info(self, request):
         """部门信息"""
-        def inner(did, li):
-            sub = Dept.objects.filter(parent_id=did)
-            if not sub.exists():
-                return li
-            for i in sub:
-                li.append(i.pk)
-                inner(i, li)
-            return li
         dept_id = request.query_params.get('dept_id')
         show_all = request.query_params.get('show_all')
         if dept_id is None:
@@ -179,8 +189,7 @@ class DeptViewSet(CustomModelViewSet):
         if not show_all:
             show_all = 0
         if int(show_all):  # 递归当前部门下的所有部门，查询用户
-            all_did = [dept_id]
-            inner(dept_id, all_did)
+            all_did = Dept.descendant_ids(dept_id) or [dept_id]
             users = Users.objects.filter(dept_id__in=all_did)
         else:
             if dept_id != '':
@@ -201,12 +210,31 @@ class DeptViewSet(CustomModelViewSet):
             },
             'sub_dept_map': []
         }
+        # 一次查询统计各下级部门(含其所有下级)的用户数
+        sub_dept_ids = [dept.pk for dept in sub_dept]
+        if not sub_dept_ids:
+            sub_dept_count = {}
+        elif DeptClosure.objects.filter(ancestor_id__in=sub_dept_ids).exists():
+            sub_dept_count = dict(
+                Users.objects.filter(dept__ancestor_closure__ancestor_id__in=sub_dept_ids)
+                .values_list('dept__ancestor_closure__ancestor_id')
+                .annotate(count=Count('id'))
+                .order_by()
+            )
+        else:
+            # 部门层级索引尚未建立, 按上级关系计算各下级部门的所有下级, 再按部门汇总用户数
+            descendant_map = Dept.descendant_ids_by_parent(sub_dept_ids)
+            dept_user_count = dict(
+                Users.objects.filter(dept_id__in={pk for ids in descendant_map.values() for pk in ids})
+                .values_list('dept_id')
+                .annotate(count=Count('id'))
+                .order_by()
+            )
+            sub_dept_count = {pk: sum(dept_user_count.get(i, 0) for i in ids) for pk, ids in descendant_map.items()}
         for dept in sub_dept:
-            all_did = [dept.pk]
-            inner(dept.pk, all_did)
             sub_data = {
                 'name': dept.name,
-                'count': Users.objects.filter(dept_id__in=all_did).count()
+                'count': sub_dept_count.get(dept.pk, 0)
             }
             data['sub_dept_map'].append(sub_data)
         return SuccessResponse(data)
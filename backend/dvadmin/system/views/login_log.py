@@ -8,6 +8,7 @@
 """
 from dvadmin.system.models import LoginLog
 from dvadmin.utils.field_permission import FieldPermissionMixin
+from dvadmin.utils.pagination import KeysetPagination
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
 
@@ -34,4 +35,5 @@ class LoginLogViewSet(CustomModelViewSet, FieldPermissionMixin):
     """
     queryset = LoginLog.objects.all()
     serializer_class = LoginLogSerializer
+    pagination_class = KeysetPagination
     # extra_filter_class = []
@@ -6,13 +6,18 @@
 @Created on: 2021/6/1 001 22:38
 @Remark: 菜单模块
 """
+from django.db.models import Prefetch
 from rest_framework import serializers
 from rest_framework.decorators import action
 
-from dvadmin.system.models import Menu, RoleMenuPermission
+from dvadmin.system.models import Menu, MenuButton, RoleMenuPermission, Users
 from dvadmin.system.views.menu_button import MenuButtonSerializer
+from dvadmin.utils.cache_util import TenantLocalVersionedCache, get_cache_version, get_tenant_namespace, \
+    versioned_cache_get
 from dvadmin.utils.json_response import SuccessResponse, ErrorResponse
+from dvadmin.utils.permission import API_PERMISSION_CACHE_NAMESPACE, get_user_role_ids
 from dvadmin.utils.serializers import CustomModelSerializer
+from dvadmin.utils.tree_util import exists_subquery, get_annotated
 from dvadmin.utils.viewset import CustomModelViewSet
 
 
@@ -24,7 +29,12 @@ class MenuSerializer(CustomModelSerializer):
     hasChild = serializers.SerializerMethodField()
 
     def get_menuPermission(self, instance):
-        queryset = instance.menuPermission.order_by('-name').values('id', 'name', 'value')
+        if 'menuPermission' in getattr(instance, '_prefetched_objects_cache', {}):
+            # 按钮已随列表预取, 按钮表默认按名称倒序
+            queryset = [{'id': item.id, 'name': item.name, 'value': item.value}
+                        for item in instance.menuPermission.all()]
+        else:
+            queryset = instance.menuPermission.order_by('-name').values('id', 'name', 'value')
         # MenuButtonSerializer(instance.menuPermission.all(), many=True)
         if queryset:
             return queryset
@@ -32,10 +42,7 @@ class MenuSerializer(CustomModelSerializer):
             return None
 
     def get_hasChild(self, instance):
-        hasChild = Menu.objects.filter(parent=instance.id)
-        if hasChild:
-            return True
-        return False
+        return get_annotated(instance, 'has_child', lambda obj: Menu.objects.filter(parent=obj.id).exists())
 
     class Meta:
         model = Menu
@@ -76,6 +83,58 @@ class WebRouterSerializer(CustomModelSerializer):
         read_only_fields = ["id"]
 
 
+# 前端路由缓存命名空间, 菜单/角色菜单权限变更时递增版本号, 租户模式下各租户独立
+WEB_ROUTER_CACHE_NAMESPACE = "web_router"
+_web_router_local_cache = TenantLocalVersionedCache(WEB_ROUTER_CACHE_NAMESPACE)
+
+
+def get_web_router(role_id_list=None, is_superuser=False, version=None):
+    """
+    获取角色集合的前端路由(缓存), 缓存的是序列化并排序后的完整数据
+    :param role_id_list: 角色id列表
+    :param is_superuser: 是否超级管理员, 超级管理员返回全部启用的菜单
+    :param version: 当前租户的缓存版本号
+    :return: 路由列表
+    """
+    namespace = get_tenant_namespace(WEB_ROUTER_CACHE_NAMESPACE)
+    if version is None:
+        version = get_cache_version(namespace)
+    if is_superuser:
+        key = "superuser"
+    else:
+        key = "role:" + ",".join(str(role_id) for role_id in sorted(set(role_id_list or [])))
+
+    def loader():
+        if is_superuser:
+            queryset = Menu.objects.filter(status=1).order_by("sort")
+        else:
+            menu_list = RoleMenuPermission.objects.filter(role__in=role_id_list).values_list('menu_id', flat=True)
+            queryset = Menu.objects.filter(id__in=menu_list).order_by("sort")
+        return [dict(item) for item in WebRouterSerializer(queryset, many=True).data]
+
+    return _web_router_local_cache.get(
+        key,
+        lambda: versioned_cache_get(namespace, key, loader, version=version),
+        version=version,
+    )
+
+
+def warm_web_router():
+    """
+    预热前端路由缓存: 超级管理员及现有用户的全部角色组合
+    :return: 预热的角色组合数
+    """
+    version = get_cache_version(get_tenant_namespace(WEB_ROUTER_CACHE_NAMESPACE))
+    get_web_router(is_superuser=True, version=version)
+    role_sets = {}
+    for user_id, role_id in Users.role.through.objects.values_list('users_id', 'role_id'):
+        role_sets.setdefault(user_id, set()).add(role_id)
+    unique_role_sets = {tuple(sorted(role_set)) for role_set in role_sets.values()}
+    for role_set in unique_role_sets:
+        get_web_router(role_set, version=version)
+    return len(unique_role_sets) + 1
+
+
 class MenuViewSet(CustomModelViewSet):
     """
     菜单管理接口
@@ -85,12 +144,17 @@ class MenuViewSet(CustomModelViewSet):
     retrieve:单例
     destroy:删除
     """
-    queryset = Menu.objects.all()
+    # 是否有下级菜单及菜单按钮随列表一次查出
+    queryset = Menu.objects.annotate(
+        has_child=exists_subquery(Menu.objects.all(), 'parent'),
+    ).prefetch_related(Prefetch('menuPermission', queryset=MenuButton.objects.order_by('-name')))
     serializer_class = MenuSerializer
     create_serializer_class = MenuCreateSerializer
     update_serializer_class = MenuCreateSerializer
     search_fields = ['name', 'status']
     filter_fields = ['parent', 'name', 'status', 'is_link', 'visible', 'cache', 'is_catalog']
+    # 列表查询数与行数无关, 超出时说明出现了逐行查询
+    query_budget = {'list': 8}
 
     def list(self, request):
         """懒加载"""
@@ -120,20 +184,17 @@ class MenuViewSet(CustomModelViewSet):
         """用于前端获取当前角色的路由"""
         user = request.user
         if user.is_superuser:
-            queryset = self.queryset.filter(status=1).order_by("sort")
+            data = get_web_router(is_superuser=True)
         else:
-            role_list = user.role.values_list('id', flat=True)
-            menu_list = RoleMenuPermission.objects.filter(role__in=role_list).values_list('menu_id', flat=True)
-            queryset = Menu.objects.filter(id__in=menu_list).order_by("sort")
-        serializer = WebRouterSerializer(queryset, many=True, request=request)
-        data = serializer.data
+            role_list = get_user_role_ids(user, get_cache_version(get_tenant_namespace(API_PERMISSION_CACHE_NAMESPACE)))
+            data = get_web_router(role_list)
         return SuccessResponse(data=data, total=len(data), msg="获取成功")
 
     @action(methods=['GET'], detail=False, permission_classes=[])
     def get_all_menu(self, request):
         """用于菜单管理获取所有的菜单"""
         user = request.user
-        queryset = self.queryset.all()
+        queryset = Menu.objects.all()
         if not user.is_superuser:
             role_list = user.role.values_list('id', flat=True)
             menu_list = RoleMenuPermission.objects.filter(role__in=role_list).values_list('menu_id')
@@ -8,6 +8,7 @@
 """
 
 from dvadmin.system.models import OperationLog
+from dvadmin.utils.pagination import KeysetPagination
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
 
@@ -44,4 +45,5 @@ class OperationLogViewSet(CustomModelViewSet):
     """
     queryset = OperationLog.objects.order_by('-create_datetime')
     serializer_class = OperationLogSerializer
+    pagination_class = KeysetPagination
     # permission_classes = []
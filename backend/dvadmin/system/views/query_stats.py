@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 接口SQL查询统计
+"""
+from rest_framework.views import APIView
+
+from dvadmin.utils.json_response import DetailResponse, ErrorResponse
+from dvadmin.utils.query_util import query_stats
+
+
+class QueryStatsView(APIView):
+    """
+    接口SQL查询统计, 仅超级管理员可访问
+    get: 当前进程内各接口的查询数、重复查询数、耗时及查询最多的序列化器字段
+    delete: 清空统计
+    统计保存在处理本次请求的进程内存中, 不跨进程汇总; 多进程部署(gunicorn/uvicorn workers)时
+    每次请求只返回其中一个进程的数据, 进程重启后清零, 适合在开发环境或单进程下排查
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_superuser:
+            return ErrorResponse(msg="仅超级管理员可查看")
+        return DetailResponse(data=query_stats.snapshot(), msg="获取成功")
+
+    def delete(self, request, *args, **kwargs):
+        if not request.user.is_superuser:
+            return ErrorResponse(msg="仅超级管理员可操作")
+        query_stats.clear()
+        return DetailResponse(msg="清空成功")
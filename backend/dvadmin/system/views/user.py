@@ -10,7 +10,10 @@ from django.db.models import Q
 from application import dispatch
 from dvadmin.system.models import Users, Role, Dept
 from dvadmin.system.views.role import RoleSerializer
+from dvadmin.utils.cache_util import bump_cache_version, get_tenant_namespace
+from dvadmin.utils.filters import DATA_SCOPE_CACHE_NAMESPACE
 from dvadmin.utils.json_response import ErrorResponse, DetailResponse, SuccessResponse
+from dvadmin.utils.permission import API_PERMISSION_CACHE_NAMESPACE
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.validator import CustomUniqueValidator
 from dvadmin.utils.viewset import CustomModelViewSet
@@ -198,13 +201,34 @@ class ExportUserProfileSerializer(CustomModelSerializer):
 class UserProfileImportSerializer(CustomModelSerializer):
     password = serializers.CharField(read_only=True, required=False)
 
+    def set_import_password(self, instance, is_create):
+        """
+        设置导入用户的密码, 每个用户单独计算哈希(独立的盐)
+        新增用户未导入密码时使用默认密码, 更新已有用户时只在导入了密码时修改
+        :param instance: 用户对象
+        :param is_create: 是否新增用户
+        :return: 是否修改了密码
+        """
+        raw_password = self.initial_data.get("password")
+        if not is_create and not raw_password:
+            return False
+        password = hashlib.new("md5", str(raw_password or "admin123456").encode(encoding="UTF-8")).hexdigest()
+        instance.set_password(password)
+        return True
+
+    def prepare_import_instance(self, instance):
+        """
+        批量导入写入前设置密码
+        :param instance: 未保存的用户对象
+        :return: 需要更新的字段
+        """
+        return ["password"] if self.set_import_password(instance, self.instance is None) else []
+
     def save(self, **kwargs):
+        is_create = self.instance is None
         data = super().save(**kwargs)
-        password = hashlib.new(
-            "md5", str(self.initial_data.get("password", "admin123456")).encode(encoding="UTF-8")
-        ).hexdigest()
-        data.set_password(password)
-        data.save()
+        if self.set_import_password(data, is_create):
+            data.save(update_fields=["password"])
         return data
 
     class Meta:
@@ -249,6 +273,8 @@ class UserViewSet(CustomModelViewSet):
     export_serializer_class = ExportUserProfileSerializer
     # 导入
     import_serializer_class = UserProfileImportSerializer
+    # 批量写入, 密码及角色由prepare_import_instance/after_import处理
+    import_bulk_save = True
     import_field_dict = {
         "username": "登录账号",
         "name": "用户名称",
@@ -270,6 +296,11 @@ class UserViewSet(CustomModelViewSet):
         "role": {"title": "角色", "choices": {"queryset": Role.objects.filter(status=True), "values_name": "name"}},
     }
 
+    def after_import(self, request, result):
+        # 批量写入用户角色不会触发m2m_changed信号, 需手动刷新权限缓存
+        bump_cache_version(get_tenant_namespace(API_PERMISSION_CACHE_NAMESPACE))
+        bump_cache_version(get_tenant_namespace(DATA_SCOPE_CACHE_NAMESPACE))
+
     @action(methods=["GET"], detail=False, permission_classes=[IsAuthenticated])
     def user_info(self, request):
         """获取当前用户信息"""
@@ -401,16 +432,8 @@ class UserViewSet(CustomModelViewSet):
         if not show_all:
             show_all = 0
         if int(show_all):
-            all_did = [dept_id]
-            def inner(did):
-                sub = Dept.objects.filter(parent_id=did)
-                if not sub.exists():
-                    return
-                for i in sub:
-                    all_did.append(i.pk)
-                    inner(i)
             if dept_id != '':
-                inner(dept_id)
+                all_did = Dept.descendant_ids(dept_id) or [dept_id]
                 searchs = [
                     Q(**{f+'__icontains':i})
                     for f in self.search_fields
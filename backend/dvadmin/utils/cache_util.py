@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 基于版本号的缓存工具
+(1)版本号保存在共享缓存(django cache)中, 数据变更时递增版本号
+(2)缓存key中带有版本号, 版本号变化后旧缓存自然失效
+(3)进程内缓存只需读取一次版本号即可判断是否失效, 多进程间通过共享缓存同步
+(4)租户模式下按schema区分命名空间, 各租户的数据及版本号互相独立
+"""
+import threading
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+CACHE_VERSION_PREFIX = "cache_version"
+# 带版本号数据的过期时间(秒), 版本号变化后旧数据自然过期
+VERSIONED_CACHE_TIMEOUT = getattr(settings, 'VERSIONED_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def get_tenant_namespace(namespace):
+    """
+    获取当前租户的缓存命名空间, 非租户模式为public
+    :param namespace: 缓存命名空间
+    :return:
+    """
+    schema_name = getattr(getattr(connection, "tenant", None), "schema_name", None) or "public"
+    return f"{namespace}:{schema_name}"
+
+
+def _version_key(namespace):
+    return f"{CACHE_VERSION_PREFIX}:{namespace}"
+
+
+def get_cache_version(namespace):
+    """
+    获取命名空间当前的缓存版本号
+    :param namespace: 缓存命名空间
+    :return:
+    """
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # 以时间戳作为初始版本号, 避免版本号被淘汰后与旧版本号重复
+        cache.add(key, int(time() * 1000), None)
+        version = cache.get(key) or 0
+    return version
+
+
+def bump_cache_version(namespace):
+    """
+    递增命名空间的缓存版本号, 使该命名空间下的所有缓存失效
+    :param namespace: 缓存命名空间
+    :return: 新的版本号
+    """
+    key = _version_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = int(time() * 1000)
+        cache.set(key, version, None)
+        return version
+
+
+def versioned_cache_get(namespace, key, loader, timeout=VERSIONED_CACHE_TIMEOUT, version=None):
+    """
+    从共享缓存读取带版本号的数据, 未命中时调用loader加载并写入
+    :param namespace: 缓存命名空间
+    :param key: 缓存key
+    :param loader: 未命中时的加载函数, 返回值需可被pickle
+    :param timeout: 过期时间(秒), None为不过期
+    :param version: 已获取的版本号, 不传则读取当前版本号
+    :return:
+    """
+    if version is None:
+        version = get_cache_version(namespace)
+    cache_key = f"{namespace}:{version}:{key}"
+    value = cache.get(cache_key)
+    if value is None:
+        value = loader()
+        cache.set(cache_key, value, timeout)
+    return value
+
+
+class LocalVersionedCache:
+    """
+    进程内缓存, 以共享缓存中的版本号判断是否失效
+    版本号变化时清空本进程内的全部数据
+    """
+
+    def __init__(self, namespace, maxsize=1024):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self._version = None
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader, version=None):
+        """
+        读取缓存数据, 未命中时调用loader加载
+        :param key: 缓存key
+        :param loader: 未命中时的加载函数
+        :param version: 已获取的版本号, 不传则读取当前版本号
+        :return:
+        """
+        if version is None:
+            version = get_cache_version(self.namespace)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._data = {}
+                    self._version = version
+        data = self._data
+        if key in data:
+            return data[key]
+        value = loader()
+        with self._lock:
+            if version == self._version:
+                if len(self._data) >= self.maxsize:
+                    self._data = {}
+                self._data[key] = value
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+            self._version = None
+
+
+class TenantLocalVersionedCache:
+    """
+    按租户区分的进程内缓存, 每个租户使用独立的LocalVersionedCache
+    namespace为不带租户的命名空间, 调用方读取版本号时需使用get_tenant_namespace(namespace)
+    """
+
+    def __init__(self, namespace, maxsize=1024):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def _get_cache(self):
+        namespace = get_tenant_namespace(self.namespace)
+        local_cache = self._caches.get(namespace)
+        if local_cache is None:
+            with self._lock:
+                local_cache = self._caches.setdefault(namespace, LocalVersionedCache(namespace, self.maxsize))
+        return local_cache
+
+    def get(self, key, loader, version=None):
+        """
+        读取当前租户的缓存数据, 未命中时调用loader加载
+        :param key: 缓存key
+        :param loader: 未命中时的加载函数
+        :param version: 已获取的当前租户版本号, 不传则读取当前版本号
+        :return:
+        """
+        return self._get_cache().get(key, loader, version=version)
+
+    def clear(self):
+        with self._lock:
+            for local_cache in self._caches.values():
+                local_cache.clear()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 按内容哈希寻址的解析结果缓存
+(1)文件以内容SHA-256为key, 与文件名、上传次数无关
+(2)version区分解析器、提示词及模型版本, 版本变化后自然不再命中
+(3)命中次数记录在缓存表中, 多进程共享统计结果
+"""
+import hashlib
+
+from django.db import IntegrityError
+from django.db.models import Count, F, Sum
+
+from dvadmin.system.models import ContentCache
+
+CONTENT_CACHE_MISS = object()
+
+
+def file_sha256(file):
+    """
+    计算文件内容的SHA-256
+    :param file: 文件路径或django File对象
+    :return:
+    """
+    sha256 = hashlib.sha256()
+    if isinstance(file, str):
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+    else:
+        for chunk in file.chunks():
+            sha256.update(chunk)
+        file.seek(0)
+    return sha256.hexdigest()
+
+
+def text_sha256(*parts):
+    """
+    计算多段文本的SHA-256, 用于生成版本号
+    :param parts:
+    :return:
+    """
+    sha256 = hashlib.sha256()
+    for part in parts:
+        sha256.update(str(part).encode('utf-8'))
+        sha256.update(b'\0')
+    return sha256.hexdigest()
+
+
+def get_content_cache(content_hash, kind, version):
+    """
+    读取缓存, 命中时累加命中次数
+    :param content_hash: 内容哈希
+    :param kind: 缓存类型
+    :param version: 版本
+    :return: 缓存内容, 未命中时返回 CONTENT_CACHE_MISS
+    """
+    if not content_hash:
+        return CONTENT_CACHE_MISS
+    instance = ContentCache.objects.filter(content_hash=content_hash, kind=kind, version=version).only('id', 'value').first()
+    if instance is None:
+        return CONTENT_CACHE_MISS
+    ContentCache.objects.filter(pk=instance.pk).update(hit_count=F('hit_count') + 1)
+    return instance.value
+
+
+def set_content_cache(content_hash, kind, version, value):
+    """
+    写入缓存, 并发写入相同key时保留先写入的内容
+    :param content_hash: 内容哈希
+    :param kind: 缓存类型
+    :param version: 版本
+    :param value: 缓存内容, 需可被JSON序列化
+    :return:
+    """
+    if not content_hash:
+        return
+    try:
+        ContentCache.objects.get_or_create(content_hash=content_hash, kind=kind, version=version,
+                                           defaults={'value': value})
+    except IntegrityError:
+        pass
+
+
+def content_cache_get(content_hash, kind, version, loader):
+    """
+    读取缓存, 未命中时调用loader加载并写入
+    :param content_hash: 内容哈希
+    :param kind: 缓存类型
+    :param version: 版本
+    :param loader: 未命中时的加载函数, 抛出异常时不写入缓存
+    :return: (内容, 是否命中)
+    """
+    value = get_content_cache(content_hash, kind, version)
+    if value is not CONTENT_CACHE_MISS:
+        return value, True
+    value = loader()
+    set_content_cache(content_hash, kind, version, value)
+    return value, False
+
+
+def get_content_cache_stats():
+    """
+    各类型缓存的命中统计, 每条缓存记录对应一次未命中
+    :return:
+    """
+    stats = {}
+    rows = ContentCache.objects.values('kind').annotate(entries=Count('id'), hits=Sum('hit_count'))
+    for row in rows:
+        hits = row['hits'] or 0
+        stats[row['kind']] = {
+            'entries': row['entries'],
+            'hits': hits,
+            'misses': row['entries'],
+            'hit_rate': round(hits / (hits + row['entries']), 4) if hits + row['entries'] else 0,
+        }
+    return stats
@@ -13,7 +13,7 @@ from functools import reduce
 
 import six
 from django.db import models
-from django.db.models import Q, F
+from django.db.models import Q
 from django.db.models.constants import LOOKUP_SEP
 from django_filters import utils, FilterSet
 from django_filters.constants import ALL_FIELDS
@@ -23,7 +23,10 @@ from django_filters.utils import get_model_field
 from rest_framework.filters import BaseFilterBackend
 from django_filters.conf import settings
 from dvadmin.system.models import Dept, ApiWhiteList, RoleMenuButtonPermission, MenuButton
+from dvadmin.utils.cache_util import TenantLocalVersionedCache, get_cache_version, get_tenant_namespace, \
+    versioned_cache_get
 from dvadmin.utils.models import CoreModel
+from dvadmin.utils.permission import METHOD_LIST, get_user_role_ids
 
 class CoreModelFilterBankend(BaseFilterBackend):
     """
@@ -58,21 +61,109 @@ class CoreModelFilterBankend(BaseFilterBackend):
 
 def get_dept(dept_id: int, dept_all_list=None, dept_list=None):
     """
-    递归获取部门的所有下级部门
+    获取部门的所有下级部门(含本部门), 基于部门层级索引一次查询
     :param dept_id: 需要获取的部门id
-    :param dept_all_list: 所有部门列表
-    :param dept_list: 递归部门list
+    :param dept_all_list: 已废弃, 保留参数兼容旧调用
+    :param dept_list: 已废弃, 保留参数兼容旧调用
     :return:
     """
-    if not dept_all_list:
-        dept_all_list = Dept.objects.all().values("id", "parent")
-    if dept_list is None:
-        dept_list = [dept_id]
-    for ele in dept_all_list:
-        if ele.get("parent") == dept_id:
-            dept_list.append(ele.get("id"))
-            get_dept(ele.get("id"), dept_all_list, dept_list)
-    return list(set(dept_list))
+    return Dept.descendant_ids(dept_id)
+
+
+# 数据权限缓存命名空间, 白名单/按钮/角色按钮权限/部门/用户角色变更时递增版本号, 租户模式下各租户独立
+DATA_SCOPE_CACHE_NAMESPACE = "data_scope"
+_data_scope_local_cache = TenantLocalVersionedCache(DATA_SCOPE_CACHE_NAMESPACE)
+
+
+class DataScope:
+    """
+    解析后的数据权限范围
+    data_range: 数据权限范围集合(0仅本人 1本部门及以下 2本部门 3全部 4自定)
+    dept_ids: 可访问的部门id集合
+    """
+
+    def __init__(self, data_range=None, dept_ids=None):
+        self.data_range = set(data_range or [])
+        self.dept_ids = set(dept_ids or [])
+
+
+def get_data_scope_white_matcher(version=None):
+    """
+    获取不认证数据权限的接口白名单匹配器(进程内缓存编译后的正则)
+    :param version: 缓存版本号
+    :return: 编译后的正则, 无白名单时返回None
+    """
+    if version is None:
+        version = get_cache_version(get_tenant_namespace(DATA_SCOPE_CACHE_NAMESPACE))
+
+    def loader():
+        api_white_list = versioned_cache_get(
+            get_tenant_namespace(DATA_SCOPE_CACHE_NAMESPACE),
+            "white_list",
+            lambda: [
+                str(item.get("url")).replace("{id}", ".*?") + ":" + str(item.get("method"))
+                for item in ApiWhiteList.objects.filter(enable_datasource=False).values("url", "method")
+                if item.get("url")
+            ],
+            version=version,
+        )
+        patterns = []
+        for item in api_white_list:
+            try:
+                re.compile(item)
+            except re.error:
+                continue
+            patterns.append(f"(?:{item})")
+        return re.compile("|".join(patterns), re.M | re.I) if patterns else None
+
+    return _data_scope_local_cache.get("white_list", loader, version=version)
+
+
+def get_data_scope(user, api, method, version=None):
+    """
+    解析用户在某个接口下的数据权限范围, 按(用户, 部门, 接口, 请求方法)缓存
+    :param user: 当前用户
+    :param api: 接口地址(单例查询时主键已替换为{id})
+    :param method: 请求方法下标
+    :param version: 缓存版本号
+    :return: DataScope
+    """
+    if version is None:
+        version = get_cache_version(get_tenant_namespace(DATA_SCOPE_CACHE_NAMESPACE))
+    user_dept_id = getattr(user, "dept_id", None)
+
+    def loader():
+        role_id_list = get_user_role_ids(user)
+        menu_button_ids = list(MenuButton.objects.filter(api=api, method=method).values_list('id', flat=True))
+        data_range = set()
+        if menu_button_ids:
+            data_range = set(RoleMenuButtonPermission.objects.filter(
+                role__in=role_id_list,
+                role__status=1,
+                menu_button_id__in=menu_button_ids).values_list('data_range', flat=True))
+        dept_ids = set()
+        if 3 not in data_range and 0 not in data_range:
+            for ele in data_range:
+                if ele == 1:
+                    dept_ids.add(user_dept_id)
+                    dept_ids.update(get_dept(user_dept_id))
+                elif ele == 2:
+                    dept_ids.add(user_dept_id)
+                elif ele == 4:
+                    dept_ids.update(RoleMenuButtonPermission.objects.filter(
+                        role__in=role_id_list,
+                        role__status=1,
+                        data_range=4).values_list('dept__id', flat=True))
+        dept_ids.discard(None)
+        return {"data_range": data_range, "dept_ids": dept_ids}
+
+    data = versioned_cache_get(
+        get_tenant_namespace(DATA_SCOPE_CACHE_NAMESPACE),
+        f"scope:{user.pk}:{user_dept_id}:{method}:{api}",
+        loader,
+        version=version,
+    )
+    return DataScope(**data)
 
 
 class DataLevelPermissionsFilter(BaseFilterBackend):
@@ -86,6 +177,7 @@ class DataLevelPermissionsFilter(BaseFilterBackend):
 
     4. 只为仅本人数据权限时只返回过滤本人数据，并且部门为自己本部门(考虑到用户会变部门，只能看当前用户所在的部门数据)
     5. 自定数据权限 获取部门，根据部门过滤
+    解析后的数据权限范围按版本号缓存, 同一请求内多次过滤只解析一次
     """
 
     def filter_queryset(self, request, queryset, view):
@@ -94,37 +186,23 @@ class DataLevelPermissionsFilter(BaseFilterBackend):
         """
         api = request.path  # 当前请求接口
         method = request.method  # 当前请求方法
-        methodList = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
-        method = methodList.index(method)
+        method = METHOD_LIST.index(method)
+        version = get_cache_version(get_tenant_namespace(DATA_SCOPE_CACHE_NAMESPACE))
         # ***接口白名单***
-        api_white_list = ApiWhiteList.objects.filter(enable_datasource=False).values(
-            permission__api=F("url"), permission__method=F("method")
-        )
-        api_white_list = [
-            str(item.get("permission__api").replace("{id}", ".*?"))
-            + ":"
-            + str(item.get("permission__method"))
-            for item in api_white_list
-            if item.get("permission__api")
-        ]
-        for item in api_white_list:
-            new_api = f"{api}:{method}"
-            matchObj = re.match(item, new_api, re.M | re.I)
-            if matchObj is None:
-                continue
-            else:
-                return queryset
+        white_matcher = get_data_scope_white_matcher(version)
+        if white_matcher is not None and white_matcher.match(f"{api}:{method}"):
+            return queryset
         """
         判断是否为超级管理员:
         如果不是超级管理员,则进入下一步权限判断
         """
         if request.user.is_superuser == 0:
-            return self._extracted_from_filter_queryset_33(request, queryset, api, method)
+            return self._extracted_from_filter_queryset_33(request, queryset, api, method, version)
         else:
             return queryset
 
     # TODO Rename this here and in `filter_queryset`
-    def _extracted_from_filter_queryset_33(self, request, queryset, api, method):
+    def _extracted_from_filter_queryset_33(self, request, queryset, api, method, version=None):
         # 0. 获取用户的部门id，没有部门则返回空
         user_dept_id = getattr(request.user, "dept_id", None)
         if not user_dept_id:
@@ -148,56 +226,31 @@ class DataLevelPermissionsFilter(BaseFilterBackend):
         _pk = request.parser_context["kwargs"].get('pk')
         if _pk: # 判断是否是单例查询
             re_api = re.sub(_pk,'{id}', api)
-        role_id_list = request.user.role.values_list('id', flat=True)
-        # 修复权限获取bug
-        menu_button_ids = MenuButton.objects.filter(api=re_api,method=method).values_list('id', flat=True)
-        role_permission_list = []
-        if menu_button_ids:
-            role_permission_list=RoleMenuButtonPermission.objects.filter(
-                role__in=role_id_list,
-                role__status=1,
-                menu_button_id__in=menu_button_ids).values(
-                'data_range'
-            )
-        dataScope_list = []  # 权限范围列表
-        for ele in role_permission_list:
-                # 判断用户是否为超级管理员角色/如果拥有[全部数据权限]则返回所有数据
-            if ele.get("data_range") == 3:
-                return queryset
-            dataScope_list.append(ele.get("data_range"))
-        dataScope_list = list(set(dataScope_list))
+        # 同一请求内复用已解析的数据权限
+        request_scopes = getattr(request, "_data_scope_cache", None)
+        if request_scopes is None:
+            request_scopes = {}
+            setattr(request, "_data_scope_cache", request_scopes)
+        data_scope = request_scopes.get((re_api, method))
+        if data_scope is None:
+            data_scope = get_data_scope(request.user, re_api, method, version)
+            request_scopes[(re_api, method)] = data_scope
+
+        # 判断用户是否为超级管理员角色/如果拥有[全部数据权限]则返回所有数据
+        if 3 in data_scope.data_range:
+            return queryset
 
         # 4. 只为仅本人数据权限时只返回过滤本人数据，并且部门为自己本部门(考虑到用户会变部门，只能看当前用户所在的部门数据)
-        if 0 in dataScope_list:
+        if 0 in data_scope.data_range:
             return queryset.filter(
                 creator=request.user, dept_belong_id=user_dept_id
             )
 
         # 5. 自定数据权限 获取部门，根据部门过滤
-        dept_list = []
-        for ele in dataScope_list:
-            if ele == 1:
-                dept_list.append(user_dept_id)
-                dept_list.extend(
-                    get_dept(
-                        user_dept_id,
-                    )
-                )
-            elif ele == 2:
-                dept_list.append(user_dept_id)
-            elif ele == 4:
-                dept_ids = RoleMenuButtonPermission.objects.filter(
-                    role__in=role_id_list,
-                    role__status=1,
-                    data_range=4).values_list(
-                    'dept__id',flat=True
-                )
-                dept_list.extend(
-                    dept_ids
-                )
+        dept_list = list(data_scope.dept_ids)
         if queryset.model._meta.model_name == 'dept':
-            return queryset.filter(id__in=list(set(dept_list)))
-        return queryset.filter(dept_belong_id__in=list(set(dept_list)))
+            return queryset.filter(id__in=dept_list)
+        return queryset.filter(dept_belong_id__in=dept_list)
 
 
 class CustomDjangoFilterBackend(DjangoFilterBackend):
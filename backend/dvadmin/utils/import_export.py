@@ -1,31 +1,29 @@
 # -*- coding: utf-8 -*-
 import os
 import re
+import warnings
 from datetime import datetime
 
 import openpyxl
 from django.conf import settings
+from django.http import HttpRequest, QueryDict
+from django.utils.module_loading import import_string
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.table import Table, TableStyleInfo
+from rest_framework.request import Request
 
 from dvadmin.utils.validator import CustomValidationError
 
+# 导出时每批序列化的数据条数
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
 
-def import_to_data(file_url, field_data, m2m_fields=None):
+
+def get_import_validation_data(field_data):
     """
-    读取导入的excel文件
-    :param file_url:
+    获取导入字段的选项映射 {字段: {显示值: 实际值}}
     :param field_data: 首行数据源
-    :param m2m_fields: 多对多字段
     :return:
     """
-    # 读取excel 文件
-    file_path_dir = os.path.join(settings.BASE_DIR, file_url)
-    workbook = openpyxl.load_workbook(file_path_dir)
-    table = workbook[workbook.sheetnames[0]]
-    theader = tuple(table.values)[0] #Excel的表头
-    is_update = '更新主键(勿改)' in theader #是否导入更新
-    if is_update is False: #不是更新时,删除id列
-        field_data.pop('id')
-    # 获取参数映射
     validation_data_dict = {}
     for key, value in field_data.items():
         if isinstance(value, dict):
@@ -41,50 +39,278 @@ def import_to_data(file_url, field_data, m2m_fields=None):
             else:
                 continue
             validation_data_dict[key] = data_dict
-    # 创建一个空列表，存储Excel的数据
-    tables = []
-    for i, row in enumerate(range(table.max_row)):
-        if i == 0:
+    return validation_data_dict
+
+
+def parse_import_row(row, field_data, validation_data_dict, m2m_fields=None):
+    """
+    将excel的一行转换为字典
+    :param row: 行数据(第一列为序号)
+    :param field_data: 首行数据源
+    :param validation_data_dict: 选项映射
+    :param m2m_fields: 多对多字段
+    :return:
+    """
+    m2m_fields = m2m_fields or []
+    array = {}
+    for index, item in enumerate(field_data.items()):
+        key, values = item
+        value_type = 'str'
+        if isinstance(values, dict):
+            value_type = values.get('type', 'str')
+        cell_value = row[index + 1] if len(row) > index + 1 else None
+        if cell_value is None or cell_value == '':
             continue
-        array = {}
-        for index, item in enumerate(field_data.items()):
-            items = list(item)
-            key = items[0]
-            values = items[1]
-            value_type = 'str'
-            if isinstance(values, dict):
-                value_type = values.get('type','str')
-            cell_value = table.cell(row=row + 1, column=index + 2).value
-            if cell_value is None or cell_value=='':
-                continue
-            elif value_type == 'date':
-                print(61, datetime.strptime(str(cell_value), '%Y-%m-%d %H:%M:%S').date())
-                try:
-                    cell_value = datetime.strptime(str(cell_value), '%Y-%m-%d %H:%M:%S').date()
-                except:
-                    raise CustomValidationError('日期格式不正确')
-            elif value_type == 'datetime':
+        elif value_type == 'date':
+            try:
+                cell_value = datetime.strptime(str(cell_value), '%Y-%m-%d %H:%M:%S').date()
+            except ValueError:
+                raise CustomValidationError('日期格式不正确')
+        elif value_type == 'datetime':
+            try:
                 cell_value = datetime.strptime(str(cell_value), '%Y-%m-%d %H:%M:%S')
-            else:
+            except ValueError:
+                raise CustomValidationError('时间格式不正确')
+        else:
             # 由于excel导入数字类型后，会出现数字加 .0 的，进行处理
-                if type(cell_value) is float and str(cell_value).split(".")[1] == "0":
-                    cell_value = int(str(cell_value).split(".")[0])
-                elif type(cell_value) is str:
-                    cell_value = cell_value.strip(" \t\n\r")
-            if key in validation_data_dict:
-                array[key] = validation_data_dict.get(key, {}).get(cell_value, None)
-                if key in m2m_fields:
-                    array[key] = list(
-                        filter(
-                            lambda x: x,
-                            [
-                                validation_data_dict.get(key, {}).get(value, None)
-                                for value in re.split(r"[，；：|.,;:\s]\s*", cell_value)
-                            ],
-                        )
+            if type(cell_value) is float and str(cell_value).split(".")[1] == "0":
+                cell_value = int(str(cell_value).split(".")[0])
+            elif type(cell_value) is str:
+                cell_value = cell_value.strip(" \t\n\r")
+        if key in validation_data_dict:
+            array[key] = validation_data_dict.get(key, {}).get(cell_value, None)
+            if key in m2m_fields:
+                array[key] = list(
+                    filter(
+                        lambda x: x,
+                        [
+                            validation_data_dict.get(key, {}).get(value, None)
+                            for value in re.split(r"[，；：|.,;:\s]\s*", str(cell_value))
+                        ],
                     )
-            else:
-                array[key] = cell_value
-        tables.append(array)
-    data = [i for i in tables if len(i) != 0]
+                )
+        else:
+            array[key] = cell_value
+    return array
+
+
+def iter_import_rows(file_url, field_data, m2m_fields=None):
+    """
+    以只读模式逐行读取导入的excel文件
+    :param file_url:
+    :param field_data: 首行数据源
+    :param m2m_fields: 多对多字段
+    :return: (行号, 数据, 错误信息) 的迭代器, 空行不返回
+    """
+    field_data = dict(field_data)
+    file_path_dir = os.path.join(settings.BASE_DIR, file_url)
+    workbook = openpyxl.load_workbook(file_path_dir, read_only=True)
+    try:
+        table = workbook[workbook.sheetnames[0]]
+        rows = table.iter_rows(values_only=True)
+        theader = next(rows, None) or ()  # Excel的表头
+        is_update = '更新主键(勿改)' in theader  # 是否导入更新
+        if is_update is False:  # 不是更新时,删除id列
+            field_data.pop('id', None)
+        # 获取参数映射
+        validation_data_dict = get_import_validation_data(field_data)
+        for row_number, row in enumerate(rows, start=2):
+            try:
+                array = parse_import_row(row, field_data, validation_data_dict, m2m_fields)
+            except CustomValidationError as e:
+                yield row_number, None, str(e)
+                continue
+            if array:
+                yield row_number, array, None
+    finally:
+        workbook.close()
+
+
+def import_to_data(file_url, field_data, m2m_fields=None):
+    """
+    读取导入的excel文件
+    :param file_url:
+    :param field_data: 首行数据源
+    :param m2m_fields: 多对多字段
+    :return:
+    """
+    data = []
+    for row_number, array, error in iter_import_rows(file_url, field_data, m2m_fields):
+        if error:
+            raise CustomValidationError(error)
+        data.append(array)
     return data
+
+
+def is_number(num):
+    try:
+        float(num)
+        return True
+    except (TypeError, ValueError):
+        pass
+
+    try:
+        import unicodedata
+        unicodedata.numeric(num)
+        return True
+    except (TypeError, ValueError):
+        pass
+    return False
+
+
+def get_string_len(string, max_width=50):
+    """
+    获取字符串最大长度
+    :param string:
+    :param max_width: 最大宽度
+    :return:
+    """
+    length = 4
+    if string is None:
+        return length
+    if is_number(string):
+        return length
+    for char in str(string):
+        length += 2.1 if ord(char) > 256 else 1
+    return round(length, 1) if length <= max_width else max_width
+
+
+def format_export_value(val):
+    """
+    转换为excel单元格可写入的值
+    """
+    if val is None or val == "":
+        return ""
+    if isinstance(val, datetime):
+        return val.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(val, (list, dict, tuple, set)):
+        return str(val)
+    return val
+
+
+def iter_export_rows(queryset, serializer_class, request=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    分批序列化查询集, 内存中只保留一批数据
+    :param queryset: 查询集
+    :param serializer_class: 导出序列化器
+    :param request:
+    :param chunk_size: 每批条数
+    :return: 序列化后的数据迭代器
+    """
+    chunk = []
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(instance)
+        if len(chunk) >= chunk_size:
+            yield from serializer_class(chunk, many=True, request=request).data
+            chunk = []
+    if chunk:
+        yield from serializer_class(chunk, many=True, request=request).data
+
+
+def export_to_excel(rows, export_field_label, file, total=None, progress_callback=None, max_width=50,
+                    sample_size=EXPORT_CHUNK_SIZE):
+    """
+    以只写模式流式写入excel
+    只写模式下列宽需在写入数据前设置, 因此以表头及前sample_size行数据计算列宽
+    :param rows: 数据迭代器(dict)
+    :param export_field_label: 导出字段 {字段名: 表头}
+    :param file: 文件路径或文件对象
+    :param total: 数据总数, 用于计算进度
+    :param progress_callback: 进度回调, 参数为0-100的整数
+    :param max_width: 列最大宽度
+    :param sample_size: 用于计算列宽的行数
+    :return: 写入的行数
+    """
+    header_data = ["序号", *export_field_label.values()]
+    fields = list(export_field_label.keys())
+    df_len_max = [get_string_len(ele, max_width) for ele in header_data]
+    rows = iter(rows)
+    sample = []
+    for results in rows:
+        line = [format_export_value(results.get(key)) for key in fields]
+        for index, val in enumerate(line):
+            width = get_string_len(val, max_width)
+            if width > df_len_max[index + 1]:
+                df_len_max[index + 1] = width
+        sample.append(line)
+        if len(sample) >= sample_size:
+            break
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    # 　更新列宽
+    for index, width in enumerate(df_len_max):
+        ws.column_dimensions[get_column_letter(index + 1)].width = width
+    ws.append(header_data)
+
+    count = 0
+    progress = -1
+
+    def write_line(line):
+        nonlocal count, progress
+        count += 1
+        ws.append([count, *line])
+        if progress_callback and total:
+            current = min(int(count * 100 / total), 99)
+            if current != progress:
+                progress = current
+                progress_callback(current)
+
+    for line in sample:
+        write_line(line)
+    for results in rows:
+        write_line([format_export_value(results.get(key)) for key in fields])
+
+    tab = Table(displayName="Table", ref=f"A1:{get_column_letter(len(header_data))}{count + 1}")  # 名称管理器
+    # 只写模式下需手动设置表格列名
+    tab._initialise_columns()
+    for column, name in zip(tab.tableColumns, header_data):
+        column.name = str(name)
+    tab.tableStyleInfo = TableStyleInfo(
+        name="TableStyleLight11",
+        showFirstColumn=True,
+        showLastColumn=True,
+        showRowStripes=True,
+        showColumnStripes=True,
+    )
+    with warnings.catch_warnings():
+        # 列名已手动设置, 忽略只写模式的提示
+        warnings.simplefilter("ignore", UserWarning)
+        ws.add_table(tab)
+    wb.save(file)
+    return count
+
+
+def build_export_view(view_path, user_id, path, method="GET", query_params=None, view_kwargs=None):
+    """
+    根据请求参数重建视图, 用于在异步任务中重新生成查询集
+    :param view_path: 视图类路径
+    :param user_id: 发起导出的用户id
+    :param path: 请求路径(数据权限按路径匹配)
+    :param method: 请求方法
+    :param query_params: 查询参数 {key: [value, ...]}
+    :param view_kwargs: url参数
+    :return: 视图实例
+    """
+    from django.contrib.auth import get_user_model
+
+    user = get_user_model().objects.get(pk=user_id)
+    http_request = HttpRequest()
+    http_request.method = method
+    http_request.path = http_request.path_info = path
+    http_request.GET = QueryDict(mutable=True)
+    for key, values in (query_params or {}).items():
+        http_request.GET.setlist(key, values)
+    http_request.user = user
+    view_kwargs = view_kwargs or {}
+    view = import_string(view_path)(format_kwarg=None, action='export_data')
+    view.args = ()
+    view.kwargs = view_kwargs
+    # 与DRF的initialize_request一致, 数据权限过滤器需要从parser_context读取url参数
+    request = Request(
+        http_request,
+        parser_context={"view": view, "args": (), "kwargs": view_kwargs, "request": http_request},
+    )
+    request.user = user
+    view.request = request
+    return view
@@ -2,21 +2,40 @@
 import datetime
 from urllib.parse import quote
 
-from django.db import transaction
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction, connections, DatabaseError
 from django.http import HttpResponse
+from django.utils import timezone
 from openpyxl import Workbook
 from openpyxl.worksheet.datavalidation import DataValidation
 from openpyxl.utils import get_column_letter, quote_sheetname
 from openpyxl.worksheet.table import Table, TableStyleInfo
+from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.request import Request
 
-from dvadmin.utils.import_export import import_to_data
+from dvadmin.utils.import_export import iter_import_rows, export_to_excel, iter_export_rows
 from dvadmin.utils.json_response import DetailResponse, SuccessResponse
 from dvadmin.utils.request_util import get_verbose_name
+from dvadmin.utils.validator import CustomValidationError
 from dvadmin.system.tasks import async_export_data
 from dvadmin.system.models import DownloadCenter
 
+# 保存单行数据时按行记录、不中断导入的异常
+IMPORT_ROW_ERRORS = (DatabaseError, ValidationError, serializers.ValidationError, CustomValidationError)
+
+
+def get_import_row_error(exc):
+    """
+    导入行保存失败时返回的错误信息
+    :param exc: IMPORT_ROW_ERRORS中的异常
+    :return:
+    """
+    if isinstance(exc, ValidationError):
+        return exc.messages
+    return getattr(exc, "detail", None) or str(exc)
+
 
 class ImportSerializerMixin:
     """
@@ -29,6 +48,11 @@ class ImportSerializerMixin:
     import_serializer_class = None
     # 表格表头最大宽度，默认50个字符
     export_column_width = 50
+    # 导入时每批处理的行数
+    import_chunk_size = getattr(settings, 'IMPORT_CHUNK_SIZE', 500)
+    # 是否使用bulk_create/bulk_update批量写入, 批量写入不会调用序列化器的save及模型的save/信号,
+    # 开启前需确认相关逻辑已在prepare_import_instance/after_import中处理; 默认逐行调用序列化器保存
+    import_bulk_save = False
 
     def is_number(self,num):
         try:
@@ -61,7 +85,6 @@ class ImportSerializerMixin:
         return round(length, 1) if length <= self.export_column_width else self.export_column_width
 
     @action(methods=['get','post'],detail=False)
-    @transaction.atomic  # Django 事务,防止出错
     def import_data(self, request: Request, *args, **kwargs):
         """
         导入模板
@@ -138,7 +161,7 @@ class ImportSerializerMixin:
             wb.save(response)
             return response
         else:
-            # 从excel中组织对应的数据结构，然后使用序列化器保存
+            # 从excel中逐行读取数据, 分批校验后批量写入, 出错的行记录在导入结果中
             queryset = self.filter_queryset(self.get_queryset())
             # 获取多对多字段
             m2m_fields = [
@@ -147,15 +170,176 @@ class ImportSerializerMixin:
                 if hasattr(ele, "many_to_many") and ele.many_to_many == True
             ]
             import_field_dict = {'id':'更新主键(勿改)',**self.import_field_dict}
-            data = import_to_data(request.data.get("url"), import_field_dict, m2m_fields)
-            for ele in data:
-                filter_dic = {'id':ele.get('id')}
-                instance = filter_dic and queryset.filter(**filter_dic).first()
-                # print(156,ele)
-                serializer = self.import_serializer_class(instance, data=ele, request=request)
-                serializer.is_valid(raise_exception=True)
-                serializer.save()
-            return DetailResponse(msg=f"导入成功！")
+            result = {"created": 0, "updated": 0, "errors": []}
+            chunk = []
+            for row in iter_import_rows(request.data.get("url"), import_field_dict, m2m_fields):
+                chunk.append(row)
+                if len(chunk) >= self.import_chunk_size:
+                    self.import_chunk(request, queryset, chunk, m2m_fields, result)
+                    chunk = []
+            if chunk:
+                self.import_chunk(request, queryset, chunk, m2m_fields, result)
+            if result["created"] or result["updated"]:
+                self.after_import(request, result)
+            if result["errors"]:
+                return DetailResponse(
+                    data=result,
+                    msg=f"导入完成，成功{result['created'] + result['updated']}条，失败{len(result['errors'])}条"
+                )
+            return DetailResponse(data=result, msg=f"导入成功！")
+
+    def import_chunk(self, request, queryset, chunk, m2m_fields, result):
+        """
+        校验并写入一批导入数据
+        (1)按id批量查询需要更新的数据
+        (2)逐行使用导入序列化器校验, 校验失败的行记录错误后跳过
+        (3)import_bulk_save开启时, 校验通过的数据使用bulk_create/bulk_update写入, 批量写入失败时逐行写入以定位出错的行;
+           未开启时逐行调用序列化器保存
+        :param request:
+        :param queryset: 可导入更新的数据范围
+        :param chunk: [(行号, 数据, 错误信息), ...]
+        :param m2m_fields: 多对多字段
+        :param result: 导入结果, 记录新增/更新条数及行级错误
+        :return:
+        """
+        model = queryset.model
+        pk_values = set()
+        for row_number, data, error in chunk:
+            if data and data.get('id') not in (None, ''):
+                try:
+                    pk_values.add(model._meta.pk.to_python(data['id']))
+                except ValidationError:
+                    pass
+        existing = {str(obj.pk): obj for obj in queryset.filter(pk__in=pk_values)} if pk_values else {}
+        creates, updates = [], []
+        for row_number, data, error in chunk:
+            if error:
+                result["errors"].append({"row": row_number, "errors": error})
+                continue
+            instance = existing.get(str(data.get('id')))
+            serializer = self.import_serializer_class(instance, data=data, request=request)
+            if not serializer.is_valid():
+                result["errors"].append({"row": row_number, "errors": serializer.errors})
+                continue
+            if not self.import_bulk_save:
+                try:
+                    with transaction.atomic():
+                        serializer.save()
+                    result["updated" if instance else "created"] += 1
+                except IMPORT_ROW_ERRORS as e:
+                    result["errors"].append({"row": row_number, "errors": get_import_row_error(e)})
+                continue
+            item = (row_number, *self.get_import_instance(request, serializer, m2m_fields))
+            (updates if instance else creates).append(item)
+        try:
+            with transaction.atomic():
+                self.bulk_save_import(model, creates, updates)
+            result["created"] += len(creates)
+            result["updated"] += len(updates)
+        except IMPORT_ROW_ERRORS:
+            for items, key in ((creates, "created"), (updates, "updated")):
+                for row_number, obj, m2m_data, fields in items:
+                    if key == "created":
+                        obj.pk = None
+                        obj._state.adding = True
+                    try:
+                        with transaction.atomic():
+                            obj.save()
+                            for name, values in m2m_data.items():
+                                getattr(obj, name).set(values)
+                        result[key] += 1
+                    except IMPORT_ROW_ERRORS as e:
+                        result["errors"].append({"row": row_number, "errors": get_import_row_error(e)})
+
+    def get_import_instance(self, request, serializer, m2m_fields):
+        """
+        根据校验后的数据生成未保存的模型对象, 审计字段与CustomModelSerializer保持一致
+        :param request:
+        :param serializer: 已校验的导入序列化器
+        :param m2m_fields: 多对多字段
+        :return: (模型对象, 多对多数据, 更新字段)
+        """
+        validated_data = dict(serializer.validated_data)
+        m2m_data = {name: validated_data.pop(name) for name in m2m_fields if name in validated_data}
+        instance = serializer.instance or serializer.Meta.model()
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        fields = list(validated_data.keys())
+        if str(request.user) != "AnonymousUser":
+            if serializer.modifier_field_id in serializer.fields:
+                setattr(instance, serializer.modifier_field_id, serializer.get_request_user_id())
+                fields.append(serializer.modifier_field_id)
+            if serializer.instance is None:
+                if serializer.creator_field_id in serializer.fields:
+                    setattr(instance, serializer.creator_field_id, request.user)
+                if (
+                        serializer.dept_belong_id_field_name in serializer.fields
+                        and getattr(instance, serializer.dept_belong_id_field_name, None) is None
+                ):
+                    setattr(instance, serializer.dept_belong_id_field_name, getattr(request.user, "dept_id", None))
+        if serializer.instance is not None and hasattr(instance, "update_datetime"):
+            # bulk_update不会触发auto_now
+            instance.update_datetime = timezone.now()
+            fields.append("update_datetime")
+        prepare_import_instance = getattr(serializer, "prepare_import_instance", None)
+        if prepare_import_instance:
+            fields.extend(prepare_import_instance(instance) or [])
+        return instance, m2m_data, fields
+
+    def bulk_save_import(self, model, creates, updates):
+        """
+        批量写入导入数据
+        :param model:
+        :param creates: 新增的数据 [(行号, 模型对象, 多对多数据, 更新字段), ...]
+        :param updates: 更新的数据
+        :return:
+        """
+        if creates:
+            objs = [obj for _, obj, _, _ in creates]
+            has_m2m = any(m2m_data for _, _, m2m_data, _ in creates)
+            if has_m2m and not connections[model.objects.db].features.can_return_rows_from_bulk_insert:
+                # 数据库不支持批量插入后返回主键时, 逐条写入以便保存多对多数据
+                for obj in objs:
+                    obj.save()
+            else:
+                model.objects.bulk_create(objs, batch_size=self.import_chunk_size)
+        if updates:
+            fields = {field for _, _, _, item_fields in updates for field in item_fields}
+            fields.discard(model._meta.pk.name)
+            if fields:
+                model.objects.bulk_update([obj for _, obj, _, _ in updates], fields, batch_size=self.import_chunk_size)
+        self.bulk_save_import_m2m(model, creates + updates)
+
+    def bulk_save_import_m2m(self, model, items):
+        """
+        批量写入多对多数据, 导入中包含的多对多字段会覆盖原有关联
+        """
+        m2m_names = {name for _, _, m2m_data, _ in items for name in m2m_data}
+        for name in m2m_names:
+            field = model._meta.get_field(name)
+            through = field.remote_field.through
+            source = field.m2m_field_name()
+            target = field.m2m_reverse_field_name()
+            objs = [(obj, m2m_data[name]) for _, obj, m2m_data, _ in items if name in m2m_data]
+            through.objects.filter(**{f"{source}__in": [obj.pk for obj, _ in objs]}).delete()
+            through.objects.bulk_create(
+                [
+                    through(**{f"{source}_id": obj.pk, f"{target}_id": getattr(value, "pk", value)})
+                    for obj, values in objs
+                    for value in values
+                ],
+                batch_size=self.import_chunk_size,
+                ignore_conflicts=True,
+            )
+
+    def after_import(self, request, result):
+        """
+        导入完成后的处理, 批量写入不会触发模型的save及信号, 需要时由子类覆盖
+        :param request:
+        :param result: 导入结果
+        :return:
+        """
+        pass
 
     @action(methods=['get'],detail=False)
     def update_template(self,request):
@@ -303,10 +487,15 @@ class ExportSerializerMixin:
         queryset = self.filter_queryset(self.get_queryset())
         assert self.export_field_label, "'%s' 请配置对应的导出模板字段。" % self.__class__.__name__
         assert self.export_serializer_class, "'%s' 请配置对应的导出序列化器。" % self.__class__.__name__
-        data = self.export_serializer_class(queryset, many=True, request=request).data
         try:
+            # 只传递查询参数, 由任务重建查询集后流式导出
             async_export_data.delay(
-                data,
+                f"{self.__class__.__module__}.{self.__class__.__name__}",
+                request.user.pk,
+                request.path,
+                request.method,
+                dict(request.query_params.lists()),
+                self.kwargs,
                 str(f"导出{get_verbose_name(queryset)}-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"),
                 DownloadCenter.objects.create(creator=request.user, task_name=f'{get_verbose_name(queryset)}数据导出任务', dept_belong_id=request.user.dept_id).pk,
                 self.export_field_label
@@ -318,41 +507,10 @@ class ExportSerializerMixin:
         response = HttpResponse(content_type="application/msexcel")
         response["Access-Control-Expose-Headers"] = f"Content-Disposition"
         response["content-disposition"] = f'attachment;filename={quote(str(f"导出{get_verbose_name(queryset)}.xlsx"))}'
-        wb = Workbook()
-        ws = wb.active
-        header_data = ["序号", *self.export_field_label.values()]
-        hidden_header = ["#", *self.export_field_label.keys()]
-        df_len_max = [self.get_string_len(ele) for ele in header_data]
-        row = get_column_letter(len(self.export_field_label) + 1)
-        column = 1
-        ws.append(header_data)
-        for index, results in enumerate(data):
-            results_list = []
-            for h_index, h_item in enumerate(hidden_header):
-                for key,val in results.items():
-                    if key == h_item:
-                        if val is None or val=="":
-                            results_list.append("")
-                        else:
-                            results_list.append(val)
-                        # 计算最大列宽度
-                        result_column_width = self.get_string_len(val)
-                        if h_index !=0 and result_column_width > df_len_max[h_index]:
-                            df_len_max[h_index] = result_column_width
-            ws.append([index + 1, *results_list])
-            column += 1
-        # 　更新列宽
-        for index, width in enumerate(df_len_max):
-            ws.column_dimensions[get_column_letter(index + 1)].width = width
-        tab = Table(displayName="Table", ref=f"A1:{row}{column}")  # 名称管理器
-        style = TableStyleInfo(
-            name="TableStyleLight11",
-            showFirstColumn=True,
-            showLastColumn=True,
-            showRowStripes=True,
-            showColumnStripes=True,
+        export_to_excel(
+            iter_export_rows(queryset, self.export_serializer_class, request),
+            self.export_field_label,
+            response,
+            max_width=self.export_column_width,
         )
-        tab.tableStyleInfo = style
-        ws.add_table(tab)
-        wb.save(response)
         return response
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 操作日志异步批量写入
+(1)请求线程只负责组装日志对象并放入有界队列
+(2)后台线程按数量/时间阈值从队列中取出批量写入, 创建/修改时间保持为入队时(请求时)的时间
+(3)队列满时按配置的策略处理: drop(丢弃) / block(阻塞等待) / sync(当前线程直接写入)
+(4)租户模式下日志随请求所在的租户一起入队, 后台线程切换到对应租户的schema写入
+(5)后台线程按stats_interval定期记录写入器运行状态
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection, router, transaction
+from django.utils import timezone
+
+from application import dispatch
+
+logger = logging.getLogger(__name__)
+
+
+class OperationLogWriter:
+    """
+    操作日志批量写入器
+    """
+
+    def __init__(self, model, max_queue_size=10000, batch_size=100, flush_interval=2.0, overflow_policy="drop",
+                 block_timeout=1.0, stats_interval=300):
+        self.model = model
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.stats_interval = stats_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.written_count = 0
+        self.dropped_count = 0
+        self.failed_count = 0
+
+    def _ensure_started(self):
+        """
+        懒启动后台线程, fork出的子进程需要重新启动
+        """
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_queue_size)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="operation-log-writer", daemon=True)
+            self._thread.start()
+
+    def put(self, instance):
+        """
+        放入一条待写入的日志, 同时记录当前租户
+        :param instance: 未保存的日志模型对象
+        :return: 是否成功放入队列或已写入
+        """
+        self._ensure_started()
+        item = (getattr(connection, "tenant", None), instance)
+        try:
+            if self.overflow_policy == "block":
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            if self.overflow_policy == "sync":
+                self._write([item])
+                return True
+            with self._stats_lock:
+                self.dropped_count += 1
+                dropped_count = self.dropped_count
+            if dropped_count % 1000 == 1:
+                logger.warning(f"操作日志队列已满, 已丢弃{dropped_count}条日志")
+            return False
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        last_stats = time.monotonic()
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            if self.stats_interval and time.monotonic() - last_stats >= self.stats_interval:
+                last_stats = time.monotonic()
+                logger.info(f"操作日志写入器状态: {self.stats()}")
+
+    def _write(self, batch):
+        """
+        按租户分组批量写入
+        :param batch: [(租户, 日志模型对象), ...]
+        """
+        groups = {}
+        for tenant, instance in batch:
+            groups.setdefault(getattr(tenant, "schema_name", None), (tenant, []))[1].append(instance)
+        with self._flush_lock:
+            try:
+                for tenant, instances in groups.values():
+                    self._bulk_create(tenant, instances)
+            finally:
+                close_old_connections()
+
+    def _bulk_create(self, tenant, instances):
+        try:
+            if tenant is not None and dispatch.is_tenants_mode():
+                from django_tenants.utils import tenant_context
+
+                with tenant_context(tenant):
+                    self._insert(instances)
+            else:
+                self._insert(instances)
+            with self._stats_lock:
+                self.written_count += len(instances)
+        except Exception as e:
+            with self._stats_lock:
+                self.failed_count += len(instances)
+            logger.exception(f"操作日志批量写入失败: {e}")
+
+    def _insert(self, instances):
+        """
+        按对象上的原值批量写入
+        bulk_create会由auto_now/auto_now_add把创建/修改时间改写为写入时间, 这里以raw方式写入保留请求时的时间
+        :param instances: 日志模型对象列表
+        """
+        opts = self.model._meta
+        now = timezone.now()
+        for instance in instances:
+            for field in opts.concrete_fields:
+                if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                    if getattr(instance, field.attname) is None:
+                        setattr(instance, field.attname, now)
+        fields = [field for field in opts.concrete_fields if field is not opts.pk]
+        using = router.db_for_write(self.model)
+        queryset = self.model._base_manager.using(using)
+        with transaction.atomic(using=using, savepoint=False):
+            for i in range(0, len(instances), self.batch_size):
+                queryset._insert(instances[i:i + self.batch_size], fields=fields, raw=True, using=using)
+
+    def flush(self):
+        """
+        在当前线程中写入队列中的全部日志(进程退出/测试时使用)
+        """
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write(batch)
+
+    def stats(self):
+        """
+        写入器运行状态
+        """
+        with self._stats_lock:
+            return {
+                "queue_size": self._queue.qsize(),
+                "max_queue_size": self.max_queue_size,
+                "written_count": self.written_count,
+                "dropped_count": self.dropped_count,
+                "failed_count": self.failed_count,
+                "overflow_policy": self.overflow_policy,
+            }
+
+
+_operation_log_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_operation_log_writer():
+    """
+    获取进程内共享的操作日志写入器
+    """
+    global _operation_log_writer
+    if _operation_log_writer is None:
+        with _writer_lock:
+            if _operation_log_writer is None:
+                from dvadmin.system.models import OperationLog
+
+                _operation_log_writer = OperationLogWriter(
+                    OperationLog,
+                    max_queue_size=getattr(settings, 'API_LOG_QUEUE_SIZE', 10000),
+                    batch_size=getattr(settings, 'API_LOG_BATCH_SIZE', 100),
+                    flush_interval=getattr(settings, 'API_LOG_FLUSH_INTERVAL', 2),
+                    overflow_policy=getattr(settings, 'API_LOG_OVERFLOW_POLICY', 'drop'),
+                    stats_interval=getattr(settings, 'API_LOG_STATS_INTERVAL', 300),
+                )
+                atexit.register(_operation_log_writer.flush)
+    return _operation_log_writer
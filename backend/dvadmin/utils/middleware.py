@@ -7,9 +7,13 @@ import logging
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.http import HttpResponse, HttpResponseServerError
+from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin
 
 from dvadmin.system.models import OperationLog
+from dvadmin.utils.log_writer import get_operation_log_writer
+from dvadmin.utils.query_util import QueryRecorder, QueryBudgetExceeded, check_query_budget, get_query_budget, \
+    query_stats
 from dvadmin.utils.request_util import get_request_user, get_request_ip, get_request_data, get_request_path, get_os, \
     get_browser, get_verbose_name
 
@@ -17,12 +21,14 @@ from dvadmin.utils.request_util import get_request_user, get_request_ip, get_req
 class ApiLoggingMiddleware(MiddlewareMixin):
     """
     用于记录API访问日志中间件
+    日志在请求结束时一次组装完成; 开启API_LOG_ASYNC时交由后台线程批量写入, 否则直接写入
     """
 
     def __init__(self, get_response=None):
         super().__init__(get_response)
         self.enable = getattr(settings, 'API_LOG_ENABLE', None) or False
         self.methods = getattr(settings, 'API_LOG_METHODS', None) or set()
+        self.async_enable = getattr(settings, 'API_LOG_ASYNC', True)
         self.operation_log_id = None
 
     @classmethod
@@ -33,12 +39,10 @@ class ApiLoggingMiddleware(MiddlewareMixin):
 
     def __handle_response(self, request, response):
 
-        # 判断有无log_id属性，使用All记录时，会出现此情况
-        if request.request_data.get('log_id', None) is None:
+        # 判断有无request_modular属性，使用All记录时，会出现此情况
+        request_modular = getattr(request, 'request_modular', None)
+        if request_modular is None:
             return
-        
-        # 移除log_id，不记录此ID
-        log_id = request.request_data.pop('log_id')
 
         # request_data,request_ip由PermissionInterfaceMiddleware中间件中添加的属性
         body = getattr(request, 'request_data', {})
@@ -54,7 +58,10 @@ class ApiLoggingMiddleware(MiddlewareMixin):
         except Exception:
             return
         user = get_request_user(request)
+        # 异步写入时日志在后台线程中入库, 创建时间需取请求时的时间
+        now = timezone.now()
         info = {
+            'request_modular': request_modular or settings.API_MODEL_MAP.get(request.request_path, None),
             'request_ip': getattr(request, 'request_ip', 'unknown'),
             'creator': user if not isinstance(user, AnonymousUser) else None,
             'dept_belong_id': getattr(request.user, 'dept_id', None),
@@ -67,20 +74,20 @@ class ApiLoggingMiddleware(MiddlewareMixin):
             'request_msg': request.session.get('request_msg'),
             'status': True if response.data.get('code') in [2000, ] else False,
             'json_result': {"code": response.data.get('code'), "msg": response.data.get('msg')},
+            'create_datetime': now,
+            'update_datetime': now,
         }
-        operation_log, creat = OperationLog.objects.update_or_create(defaults=info, id=log_id)
-        if not operation_log.request_modular and settings.API_MODEL_MAP.get(request.request_path, None):
-            operation_log.request_modular = settings.API_MODEL_MAP[request.request_path]
+        operation_log = OperationLog(**info)
+        if self.async_enable:
+            get_operation_log_writer().put(operation_log)
+        else:
             operation_log.save()
 
     def process_view(self, request, view_func, view_args, view_kwargs):
         if hasattr(view_func, 'cls') and hasattr(view_func.cls, 'queryset'):
             if self.enable:
                 if self.methods == 'ALL' or request.method in self.methods:
-                    log = OperationLog(request_modular=get_verbose_name(view_func.cls.queryset))
-                    log.save()
-                    # self.operation_log_id = log.id
-                    request.request_data['log_id'] = log.id
+                    request.request_modular = get_verbose_name(view_func.cls.queryset)
 
         return
 
@@ -99,6 +106,53 @@ class ApiLoggingMiddleware(MiddlewareMixin):
                 self.__handle_response(request, response)
         return response
 
+query_logger = logging.getLogger("query_budget")
+
+
+class QueryInstrumentMiddleware:
+    """
+    SQL查询统计中间件, QUERY_INSTRUMENT_ENABLE开启时生效
+    (1)响应头返回本次请求的查询数、重复查询数及查询耗时
+    (2)按接口汇总统计结果, 超出视图集声明的query_budget时记录日志, QUERY_BUDGET_STRICT时返回错误
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enable = getattr(settings, 'QUERY_INSTRUMENT_ENABLE', False)
+        self.strict = getattr(settings, 'QUERY_BUDGET_STRICT', False)
+
+    def __call__(self, request):
+        if not self.enable:
+            return self.get_response(request)
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        view_label = getattr(request, 'query_view_label', None)
+        if view_label is None:
+            return response
+        budget = getattr(request, 'query_budget', None)
+        query_stats.add(view_label, recorder, budget)
+        report = recorder.report()
+        response['X-Query-Count'] = report['count']
+        response['X-Query-Duplicates'] = report['duplicates']
+        response['X-Query-Time'] = report['time_ms']
+        try:
+            check_query_budget(recorder, budget, view_label)
+        except QueryBudgetExceeded as e:
+            query_logger.warning(str(e))
+            if self.strict:
+                raise
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if not self.enable or view_class is None:
+            return
+        actions = getattr(view_func, 'actions', None) or {}
+        action = actions.get(request.method.lower())
+        request.query_view_label = f"{view_class.__name__}.{action}" if action else view_class.__name__
+        request.query_budget = get_query_budget(view_class, action)
+
+
 logger = logging.getLogger("healthz")
 class HealthCheckMiddleware(object):
     """
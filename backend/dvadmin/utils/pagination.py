@@ -7,13 +7,28 @@
 
 @Created on: 2020/4/16 23:35
 """
+import base64
+import binascii
+import datetime
+import hashlib
+import json
+import operator
 from collections import OrderedDict
+from functools import reduce
 
+from django.conf import settings
 from django.core import paginator
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
 from django.core.paginator import Paginator as DjangoPaginator, InvalidPage
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
+from dvadmin.utils.cache_util import get_tenant_namespace
+
 
 class CustomPagination(PageNumberPagination):
     page_size = 10
@@ -81,3 +96,204 @@ class CustomPagination(PageNumberPagination):
             ('is_previous', is_previous),
             ('data', data)
         ]))
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    """游标中的时间保留完整精度, DjangoJSONEncoder会截断到毫秒"""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return data["d"], data["v"]
+    except (TypeError, ValueError, KeyError, UnicodeDecodeError, binascii.Error):
+        return None, None
+
+
+def _encode_cursor(direction, values):
+    data = json.dumps({"d": direction, "v": values}, cls=_CursorEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+class KeysetPagination(CustomPagination):
+    """
+    游标(keyset)分页, 适用于日志等数据量大的表, 视图集设置 pagination_class = KeysetPagination 开启
+    (1)按查询集的排序字段(默认模型Meta.ordering)加主键排序, 以上一页最后一行的排序值作为游标, 避免OFFSET扫描
+    (2)请求带cursor参数时按游标翻页; 只带page参数时按OFFSET取数但不统计总数, 兼容原有前端
+    (3)总数按count_mode统计: exact(精确) / cached(精确值缓存count_cache_timeout秒) / estimate(无过滤条件时读取数据库统计信息)
+    (4)返回格式与CustomPagination一致, 另外返回next_cursor/previous_cursor
+    """
+    cursor_query_param = "cursor"
+    count_mode = getattr(settings, "PAGINATION_COUNT_MODE", "cached")
+    count_cache_timeout = getattr(settings, "PAGINATION_COUNT_CACHE_TIMEOUT", 60)
+    # 估算值小于该数量时仍精确统计
+    estimate_threshold = 100000
+
+    def get_ordering(self, queryset):
+        """
+        排序字段 [(字段, 是否倒序, 空值是否排在最后)], 末尾补充主键保证顺序唯一
+        """
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering or [])
+        if not all(isinstance(item, str) for item in ordering):
+            ordering = []
+        pk_name = queryset.model._meta.pk.name
+        result = []
+        for item in ordering:
+            field = item.lstrip("-")
+            field = pk_name if field == "pk" else field
+            result.append((field, item.startswith("-")))
+        if not result or result[-1][0] != pk_name:
+            result.append((pk_name, result[-1][1] if result else True))
+        # postgresql/oracle的空值视为最大值, mysql/sqlite视为最小值
+        nulls_largest = connections[queryset.db].vendor in ("postgresql", "oracle")
+        return [(field, desc, desc != nulls_largest) for field, desc in result]
+
+    @staticmethod
+    def _keyset_filter(ordering, values):
+        """构建排在游标之后的数据的过滤条件"""
+        condition = None
+        for (field, desc, nulls_last), value in reversed(list(zip(ordering, values))):
+            if value is None:
+                after = None if nulls_last else Q(**{f"{field}__isnull": False})
+                equal = Q(**{f"{field}__isnull": True})
+            else:
+                after = Q(**{f"{field}__{'lt' if desc else 'gt'}": value})
+                if nulls_last:
+                    after |= Q(**{f"{field}__isnull": True})
+                equal = Q(**{field: value})
+            parts = [part for part in (after, equal & condition if condition is not None else None) if part is not None]
+            condition = reduce(operator.or_, parts) if parts else Q(pk__in=[])
+        return condition
+
+    @staticmethod
+    def _row_values(row, ordering):
+        values = []
+        for field, _, _ in ordering:
+            if isinstance(row, dict):
+                values.append(row.get(field))
+                continue
+            value = row
+            for attr in field.split("__"):
+                value = getattr(value, attr, None)
+                if value is None:
+                    break
+            values.append(getattr(value, "pk", value))
+        return values
+
+    @staticmethod
+    def _parse_values(queryset, ordering, values):
+        parsed = []
+        for (field, _, _), value in zip(ordering, values):
+            try:
+                parsed.append(queryset.model._meta.get_field(field).to_python(value) if value is not None else None)
+            except (FieldDoesNotExist, ValidationError):
+                parsed.append(value)
+        return parsed
+
+    def get_count(self, queryset):
+        """按count_mode统计总数"""
+        if self.count_mode == "exact":
+            return queryset.count()
+        if self.count_mode == "estimate" and not queryset.query.where:
+            estimate = self.get_estimated_count(queryset)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        # 租户模式下schema由search_path决定, 不在sql中, 需按租户区分
+        key = get_tenant_namespace("pagination_count") + ":" + hashlib.md5(
+            f"{queryset.db}:{sql}:{params}".encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.count_cache_timeout)
+        return count
+
+    @staticmethod
+    def get_estimated_count(queryset):
+        """读取数据库统计信息中的表行数, 不支持时返回None"""
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        if connection.vendor == "postgresql":
+            sql, params = "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", [table]
+        elif connection.vendor == "mysql":
+            sql = "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+            params = [table]
+        else:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if not row or row[0] is None or row[0] < 0:
+            return None
+        return int(row[0])
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        self.request = request
+        self.limit = page_size
+        self.ordering = self.get_ordering(queryset)
+        try:
+            self.page_number = max(int(request.query_params.get(self.page_query_param, 1)), 1)
+        except (TypeError, ValueError):
+            self.page_number = 1
+
+        direction, values = None, None
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            direction, values = _decode_cursor(cursor)
+            if direction not in ("next", "previous") or not isinstance(values, list) \
+                    or len(values) != len(self.ordering):
+                direction, values = None, None
+        reverse = direction == "previous"
+        ordering = [(field, desc != reverse, nulls_last != reverse) for field, desc, nulls_last in self.ordering]
+        page_queryset = queryset.order_by(*[f"-{field}" if desc else field for field, desc, _ in ordering])
+
+        self.total = self.get_count(queryset)
+        if values is not None:
+            page_queryset = page_queryset.filter(
+                self._keyset_filter(ordering, self._parse_values(queryset, ordering, values)))
+            rows = list(page_queryset[:page_size + 1])
+        else:
+            offset = (self.page_number - 1) * page_size
+            rows = list(page_queryset[offset:offset + page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+            self.is_next, self.is_previous = True, has_more
+        else:
+            self.is_next, self.is_previous = has_more, values is not None or self.page_number > 1
+        self.next_cursor = _encode_cursor("next", self._row_values(rows[-1], self.ordering)) \
+            if rows and self.is_next else None
+        self.previous_cursor = _encode_cursor("previous", self._row_values(rows[0], self.ordering)) \
+            if rows and self.is_previous else None
+        return rows
+
+    def get_paginated_response(self, data):
+        code = 2000
+        msg = 'success'
+        if not data:
+            msg = "暂无数据"
+            data = []
+        return Response(OrderedDict([
+            ('code', code),
+            ('msg', msg),
+            ('page', self.page_number),
+            ('limit', self.limit),
+            ('total', self.total),
+            ('is_next', self.is_next),
+            ('is_previous', self.is_previous),
+            ('next_cursor', self.next_cursor),
+            ('previous_cursor', self.previous_cursor),
+            ('data', data)
+        ]))
@@ -13,6 +13,8 @@ from django.db.models import F
 from rest_framework.permissions import BasePermission
 
 from dvadmin.system.models import ApiWhiteList, RoleMenuButtonPermission
+from dvadmin.utils.cache_util import TenantLocalVersionedCache, get_cache_version, get_tenant_namespace, \
+    versioned_cache_get
 
 
 def ValidationApi(reqApi, validApi):
@@ -88,6 +90,110 @@ def ReUUID(api):
         return None
 
 
+METHOD_LIST = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH']
+# 接口权限缓存命名空间, 白名单/按钮/角色按钮权限/用户角色变更时递增版本号, 租户模式下各租户独立
+API_PERMISSION_CACHE_NAMESPACE = "api_permission"
+_api_permission_local_cache = TenantLocalVersionedCache(API_PERMISSION_CACHE_NAMESPACE)
+
+
+def _group_api_patterns(api_list):
+    """
+    将接口按请求方法分组, 并转换为正则
+    :param api_list: [{"api": 接口地址, "method": 请求方法}]
+    :return: {请求方法: [正则, ...]}
+    """
+    patterns = {}
+    for item in api_list:
+        api = item.get('api')
+        method = item.get('method')
+        if not api or method is None:
+            continue
+        pattern = str(api).replace('{id}', '([a-zA-Z0-9-]+)') + '$'
+        method_patterns = patterns.setdefault(method, [])
+        if pattern not in method_patterns:
+            method_patterns.append(pattern)
+    return patterns
+
+
+def _compile_api_patterns(patterns):
+    """
+    将同一请求方法下的所有正则合并为一个正则
+    :param patterns: {请求方法: [正则, ...]}
+    :return: {请求方法: 编译后的正则}
+    """
+    matchers = {}
+    for method, method_patterns in patterns.items():
+        valid_patterns = []
+        for pattern in method_patterns:
+            try:
+                re.compile(pattern)
+            except re.error:
+                continue
+            valid_patterns.append(f"(?:{pattern})")
+        if valid_patterns:
+            matchers[method] = re.compile("|".join(valid_patterns), re.M | re.I)
+    return matchers
+
+
+def get_user_role_ids(user, version=None):
+    """
+    获取用户的角色id列表(缓存)
+    :param user: 当前用户
+    :param version: 当前租户的缓存版本号
+    :return:
+    """
+    return versioned_cache_get(
+        get_tenant_namespace(API_PERMISSION_CACHE_NAMESPACE),
+        f"user_role:{user.pk}",
+        lambda: sorted(user.role.values_list('id', flat=True)),
+        version=version,
+    )
+
+
+def get_role_api_patterns(role_id_list, version=None):
+    """
+    获取角色集合可访问的接口正则(含接口白名单), 按请求方法分组
+    :param role_id_list: 角色id列表
+    :param version: 当前租户的缓存版本号
+    :return: {请求方法: [正则, ...]}
+    """
+    role_id_list = sorted(set(role_id_list))
+
+    def loader():
+        api_white_list = ApiWhiteList.objects.values(api=F('url'), method_value=F('method'))
+        user_api_list = RoleMenuButtonPermission.objects.filter(role__in=role_id_list).values(
+            api=F('menu_button__api'), method_value=F('menu_button__method'))
+        api_list = [
+            {'api': item.get('api'), 'method': item.get('method_value')}
+            for item in list(api_white_list) + list(user_api_list)
+        ]
+        return _group_api_patterns(api_list)
+
+    return versioned_cache_get(
+        get_tenant_namespace(API_PERMISSION_CACHE_NAMESPACE),
+        "role_api:" + ",".join(str(role_id) for role_id in role_id_list),
+        loader,
+        version=version,
+    )
+
+
+def get_api_permission_matcher(role_id_list, version=None):
+    """
+    获取角色集合的接口权限匹配器, 进程内缓存编译后的正则
+    :param role_id_list: 角色id列表
+    :param version: 当前租户的缓存版本号
+    :return: {请求方法: 编译后的正则}
+    """
+    if version is None:
+        version = get_cache_version(get_tenant_namespace(API_PERMISSION_CACHE_NAMESPACE))
+    key = tuple(sorted(set(role_id_list)))
+    return _api_permission_local_cache.get(
+        key,
+        lambda: _compile_api_patterns(get_role_api_patterns(key, version)),
+        version=version,
+    )
+
+
 class CustomPermission(BasePermission):
     """自定义权限"""
 
@@ -100,29 +206,13 @@ class CustomPermission(BasePermission):
         else:
             api = request.path  # 当前请求接口
             method = request.method  # 当前请求方法
-            methodList = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH']
-            method = methodList.index(method)
-            # ***接口白名单***
-            api_white_list = ApiWhiteList.objects.values(permission__api=F('url'), permission__method=F('method'))
-            api_white_list = [
-                str(item.get('permission__api').replace('{id}', '([a-zA-Z0-9-]+)')) + ":" + str(
-                    item.get('permission__method')) + '$' for item in api_white_list if item.get('permission__api')]
-            # ********#
+            method = METHOD_LIST.index(method)
             if not hasattr(request.user, "role"):
                 return False
-            role_id_list = request.user.role.values_list('id', flat=True)
-            userApiList = RoleMenuButtonPermission.objects.filter(role__in=role_id_list).values(
-                permission__api=F('menu_button__api'), permission__method=F('menu_button__method'))  # 获取当前用户的角色拥有的所有接口
-            ApiList = [
-                str(item.get('permission__api').replace('{id}', '([a-zA-Z0-9-]+)')) + ":" + str(
-                    item.get('permission__method')) + '$' for item in userApiList if item.get('permission__api')]
-            new_api_ist = api_white_list + ApiList
-            new_api = api + ":" + str(method)
-            for item in new_api_ist:
-                matchObj = re.match(item, new_api, re.M | re.I)
-                if matchObj is None:
-                    continue
-                else:
-                    return True
-            else:
+            # 接口白名单 + 当前用户的角色拥有的所有接口, 按请求方法预编译
+            version = get_cache_version(get_tenant_namespace(API_PERMISSION_CACHE_NAMESPACE))
+            role_id_list = get_user_role_ids(request.user, version)
+            matcher = get_api_permission_matcher(role_id_list, version).get(method)
+            if matcher is None:
                 return False
+            return matcher.match(api) is not None
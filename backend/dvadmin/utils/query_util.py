@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: SQL查询统计及查询预算
+(1)QueryRecorder记录一段代码执行的查询数、耗时及重复的SQL指纹, 并归属到触发查询的序列化器字段
+(2)视图集声明query_budget(整数或{action: 整数}), 超出预算时记录日志, 严格模式下抛出异常
+(3)各接口的统计结果在进程内汇总(不跨进程), 供统计接口查询
+"""
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.db import connections
+from rest_framework.serializers import BaseSerializer, Field
+
+_fingerprint_patterns = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+class QueryBudgetExceeded(AssertionError):
+    """查询数超出预算"""
+
+
+def sql_fingerprint(sql):
+    """
+    SQL指纹: 去掉参数值, 同一条语句不同参数的查询指纹相同
+    :param sql: SQL语句
+    :return:
+    """
+    for pattern, repl in _fingerprint_patterns:
+        sql = pattern.sub(repl, sql)
+    return sql.strip()
+
+
+def _query_source():
+    """从调用栈中查找触发查询的序列化器字段, 返回 序列化器.字段 """
+    frame = sys._getframe(2)
+    while frame is not None:
+        instance = frame.f_locals.get('self')
+        # 使用type判断, 避免isinstance触发惰性对象(如request.user)求值
+        cls = type(instance)
+        if issubclass(cls, Field) and not issubclass(cls, BaseSerializer) and instance.field_name:
+            return f"{type(instance.parent).__name__}.{instance.field_name}"
+        frame = frame.f_back
+    return None
+
+
+class QueryRecorder:
+    """
+    记录代码块内执行的SQL
+    with QueryRecorder() as recorder:
+        ...
+    recorder.count / recorder.duration / recorder.duplicates / recorder.sources
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.queries = []
+        self._stack = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'fingerprint': sql_fingerprint(sql),
+                'time': time.perf_counter() - start,
+                'source': _query_source(),
+            })
+
+    def __enter__(self):
+        aliases = [self.using] if self.using else list(connections)
+        for alias in aliases:
+            wrapper = connections[alias].execute_wrapper(self)
+            wrapper.__enter__()
+            self._stack.append(wrapper)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        while self._stack:
+            self._stack.pop().__exit__(exc_type, exc_val, exc_tb)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(query['time'] for query in self.queries)
+
+    @property
+    def fingerprints(self):
+        return Counter(query['fingerprint'] for query in self.queries)
+
+    @property
+    def duplicates(self):
+        """重复执行的查询数(同一指纹第二次及以后的执行)"""
+        return sum(count - 1 for count in self.fingerprints.values())
+
+    @property
+    def sources(self):
+        """各序列化器字段触发的查询数"""
+        return Counter(query['source'] for query in self.queries if query['source'])
+
+    def report(self, top=5):
+        """
+        查询统计摘要
+        :param top: 返回重复最多的指纹、查询最多的字段的条数
+        :return:
+        """
+        return {
+            'count': self.count,
+            'duplicates': self.duplicates,
+            'time_ms': round(self.duration * 1000, 2),
+            'duplicate_fingerprints': [
+                {'sql': sql, 'count': count}
+                for sql, count in self.fingerprints.most_common(top) if count > 1
+            ],
+            'sources': dict(self.sources.most_common(top)),
+        }
+
+
+def get_query_budget(view, action=None):
+    """
+    获取视图声明的查询预算
+    :param view: 视图或视图类
+    :param action: 视图集的action
+    :return: 查询数上限, 未声明时为None
+    """
+    budget = getattr(view, 'query_budget', None)
+    if isinstance(budget, dict):
+        return budget.get(action, budget.get('default'))
+    return budget
+
+
+def check_query_budget(recorder, budget, label=''):
+    """
+    查询数超出预算时抛出QueryBudgetExceeded
+    :param recorder: QueryRecorder
+    :param budget: 查询数上限
+    :param label: 出错信息中的接口名称
+    """
+    if budget is not None and recorder.count > budget:
+        report = recorder.report()
+        raise QueryBudgetExceeded(
+            f"{label} 执行了{recorder.count}次查询, 超出预算{budget}次; "
+            f"重复查询{report['duplicates']}次, 字段: {report['sources']}, "
+            f"重复SQL: {report['duplicate_fingerprints']}"
+        )
+
+
+class query_budget:
+    """
+    测试中限制代码块的查询数
+    with query_budget(3, 'dept list'):
+        client.get('/api/system/dept/')
+    """
+
+    def __init__(self, budget, label='', using=None):
+        self.budget = budget
+        self.label = label
+        self.recorder = QueryRecorder(using)
+
+    def __enter__(self):
+        return self.recorder.__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.recorder.__exit__(exc_type, exc_val, exc_tb)
+        if exc_type is None:
+            check_query_budget(self.recorder, self.budget, self.label)
+
+
+class QueryStats:
+    """各接口查询统计的进程内汇总, 多进程部署时各进程独立统计"""
+
+    def __init__(self, top=10):
+        self.top = top
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def add(self, label, recorder, budget=None):
+        report = recorder.report(self.top)
+        with self._lock:
+            item = self._data.setdefault(label, {
+                'requests': 0, 'queries': 0, 'max_queries': 0, 'duplicates': 0, 'time_ms': 0.0,
+                'budget': budget, 'over_budget': 0, 'sources': Counter(),
+            })
+            item['requests'] += 1
+            item['queries'] += report['count']
+            item['max_queries'] = max(item['max_queries'], report['count'])
+            item['duplicates'] += report['duplicates']
+            item['time_ms'] += report['time_ms']
+            item['budget'] = budget
+            if budget is not None and report['count'] > budget:
+                item['over_budget'] += 1
+            item['sources'].update(recorder.sources)
+
+    def snapshot(self):
+        """按平均查询数降序返回各接口的统计"""
+        with self._lock:
+            result = [
+                {
+                    'view': label,
+                    'requests': item['requests'],
+                    'avg_queries': round(item['queries'] / item['requests'], 2),
+                    'max_queries': item['max_queries'],
+                    'avg_duplicates': round(item['duplicates'] / item['requests'], 2),
+                    'avg_time_ms': round(item['time_ms'] / item['requests'], 2),
+                    'budget': item['budget'],
+                    'over_budget': item['over_budget'],
+                    'sources': dict(item['sources'].most_common(self.top)),
+                }
+                for label, item in self._data.items()
+            ]
+        return sorted(result, key=lambda item: item['avg_queries'], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+
+
+query_stats = QueryStats()
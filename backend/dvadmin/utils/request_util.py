@@ -2,6 +2,7 @@
 Request工具类
 """
 import json
+from functools import lru_cache
 
 import requests
 from django.conf import settings
@@ -120,6 +121,34 @@ def get_request_canonical_path(request, ):
     return path
 
 
+@lru_cache(maxsize=getattr(settings, 'USER_AGENT_CACHE_SIZE', 1024))
+def parse_user_agent(ua_string):
+    """
+    解析User-Agent, 相同的User-Agent只解析一次(LRU缓存)
+    :param ua_string: User-Agent字符串
+    :return: (agent, browser, os)
+    """
+    user_agent = parse(ua_string or '')
+    return str(user_agent), user_agent.get_browser(), user_agent.get_os()
+
+
+def get_user_agent_cache_info():
+    """
+    获取User-Agent解析缓存的命中情况
+    :return: hits/misses/maxsize/currsize
+    """
+    return parse_user_agent.cache_info()._asdict()
+
+
+def get_user_agent(request):
+    """
+    获取请求的User-Agent解析结果
+    :param request:
+    :return: (agent, browser, os)
+    """
+    return parse_user_agent(request.META.get('HTTP_USER_AGENT', ''))
+
+
 def get_browser(request, ):
     """
     获取浏览器名
@@ -128,9 +157,7 @@ def get_browser(request, ):
     :param kwargs:
     :return:
     """
-    ua_string = request.META['HTTP_USER_AGENT']
-    user_agent = parse(ua_string)
-    return user_agent.get_browser()
+    return get_user_agent(request)[1]
 
 
 def get_os(request, ):
@@ -141,9 +168,7 @@ def get_os(request, ):
     :param kwargs:
     :return:
     """
-    ua_string = request.META['HTTP_USER_AGENT']
-    user_agent = parse(ua_string)
-    return user_agent.get_os()
+    return get_user_agent(request)[2]
 
 
 def get_verbose_name(queryset=None, view=None, model=None):
@@ -211,9 +236,7 @@ def save_login_log(request):
     analysis_data = get_ip_analysis(ip)
     analysis_data['username'] = request.user.username
     analysis_data['ip'] = ip
-    analysis_data['agent'] = str(parse(request.META['HTTP_USER_AGENT']))
-    analysis_data['browser'] = get_browser(request)
-    analysis_data['os'] = get_os(request)
+    analysis_data['agent'], analysis_data['browser'], analysis_data['os'] = get_user_agent(request)
     analysis_data['creator_id'] = request.user.id
     analysis_data['dept_belong_id'] = getattr(request.user, 'dept_id', '')
     LoginLog.objects.create(**analysis_data)
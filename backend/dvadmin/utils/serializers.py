@@ -6,17 +6,81 @@
 @Created on: 2021/6/1 001 22:47
 @Remark: 自定义序列化器
 """
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
 from rest_framework import serializers
 from rest_framework.fields import empty
 from rest_framework.request import Request
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import ModelSerializer, ListSerializer, LIST_SERIALIZER_KWARGS, \
+    LIST_SERIALIZER_KWARGS_REMOVE
 from django.utils.functional import cached_property
 from rest_framework.utils.serializer_helpers import BindingDict
 
 from dvadmin.system.models import Users
+from dvadmin.utils.cache_util import get_tenant_namespace
 from django_restql.mixins import DynamicFieldsMixin
 
 
+USER_NAME_CACHE_PREFIX = "user_name"
+# 用户姓名缓存时间(秒), 用户修改姓名后最迟在该时间后生效
+USER_NAME_CACHE_TIMEOUT = getattr(settings, 'USER_NAME_CACHE_TIMEOUT', 60)
+
+
+def user_name_cache_key(user_id, namespace=None):
+    """
+    用户姓名的缓存key, 租户模式下各租户独立
+    :param user_id: 用户id
+    :param namespace: 已获取的当前租户命名空间, 不传则按当前租户获取
+    :return:
+    """
+    return f"{namespace or get_tenant_namespace(USER_NAME_CACHE_PREFIX)}:{user_id}"
+
+
+def get_user_names(user_ids):
+    """
+    批量获取用户姓名(缓存), 未缓存的用户一次查询
+    :param user_ids: 用户id列表, 可为字符串形式的id
+    :return: {用户id(int): 姓名}
+    """
+    ids = set()
+    for user_id in user_ids:
+        if isinstance(user_id, int) or (isinstance(user_id, str) and user_id.isdigit()):
+            ids.add(int(user_id))
+    if not ids:
+        return {}
+    namespace = get_tenant_namespace(USER_NAME_CACHE_PREFIX)
+    keys = {user_id: user_name_cache_key(user_id, namespace) for user_id in ids}
+    cached = cache.get_many(list(keys.values()))
+    names = {user_id: cached[key] for user_id, key in keys.items() if key in cached}
+    missing = ids - set(names)
+    if missing:
+        loaded = dict(Users.objects.filter(id__in=missing).values_list("id", "name"))
+        # 不存在的用户也缓存, 避免重复查询
+        loaded.update({user_id: None for user_id in missing if user_id not in loaded})
+        cache.set_many({user_name_cache_key(user_id, namespace): name for user_id, name in loaded.items()},
+                       USER_NAME_CACHE_TIMEOUT)
+        names.update(loaded)
+    return names
+
+
+class AuditListSerializer(ListSerializer):
+    """
+    批量序列化时一次查出当前页所有创建人、修改人的姓名, 避免每行单独查询
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        if not isinstance(iterable, list):
+            iterable = list(iterable)
+        user_ids = set()
+        for item in iterable:
+            user_ids.add(getattr(item, "creator_id", None))
+            user_ids.add(getattr(item, self.child.modifier_field_id, None))
+        self.child.audit_user_names = get_user_names(user_ids)
+        return super().to_representation(iterable)
+
+
 class CustomModelSerializer(DynamicFieldsMixin, ModelSerializer):
     """
     增强DRF的ModelSerializer,可自动更新模型的审计字段记录
@@ -26,24 +90,30 @@ class CustomModelSerializer(DynamicFieldsMixin, ModelSerializer):
     # 修改人的审计字段名称, 默认modifier, 继承使用时可自定义覆盖
     modifier_field_id = "modifier"
     modifier_name = serializers.SerializerMethodField(read_only=True)
+    # 创建人、修改人的姓名, 批量序列化时由AuditListSerializer一次查出
+    audit_user_names = None
+
+    def get_audit_user_name(self, user_id):
+        if user_id is None:
+            return None
+        user_id = str(user_id)
+        if not user_id.isdigit():
+            return None
+        if self.audit_user_names is None or int(user_id) not in self.audit_user_names:
+            return get_user_names([user_id]).get(int(user_id))
+        return self.audit_user_names[int(user_id)]
 
     def get_modifier_name(self, instance):
         if not hasattr(instance, "modifier"):
             return None
-        queryset = (
-            Users.objects.filter(id=instance.modifier)
-            .values_list("name", flat=True)
-            .first()
-        )
-        if queryset:
-            return queryset
-        return None
+        return self.get_audit_user_name(instance.modifier) or None
 
     # 创建人的审计字段名称, 默认creator, 继承使用时可自定义覆盖
     creator_field_id = "creator"
-    creator_name = serializers.SlugRelatedField(
-        slug_field="name", source="creator", read_only=True
-    )
+    creator_name = serializers.SerializerMethodField(read_only=True)
+
+    def get_creator_name(self, instance):
+        return self.get_audit_user_name(getattr(instance, "creator_id", None))
     # 数据所属部门字段
     dept_belong_id_field_name = "dept_belong_id"
     # 添加默认时间返回格式
@@ -58,6 +128,21 @@ class CustomModelSerializer(DynamicFieldsMixin, ModelSerializer):
         super().__init__(instance, data, **kwargs)
         self.request: Request = request or self.context.get("request", None)
 
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        # 未指定list_serializer_class时使用AuditListSerializer批量查询审计字段
+        # 不修改Meta, 未定义Meta的子类继承的是父类的Meta
+        if hasattr(getattr(cls, "Meta", None), "list_serializer_class"):
+            return super().many_init(*args, **kwargs)
+        list_kwargs = {}
+        for key in LIST_SERIALIZER_KWARGS_REMOVE:
+            value = kwargs.pop(key, None)
+            if value is not None:
+                list_kwargs[key] = value
+        list_kwargs["child"] = cls(*args, **kwargs)
+        list_kwargs.update({key: value for key, value in kwargs.items() if key in LIST_SERIALIZER_KWARGS})
+        return AuditListSerializer(*args, **list_kwargs)
+
     def save(self, **kwargs):
         return super().save(**kwargs)
 
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 树形数据序列化的公共方法
+(1)下级节点数、关联数据数在查询集上以子查询注解, 列表只需一次查询
+(2)序列化器优先读取注解, 未注解的实例(如新增后返回)再单独查询
+"""
+from django.db.models import Count, Exists, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(queryset, field, to_field="pk"):
+    """
+    统计关联数据数的子查询
+    :param queryset: 被统计的查询集
+    :param field: 被统计数据中指向外层数据的字段
+    :param to_field: 外层数据被关联的字段
+    :return: 可用于annotate的表达式, 无关联数据时为0
+    """
+    subquery = (
+        queryset.filter(**{field: OuterRef(to_field)})
+        .order_by()
+        .values(field)
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    return Coalesce(Subquery(subquery, output_field=IntegerField()), Value(0))
+
+
+def exists_subquery(queryset, field, to_field="pk"):
+    """
+    判断是否存在关联数据的子查询
+    :param queryset: 被查询的查询集
+    :param field: 被查询数据中指向外层数据的字段
+    :param to_field: 外层数据被关联的字段
+    :return: 可用于annotate的表达式
+    """
+    return Exists(queryset.filter(**{field: OuterRef(to_field)}))
+
+
+def get_annotated(instance, name, loader):
+    """
+    读取实例上的注解值, 未注解时调用loader查询
+    :param instance: 模型实例
+    :param name: 注解名称
+    :param loader: 未注解时的查询函数, 参数为实例
+    :return:
+    """
+    if hasattr(instance, name):
+        return getattr(instance, name)
+    return loader(instance)
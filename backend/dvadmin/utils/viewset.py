@@ -34,6 +34,7 @@ class CustomModelViewSet(ModelViewSet, ImportSerializerMixin, ExportSerializerMi
     (3)filter_fields = '__all__' 默认支持全部model中的字段查询(除json字段外)
     (4)import_field_dict={} 导入时的字段字典 {model值: model的label}
     (5)export_field_label = [] 导出时的字段
+    (6)query_budget = None 每个请求的SQL查询数上限, 整数或{action: 整数}, 开启QUERY_INSTRUMENT_ENABLE时检查
     """
     values_queryset = None
     ordering_fields = '__all__'
@@ -45,6 +46,7 @@ class CustomModelViewSet(ModelViewSet, ImportSerializerMixin, ExportSerializerMi
     permission_classes = [CustomPermission]
     import_field_dict = {}
     export_field_label = {}
+    query_budget = None
 
     def filter_queryset(self, queryset):
         for backend in set(set(self.filter_backends) | set(self.extra_filter_class or [])):